@@ -5,6 +5,7 @@ from app.drivers.qodProvisioning import callbacks as qod_provisioning_callbacks
 from app.drivers.reachability_status import callbacks as reachability_status_callbacks
 from app.drivers.roaming_status import callbacks as roaming_status_callbacks
 from app.drivers.quality_on_demand import callbacks as qod_callbacks
+from app.drivers import standing_monitors
 
 router = APIRouter()
 router.include_router(qod_provisioning_callbacks.router)
@@ -12,3 +13,4 @@ router.include_router(qod_callbacks.router)
 router.include_router(geofencing_callbacks.router)
 router.include_router(reachability_status_callbacks.router)
 router.include_router(roaming_status_callbacks.router)
+router.include_router(standing_monitors.router)
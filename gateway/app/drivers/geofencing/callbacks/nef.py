@@ -1,8 +1,8 @@
 import asyncio
 import logging
 from http import HTTPStatus
-from typing import AsyncIterator
-from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import APIRouter, FastAPI
 
@@ -10,54 +10,111 @@ from app.exceptions import ResourceNotFound
 from app.drivers.geofencing.nef import nef_geofencing_subscription_interface
 from app.schemas.geofencing import Subscription
 from app.schemas.nef_schemas.monitoringevent import (
+    GeographicalCoordinates,
     MonitoringNotification,
     SupportedGADShapes,
 )
+from app.utils.notification_coalescer import NotificationCoalescer
 
 LOG = logging.getLogger(__name__)
 
 
+async def _handle_monitor_location(
+    monitor_id: str, reported: tuple[GeographicalCoordinates, str]
+) -> None:
+    point, nef_subscription_url = reported
+
+    await nef_geofencing_subscription_interface.notify_monitor_location(
+        monitor_id, point, nef_subscription_url=nef_subscription_url
+    )
+
+
+async def _handle_location(
+    sub_id: str, reported: tuple[GeographicalCoordinates, str]
+) -> None:
+    point, nef_subscription_url = reported
+
+    subscription: Subscription
+    try:
+        subscription = await nef_geofencing_subscription_interface.get_subscription(
+            sub_id
+        )
+    except ResourceNotFound:
+        LOG.warning("Received notification for non exisiting subscription")
+        return
+
+    await nef_geofencing_subscription_interface.notify_location(
+        subscription, point, nef_subscription_url=nef_subscription_url
+    )
+
+
+# Only the last location of a burst matters, the areas entered and left in
+# between cancel out
+_monitor_coalescer = NotificationCoalescer(
+    "geofencing_monitor", _handle_monitor_location
+)
+_coalescer = NotificationCoalescer("geofencing", _handle_location)
+
+
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await nef_geofencing_subscription_interface.rebuild_subscription_index()
     task = asyncio.create_task(nef_geofencing_subscription_interface.clear_loop())
 
     yield
 
     task.cancel()
+    # Waits for the loop to release its lease
+    with suppress(asyncio.CancelledError):
+        await task
+    await _monitor_coalescer.close()
+    await _coalescer.close()
 
 
 router = APIRouter(lifespan=lifespan)
 
 
-@router.post("/geofencing/{sub_id}", status_code=HTTPStatus.NO_CONTENT)
-async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
-    LOG.debug(notification)
-
+def _reported_point(
+    notification: MonitoringNotification,
+) -> Optional[GeographicalCoordinates]:
     if (
         notification.monitoringEventReports is None
         or notification.monitoringEventReports[0].locationInfo is None
         or notification.monitoringEventReports[0].locationInfo.geographicArea is None
     ):
         LOG.warning("No location details in received notification")
-        return
+        return None
 
     geographicArea = notification.monitoringEventReports[0].locationInfo.geographicArea
     if geographicArea.shape != SupportedGADShapes.POINT:
         LOG.warning("Received shape is not a POINT")
-        return
+        return None
 
-    point = geographicArea.point
-    subscription: Subscription
-    try:
-        subscription = await nef_geofencing_subscription_interface.get_subscription(
-            sub_id
-        )
-    except ResourceNotFound:
-        LOG.warning("Received notification for non exisiting subscription")
+    return geographicArea.point
+
+
+@router.post("/geofencing/monitors/{monitor_id}", status_code=HTTPStatus.NO_CONTENT)
+async def monitor_webhook(
+    monitor_id: str, notification: MonitoringNotification
+) -> None:
+    LOG.debug(notification)
+
+    point = _reported_point(notification)
+    if point is None:
         return
 
-    await nef_geofencing_subscription_interface.notify_location(
-        subscription,
-        point,
-        nef_subscription_url=notification.subscription.unicode_string(),
+    await _monitor_coalescer.submit(
+        monitor_id, (point, notification.subscription.unicode_string())
     )
+
+
+# Used by the subscriptions created before the monitors
+@router.post("/geofencing/{sub_id}", status_code=HTTPStatus.NO_CONTENT)
+async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
+    LOG.debug(notification)
+
+    point = _reported_point(notification)
+    if point is None:
+        return
+
+    await _coalescer.submit(sub_id, (point, notification.subscription.unicode_string()))
@@ -1,11 +1,10 @@
+import uuid
 import logging
 import asyncio
 from enum import Enum
 from typing import Optional, Union
 from datetime import datetime
 
-import geopy
-import geopy.distance
 from fastapi.encoders import jsonable_encoder
 from pydantic import AnyUrl
 
@@ -27,6 +26,7 @@ from app.schemas.geofencing import (
     SubscriptionEnds,
 )
 from app.schemas.subscriptions import (
+    SubscriptionStatus,
     TerminationReason,
 )
 from app.schemas.nef_schemas.monitoringevent import (
@@ -35,7 +35,9 @@ from app.schemas.nef_schemas.monitoringevent import (
     MonitoringType,
 )
 from app.settings import NEFSettings
+from app.utils import device_index, geometry
 from app.utils.nef_driver_base import NefDriverBase
+from app.utils.redis_lease import RedisLock
 from app.utils.subscription_driver_redis import SubscriptionDriverRedis
 
 LOG = logging.getLogger(__name__)
@@ -43,6 +45,48 @@ LOG = logging.getLogger(__name__)
 _prefix_last_state = "geofencing_state"
 _prefix_nef_url = "geofencing_nef_url"
 
+# A monitor is the NEF subscription reporting the location of a device, shared
+# by all the subscriptions for the device
+_prefix_monitor = "geofencing_monitor"
+_prefix_monitor_device = "geofencing_monitor_device"
+_prefix_monitor_nef_url = "geofencing_monitor_nef_url"
+_prefix_monitor_subs = "geofencing_monitor_subs"
+_prefix_monitor_location = "geofencing_monitor_location"
+_prefix_sub_monitor = "geofencing_sub_monitor"
+
+# Moves the subscription to the state in ARGV[1], returning -1 if it was
+# already there or if the change isn't reported, because it's the initial
+# state and ARGV[2] (initialEvent) isn't set or because ARGV[3] (the event
+# type is subscribed) isn't set. Otherwise the event is counted if ARGV[4]
+# (has max events) is set, returning the counter, or 0 if it isn't counted.
+_transition_script = """
+local last = redis.call("GET", KEYS[1])
+if last == ARGV[1] then
+    return -1
+end
+redis.call("SET", KEYS[1], ARGV[1])
+if (not last and ARGV[2] == "0") or ARGV[3] == "0" then
+    return -1
+end
+if ARGV[4] == "1" then
+    return redis.call("INCR", KEYS[2])
+end
+return 0
+"""
+
+# Stores the location in KEYS[2] only if the monitor still has subscriptions
+# in KEYS[1], returning them
+_monitor_location_script = """
+local sub_ids = redis.call("SMEMBERS", KEYS[1])
+if #sub_ids > 0 then
+    redis.call("SET", KEYS[2], ARGV[1])
+end
+return sub_ids
+"""
+
+# Time after which the lock of a monitor is released if its holder crashed
+_monitor_lock_secs = 30
+
 
 class State(Enum):
     INSIDE = "INSIDE"
@@ -85,56 +129,194 @@ class NefGeofencingSubscriptionInterface(
         )
 
         self.notification_url = nef_settings.get_notification_url()
+        self._transition = self.redis.register_script(_transition_script)
+        self._store_monitor_location = self.redis.register_script(
+            _monitor_location_script
+        )
+
+    def get_subscription_device(self, details: SubscriptionDetail) -> Optional[Device]:
+        return details.device
+
+    def get_subscription_area(
+        self, details: SubscriptionDetail
+    ) -> geometry.CircleShape:
+        return geometry.circle(details.area.center, details.area.radius)
 
     async def create_subscription(
         self, req: SubscriptionRequest, device: Device
     ) -> Subscription:
-        # Store subscription
-        req.config.subscriptionDetail.device = device
-        sub = await self.create_gateway_subscription(req)
-
-        try:
-            # Create monitoring event subscription
-            body = MonitoringEventSubscription(
-                ipv6Addr=device.ipv6Address,
-                notificationDestination=AnyUrl(
-                    f"{self.notification_url}/callbacks/v1/geofencing/{sub.id}"
-                ),
-                monitoringType=MonitoringType.LOCATION_REPORTING,
-                monitorExpireTime=req.config.subscriptionExpireTime or datetime.max,
-                immediateRep=req.config.initialEvent,
-            )
+        return await SubscriptionDriverRedis.create_subscription(self, req, device)
 
-            body = self.install_device_identifiers(body, device)
-
-            res = await self.httpx_client.post(
-                f"/3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
-                json=jsonable_encoder(body),
-            )
+    def set_subscription_device(
+        self, details: SubscriptionDetail, device: Device
+    ) -> None:
+        details.device = device
+
+    async def setup_subscription(self, sub: Subscription) -> None:
+        device = sub.config.subscriptionDetail.device
+        assert device is not None
+
+        location = await self._join_monitor(sub.id, device)
+
+        # The monitor was already running, so its last report is used as the
+        # initial location of the new subscription
+        if location is not None:
+            try:
+                await self.notify_device_location([sub], location)
+            except Exception:
+                # The subscription is already part of the monitor, so it's
+                # kept and gets the next report instead
+                LOG.exception("Failed to handle the initial location")
+
+    async def _join_monitor(
+        self, sub_id: str, device: Device
+    ) -> Optional[GeographicalCoordinates]:
+        """
+        Adds the subscription to the monitor of the device, creating the
+        monitor and its NEF subscription if the device doesn't have one.
+
+        Returns the last location reported to the monitor, if any.
+        """
+        device_key = device_index.device_key(device)
+        monitor_key = f"{_prefix_monitor}:{device_key}"
+
+        async with RedisLock(monitor_key, _monitor_lock_secs):
+            monitor_id = await self.redis.get(monitor_key)
+
+            if monitor_id is None:
+                monitor_id = str(uuid.uuid4())
+                subs_key = f"{_prefix_monitor_subs}:{monitor_id}"
+
+                # Stored before creating the NEF subscription so that its
+                # immediate report already reaches the subscription
+                async with self.redis.pipeline(transaction=True) as p:
+                    p.set(monitor_key, monitor_id)
+                    p.set(f"{_prefix_monitor_device}:{monitor_id}", device_key)
+                    p.sadd(subs_key, sub_id)
+                    p.set(f"{_prefix_sub_monitor}:{sub_id}", monitor_id)
+                    await p.execute()
+
+                try:
+                    nef_subscription_url = await self._create_nef_subscription(
+                        monitor_id, device
+                    )
+                except BaseException:
+                    await self.redis.delete(
+                        monitor_key,
+                        f"{_prefix_monitor_device}:{monitor_id}",
+                        subs_key,
+                        f"{_prefix_sub_monitor}:{sub_id}",
+                        f"{_prefix_monitor_location}:{monitor_id}",
+                    )
+                    raise
+
+                await self.redis.set(
+                    f"{_prefix_monitor_nef_url}:{monitor_id}", nef_subscription_url
+                )
 
-            # Check success of monitoring event subscription
-            if not res.is_success:
-                raise ApiException(
-                    message="Error comunicating with the core",
+                return None
+
+            async with self.redis.pipeline(transaction=True) as p:
+                p.sadd(f"{_prefix_monitor_subs}:{monitor_id}", sub_id)
+                p.set(f"{_prefix_sub_monitor}:{sub_id}", monitor_id)
+                p.get(f"{_prefix_monitor_location}:{monitor_id}")
+                *_, location = await p.execute()
+
+        if location is None:
+            return None
+
+        return GeographicalCoordinates.model_validate_json(location)
+
+    async def _leave_monitor(self, sub_id: str) -> bool:
+        """
+        Removes the subscription from the monitor of its device, deleting the
+        monitor and its NEF subscription if it was the last one.
+
+        Returns False if the subscription doesn't belong to a monitor.
+        """
+        monitor_id = await self.redis.get(f"{_prefix_sub_monitor}:{sub_id}")
+        if monitor_id is None:
+            return False
+
+        device_key_key = f"{_prefix_monitor_device}:{monitor_id}"
+        subs_key = f"{_prefix_monitor_subs}:{monitor_id}"
+
+        device_key = await self.redis.get(device_key_key)
+        if device_key is None:
+            # The monitor was already torn down
+            await self.redis.delete(f"{_prefix_sub_monitor}:{sub_id}")
+            return True
+
+        monitor_key = f"{_prefix_monitor}:{device_key}"
+
+        async with RedisLock(monitor_key, _monitor_lock_secs):
+            async with self.redis.pipeline(transaction=True) as p:
+                p.srem(subs_key, sub_id)
+                p.delete(f"{_prefix_sub_monitor}:{sub_id}")
+                p.scard(subs_key)
+                p.get(device_key_key)
+                *_, remaining, locked_device_key = await p.execute()
+
+            # Torn down by another subscription while waiting for the lock
+            if locked_device_key is None:
+                return True
+
+            if remaining != 0:
+                return True
+
+            async with self.redis.pipeline(transaction=True) as p:
+                p.get(f"{_prefix_monitor_nef_url}:{monitor_id}")
+                p.delete(
+                    monitor_key,
+                    device_key_key,
+                    f"{_prefix_monitor_nef_url}:{monitor_id}",
+                    f"{_prefix_monitor_location}:{monitor_id}",
                 )
+                nef_subscription_url, _ = await p.execute()
+
+        if nef_subscription_url is not None:
+            # Schedule the deletion of the NEF subscription
+            asyncio.create_task(self.delete_nef_subscription(nef_subscription_url))
 
-            subscription_result = MonitoringEventSubscription.model_validate_json(
-                res.content
+        return True
+
+    async def _create_nef_subscription(self, monitor_id: str, device: Device) -> str:
+        # Always asks for an immediate report, the subscriptions that don't
+        # want an initial event ignore it
+        body = MonitoringEventSubscription(
+            ipv6Addr=device.ipv6Address,
+            notificationDestination=AnyUrl(
+                f"{self.notification_url}/callbacks/v1/geofencing/monitors/{monitor_id}"
+            ),
+            monitoringType=MonitoringType.LOCATION_REPORTING,
+            monitorExpireTime=datetime.max,
+            immediateRep=True,
+        )
+
+        body = self.install_device_identifiers(body, device)
+
+        res = await self.httpx_client.post(
+            f"/3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
+            json=jsonable_encoder(body),
+        )
+
+        # Check success of monitoring event subscription
+        if not res.is_success:
+            raise ApiException(
+                message="Error comunicating with the core",
             )
 
-            if subscription_result.self is None:
-                LOG.error("No 'self' in monitoring subscription response")
-                raise ApiException(
-                    message="Error comunicating with the core",
-                )
+        subscription_result = MonitoringEventSubscription.model_validate_json(
+            res.content
+        )
 
-            self_key = f"{_prefix_nef_url}:{sub.id}"
-            await self.redis.set(self_key, subscription_result.self.unicode_string())
+        if subscription_result.self is None:
+            LOG.error("No 'self' in monitoring subscription response")
+            raise ApiException(
+                message="Error comunicating with the core",
+            )
 
-            return sub
-        except BaseException as e:
-            await self.permanently_delete_subscription(sub)
-            raise e
+        return subscription_result.self.unicode_string()
 
     async def delete_subscription(
         self,
@@ -153,12 +335,15 @@ class NefGeofencingSubscriptionInterface(
         last_state_key = f"{_prefix_last_state}:{sub_id}"
         nef_url_key = f"{_prefix_nef_url}:{sub_id}"
 
-        if nef_subscription_url is None:
-            nef_subscription_url = await self.redis.get(nef_url_key)
+        # Subscriptions created before the monitors have their own NEF
+        # subscription
+        if not await self._leave_monitor(sub_id):
+            if nef_subscription_url is None:
+                nef_subscription_url = await self.redis.get(nef_url_key)
 
-        if nef_subscription_url is not None:
-            # Schedule the deletion of the NEF subscription
-            asyncio.create_task(self.delete_nef_subscription(nef_subscription_url))
+            if nef_subscription_url is not None:
+                # Schedule the deletion of the NEF subscription
+                asyncio.create_task(self.delete_nef_subscription(nef_subscription_url))
 
         await self.redis.delete(last_state_key, nef_url_key)
 
@@ -173,11 +358,30 @@ class NefGeofencingSubscriptionInterface(
             ),
         )
 
+    async def create_subscriptions(
+        self, req: SubscriptionRequest, devices: list[Device]
+    ) -> list[Subscription | BaseException]:
+        return await SubscriptionDriverRedis.create_subscriptions(self, req, devices)
+
+    async def delete_subscriptions(
+        self, sub_ids: list[str]
+    ) -> list[None | BaseException]:
+        return await SubscriptionDriverRedis.delete_subscriptions(self, sub_ids)
+
     async def get_subscription(self, sub_id: str) -> Subscription:
         return await SubscriptionDriverRedis.get_subscription(self, sub_id)
 
-    async def get_subscriptions(self) -> list[Subscription]:
-        return await SubscriptionDriverRedis.get_subscriptions(self)
+    async def get_subscriptions(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> tuple[list[Subscription], Optional[str]]:
+        return await SubscriptionDriverRedis.get_subscriptions(self, cursor, limit)
+
+    async def get_area_subscriptions(
+        self, latitude: float, longitude: float, radius_m: Optional[float] = None
+    ) -> list[Subscription]:
+        return await SubscriptionDriverRedis.get_area_subscriptions(
+            self, latitude, longitude, radius_m
+        )
 
     async def notify_location(
         self,
@@ -186,61 +390,110 @@ class NefGeofencingSubscriptionInterface(
         *,
         nef_subscription_url: Optional[str] = None,
     ) -> None:
-        """Returns bool indicating whether the subscription was deleted or not."""
-        device_location = geopy.Point(latitude=location.lat, longitude=location.lon)
-
-        geofencing_area = subscription.config.subscriptionDetail.area
-        center = geopy.Point(
-            latitude=geofencing_area.center.latitude,
-            longitude=geofencing_area.center.longitude,
+        await self.notify_device_location(
+            [subscription], location, nef_subscription_url=nef_subscription_url
         )
 
-        radius = geofencing_area.radius
-        distance = geopy.distance.geodesic(center, device_location).m
+    async def notify_monitor_location(
+        self,
+        monitor_id: str,
+        location: GeographicalCoordinates,
+        *,
+        nef_subscription_url: Optional[str] = None,
+    ) -> None:
+        """
+        Handles a location reported to the monitor of a device, updating all
+        the subscriptions of the device.
+        """
+        sub_ids = await self._store_monitor_location(
+            keys=[
+                f"{_prefix_monitor_subs}:{monitor_id}",
+                f"{_prefix_monitor_location}:{monitor_id}",
+            ],
+            args=[location.model_dump_json()],
+        )
 
-        state: State
-        if distance < radius:
-            state = State.INSIDE
-        elif distance > radius:
-            state = State.OUTSIDE
-        else:
+        if len(sub_ids) == 0:
+            LOG.warning("Received notification for non existing monitor")
+            if nef_subscription_url is not None:
+                asyncio.create_task(self.delete_nef_subscription(nef_subscription_url))
             return
 
-        await self._handle_area(subscription, state, nef_subscription_url)
+        results = await self.redis.mget(
+            [f"{self.sub_prefix}:{sub_id}" for sub_id in sub_ids]
+        )
+        subscriptions = [
+            sub
+            for sub in (
+                SubscriptionTypeAdapter.validate_json(result)
+                for result in results
+                if result is not None
+            )
+            if sub.status == SubscriptionStatus.ACTIVE
+        ]
 
-    async def _handle_area(
+        await self.notify_device_location(subscriptions, location)
+
+    async def notify_device_location(
         self,
-        subscription: Subscription,
-        state: State,
-        nef_subscription_url: Optional[str],
+        subscriptions: list[Subscription],
+        location: GeographicalCoordinates,
+        *,
+        nef_subscription_url: Optional[str] = None,
     ) -> None:
-        LOG.debug("Device %s area", state)
-
-        key = f"{_prefix_last_state}:{subscription.id}"
-        last_state = await self.redis.get(key)
-
-        if last_state == state.value:
-            return
+        """
+        Handles a location reported for the device of all `subscriptions`, the
+        areas of the subscriptions are evaluated together.
+        """
+        areas = [
+            self.get_subscription_area(subscription.config.subscriptionDetail)
+            for subscription in subscriptions
+        ]
 
-        await self.redis.set(key, state.value)
+        # The state transitions of all the subscriptions are done in a single
+        # round trip, each one atomically with the counting of its event
+        reports = []
+        async with self.redis.pipeline(transaction=False) as p:
+            for subscription, inside in zip(
+                subscriptions, geometry.classify(areas, location.lat, location.lon)
+            ):
+                if inside is None:
+                    continue
+
+                state = State.INSIDE if inside else State.OUTSIDE
+                sub_event_type, _, _ = _handle_state_details[state]
+                await self._transition(
+                    keys=[
+                        f"{_prefix_last_state}:{subscription.id}",
+                        f"{self.counter_prefix}:{subscription.id}",
+                    ],
+                    args=[
+                        state.value,
+                        int(bool(subscription.config.initialEvent)),
+                        int(sub_event_type in subscription.types),
+                        int(subscription.config.subscriptionMaxEvents is not None),
+                    ],
+                    client=p,
+                )
+                reports.append((subscription, state))
 
-        if last_state is None and not subscription.config.initialEvent:
-            return
+            results = await p.execute()
 
-        sub_event_type, notif_event_type, notif_data_class = _handle_state_details[
-            state
-        ]
+        for (subscription, state), events in zip(reports, results):
+            if events == -1:
+                continue
 
-        if sub_event_type not in subscription.types:
-            return
+            LOG.debug("Device %s area", state)
 
-        await self.send_report(
-            subscription,
-            notif_event_type,
-            notif_data_class(
-                device=subscription.config.subscriptionDetail.device,
-                area=subscription.config.subscriptionDetail.area,
-                subscriptionId=subscription.id,
-            ),
-            nef_subscription_url=nef_subscription_url,
-        )
+            _, notif_event_type, notif_data_class = _handle_state_details[state]
+            await self.send_counted_report(
+                subscription,
+                notif_event_type,
+                notif_data_class(
+                    device=subscription.config.subscriptionDetail.device,
+                    area=subscription.config.subscriptionDetail.area,
+                    subscriptionId=subscription.id,
+                ),
+                events if events != 0 else None,
+                nef_subscription_url=nef_subscription_url,
+            )
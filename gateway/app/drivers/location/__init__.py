@@ -14,7 +14,7 @@ if settings.location.backend == LocationBackend.Mock:
 elif settings.location.backend == LocationBackend.Nef:
     from .nef import NEFDriver
 
-    location_interface = NEFDriver(settings.location.nef)
+    location_interface = NEFDriver(settings.location)
 
 
 async def get_location_driver() -> LocationInterface:
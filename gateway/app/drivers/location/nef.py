@@ -1,31 +1,157 @@
+import time
+import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
-import httpx
 from fastapi import HTTPException
 
-from app.drivers.nef_auth import NEFAuth
+from app.drivers.nef_auth import get_nef_client
 from app.interfaces.location import LocationInterface
 from app.schemas.common import Point
 from app.schemas.device import Device
 from app.schemas.location import Circle, Location, Polygon
-from app.settings import NEFSettings
+from app.schemas.nef_schemas.monitoringevent import (
+    MonitoringEventSubscription,
+    MonitoringType,
+    SupportedGADShapes,
+)
+from app.settings import NEFLocationSettings
+from app.utils.device_index import device_key
+from app.utils.standing_monitors import StandingMonitors, StandingReport
+
+_subscriptions_path = "/3gpp-monitoring-event/v1/myNetApp/subscriptions"
+
+
+def _device_query(device: Device) -> tuple[str, str]:
+    """
+    Returns the field and value identifying the device in the NEF request.
+    """
+    if device.phoneNumber is not None:
+        return ("msisdn", device.phoneNumber.lstrip("+"))
+    elif device.ipv4Address is not None:
+        return ("ipv4Addr", str(device.ipv4Address.publicAddress))
+    elif device.ipv6Address is not None:
+        return ("ipv6Addr", str(device.ipv6Address))
+    elif device.networkAccessIdentifier is not None:
+        return ("externalId", device.networkAccessIdentifier)
+
+    return ("", "")
+
+
+def _standing_location(
+    standing: StandingReport, max_age: Optional[int]
+) -> Optional[Location]:
+    """
+    Returns the location reported to a standing subscription, if it's a point
+    reported recently enough for `max_age`.
+    """
+    age = (datetime.now(timezone.utc) - standing.received_at).total_seconds()
+    if max_age is not None and age > max_age:
+        return None
+
+    location_info = standing.report.locationInfo
+    if location_info is None or location_info.geographicArea is None:
+        return None
+
+    area = location_info.geographicArea
+    if area.shape != SupportedGADShapes.POINT:
+        return None
+
+    return Location(
+        lastLocationTime=standing.received_at,
+        area=Circle(
+            center=Point(latitude=area.point.lat, longitude=area.point.lon),
+            radius=10,
+        ),
+    )
 
 
 class NEFDriver(LocationInterface):
-    def __init__(self, nef_settings: NEFSettings) -> None:
+    """
+    Retrieves the location with one time location reporting subscriptions.
+
+    Concurrent requests for the same device share a single NEF request, and
+    the locations are kept for `cache_secs` to answer the requests whose
+    `maxAge` accepts them without asking the NEF again. The devices queried
+    often get a standing subscription whose last report answers the queries.
+    """
+
+    def __init__(self, location_settings: NEFLocationSettings) -> None:
         super().__init__()
-        nef_auth = NEFAuth(
-            nef_settings.url, nef_settings.username, nef_settings.password
-        )
-        self.httpx_client = httpx.AsyncClient(
-            base_url=nef_settings.get_base_url(), auth=nef_auth
+        self.httpx_client = get_nef_client(location_settings.nef)
+        self.settings = location_settings
+        self.standing_monitors = StandingMonitors(
+            "location", location_settings.nef, _subscriptions_path
         )
 
+        # Insertion ordered, so the first entry is the oldest
+        self._cache: dict[str, tuple[float, Location]] = {}
+        self._in_flight: dict[str, asyncio.Task[Location]] = {}
+
     async def retrieve_location(
         self, device: Device, max_age: Optional[int], max_surface: Optional[int]
     ) -> Location:
+        key = device_key(device)
+
+        cached = self._cached_location(key, max_age)
+        if cached is not None:
+            return cached
+
+        field, value = _device_query(device)
+        standing = await self.standing_monitors.lookup(
+            key,
+            MonitoringEventSubscription.model_validate(
+                {
+                    "monitoringType": MonitoringType.LOCATION_REPORTING,
+                    "notificationDestination": "https://0.0.0.0",
+                    "maximumNumberOfReports": 1,
+                    field: value,
+                }
+            ),
+        )
+        if standing is not None:
+            location = _standing_location(standing, max_age)
+            if location is not None:
+                return location
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_location(key, device))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shielded so that a cancelled request doesn't cancel the others
+        return await asyncio.shield(task)
+
+    def _cached_location(self, key: str, max_age: Optional[int]) -> Optional[Location]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        fetched_at, location = entry
+        age = time.monotonic() - fetched_at
+        if age >= self.settings.cache_secs:
+            del self._cache[key]
+            return None
+
+        # No maxAge means that any age is accepted
+        if max_age is not None and age > max_age:
+            return None
+
+        return location
+
+    def _cache_location(self, key: str, location: Location) -> None:
+        if self.settings.cache_secs == 0:
+            return
+
+        self._cache.pop(key, None)
+        self._cache[key] = (time.monotonic(), location)
+
+        while len(self._cache) > self.settings.cache_size:
+            del self._cache[next(iter(self._cache))]
+
+    async def _fetch_location(self, key: str, device: Device) -> Location:
         data = {
             "monitoringType": "LOCATION_REPORTING",
             "notificationDestination": "https://0.0.0.0",
@@ -33,16 +159,11 @@ class NEFDriver(LocationInterface):
             "locationType": "LAST_KNOWN_LOCATION",
         }
 
-        if device.phoneNumber is not None:
-            data["msisdn"] = device.phoneNumber.lstrip("+")
-        elif device.ipv4Address is not None:
-            data["ipv4Addr"] = str(device.ipv4Address.publicAddress)
-        elif device.ipv6Address is not None:
-            data["ipv6Addr"] = str(device.ipv6Address)
-        elif device.networkAccessIdentifier is not None:
-            data["externalId"] = device.networkAccessIdentifier
+        field, value = _device_query(device)
+        if field != "":
+            data[field] = value
 
-        url = "/3gpp-monitoring-event/v1/myNetApp/subscriptions"
+        url = _subscriptions_path
 
         logging.debug("Querying the NEF Emulator at %s with data %s", url, data)
 
@@ -53,20 +174,28 @@ class NEFDriver(LocationInterface):
 
         area = doc.json().get("locationInfo").get("geographicArea")
 
+        location: Location
         if area["shape"] == "POINT":
             point = area["point"]
-            return Location(
-                lastLocationTime=datetime.now(),
+            location = Location(
+                lastLocationTime=datetime.now(timezone.utc),
                 area=Circle(
                     center=Point(latitude=point["lat"], longitude=point["lon"]),
                     radius=10,
                 ),
             )
-
-        if area["shape"] == "POLYGON":
-            return Location(
-                lastLocationTime=datetime.now(),
-                area=Polygon(boundary=area["pointList"]),
+        elif area["shape"] == "POLYGON":
+            location = Location(
+                lastLocationTime=datetime.now(timezone.utc),
+                area=Polygon(
+                    boundary=[
+                        Point(latitude=point["lat"], longitude=point["lon"])
+                        for point in area["pointList"]
+                    ]
+                ),
             )
+        else:
+            raise HTTPException(status_code=501, detail="Area response not supported")
 
-        raise HTTPException(status_code=501, detail="Area response not supported")
+        self._cache_location(key, location)
+        return location
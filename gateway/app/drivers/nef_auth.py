@@ -1,42 +1,141 @@
+import json
+import time
+import base64
+import asyncio
 import logging
-from typing import Generator, Optional
+from typing import AsyncGenerator, Optional
 
 import httpx
 from pydantic import AnyHttpUrl
 
+from app.metrics import InstrumentedTransport
+from app.redis import get_redis
+from app.settings import NEFAuthSettings, NEFSettings, settings
+
 LOG = logging.getLogger(__name__)
 
+_prefix_token = "neftoken"
+
+
+def _token_expiry(token: str) -> Optional[float]:
+    """
+    Returns the `exp` claim of a JWT bearer token, the signature isn't checked
+    since the token is only used to know when to request a new one.
+    """
+    try:
+        payload = token.removeprefix("Bearer ").split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
 
 class NEFAuth(httpx.Auth):
-    requires_response_body = True
+    """
+    Logs in to the NEF and adds the access token to the requests.
+
+    The token is refreshed shortly before it expires and whenever the NEF
+    answers with a 401. The refresh happens under a lock, so concurrent
+    requests wait for a single login instead of each sending their own.
+    When `share_tokens` is enabled the token is also stored in redis so that
+    the other replicas can reuse it.
+    """
 
     def __init__(
-        self, nef_url: AnyHttpUrl, nef_username: str, nef_password: str
+        self,
+        nef_url: AnyHttpUrl,
+        nef_username: str,
+        nef_password: str,
+        auth_settings: NEFAuthSettings = settings.nef_auth,
     ) -> None:
         self.nef_url = str(nef_url).rstrip("/")
         self.nef_username = nef_username
         self.nef_password = nef_password
+        self.settings = auth_settings
 
         self.current_token: Optional[str] = None
+        self.expires_at: Optional[float] = None
+
+        self.redis = get_redis()
+        self.token_key = f"{_prefix_token}:{self.nef_url}:{self.nef_username}"
 
-    def auth_flow(
+        self._lock = asyncio.Lock()
+
+    async def async_auth_flow(
         self, request: httpx.Request
-    ) -> Generator[httpx.Request, httpx.Response, None]:
-        token = self.current_token
+    ) -> AsyncGenerator[httpx.Request, httpx.Response]:
+        token = self.fresh_token()
         if token is None:
-            res = yield self.build_login_request()
-            token = self.update_token(res)
+            async with self._lock:
+                token = await self.cached_token(stale=None)
+                if token is None:
+                    res = yield self.build_login_request()
+                    token = await self.update_token(res)
 
         request.headers["Authorization"] = token
         res = yield request
 
         if res.status_code == 401:
-            res = yield self.build_login_request()
-            token = self.update_token(res)
+            async with self._lock:
+                # Another request might have already replaced the rejected token
+                new_token = await self.cached_token(stale=token)
+                if new_token is None:
+                    res = yield self.build_login_request()
+                    new_token = await self.update_token(res)
 
-            request.headers["Authorization"] = token
+            request.headers["Authorization"] = new_token
             yield request
 
+    def fresh_token(self) -> Optional[str]:
+        if self.current_token is None:
+            return None
+
+        if (
+            self.expires_at is not None
+            and time.time() >= self.expires_at - self.settings.refresh_margin_secs
+        ):
+            return None
+
+        return self.current_token
+
+    async def cached_token(self, stale: Optional[str]) -> Optional[str]:
+        """
+        Returns a token that is still valid and isn't `stale`, either from
+        this process or from the ones shared by the other replicas.
+        """
+        token = self.fresh_token()
+        if token is not None and token != stale:
+            return token
+
+        if not self.settings.share_tokens:
+            return None
+
+        try:
+            shared: Optional[str] = await self.redis.get(self.token_key)
+        except Exception as e:
+            LOG.warning("Failed to get the shared NEF token: %s", e)
+            return None
+
+        if shared is None or shared == stale:
+            return None
+
+        self.set_token(shared)
+        return self.fresh_token()
+
+    async def ensure_token(self, client: httpx.AsyncClient) -> None:
+        """
+        Logs in with `client` unless there is already a valid token.
+        """
+        if self.fresh_token() is not None:
+            return
+
+        async with self._lock:
+            if await self.cached_token(stale=None) is not None:
+                return
+
+            res = await client.send(self.build_login_request(), auth=None)
+            await self.update_token(res)
+
     def build_login_request(self) -> httpx.Request:
         LOG.debug("Building login request")
         return httpx.Request(
@@ -48,17 +147,93 @@ class NEFAuth(httpx.Auth):
             },
         )
 
-    def update_token(self, res: httpx.Response) -> str:
+    def set_token(self, token: str) -> None:
+        self.current_token = token
+        self.expires_at = _token_expiry(token)
+
+    async def update_token(self, res: httpx.Response) -> str:
         LOG.debug("Updating token from login response")
 
+        await res.aread()
+
         if not res.is_success:
             LOG.error(
-                "Login response is not successfull ({}): {}",
+                "Login response is not successfull (%d): %s",
                 res.status_code,
                 res.content,
             )
             raise RuntimeError("Failed to login to NEF")
 
         token = f"Bearer {res.json()['access_token']}"
-        self.current_token = token
+        self.set_token(token)
+
+        if self.settings.share_tokens:
+            ttl = None
+            if self.expires_at is not None:
+                ttl = max(int((self.expires_at - time.time()) * 1000), 1)
+
+            try:
+                await self.redis.set(self.token_key, token, px=ttl)
+            except Exception as e:
+                LOG.warning("Failed to share the NEF token: %s", e)
+
         return token
+
+
+_nef_auths: dict[tuple[str, str], NEFAuth] = {}
+_nef_clients: dict[tuple[str, str, str], httpx.AsyncClient] = {}
+
+
+def _get_nef_auth(nef_settings: NEFSettings) -> NEFAuth:
+    auth_key = (str(nef_settings.url).rstrip("/"), nef_settings.username)
+    auth = _nef_auths.get(auth_key)
+    if auth is None:
+        auth = NEFAuth(nef_settings.url, nef_settings.username, nef_settings.password)
+        _nef_auths[auth_key] = auth
+
+    return auth
+
+
+def get_nef_client(
+    nef_settings: NEFSettings, base_url: Optional[str] = None
+) -> httpx.AsyncClient:
+    """
+    Returns the client used to reach the NEF at `base_url`, which defaults
+    to the base url of the settings.
+
+    The clients are shared by every driver, and all the clients of the same
+    NEF user share the same token.
+    """
+    nef_url = str(nef_settings.url).rstrip("/")
+    if base_url is None:
+        base_url = nef_settings.get_base_url()
+
+    auth = _get_nef_auth(nef_settings)
+
+    client_key = (base_url, nef_url, nef_settings.username)
+    client = _nef_clients.get(client_key)
+    if client is None:
+        transport = InstrumentedTransport(
+            "nef", httpx.AsyncHTTPTransport(), base_path=httpx.URL(base_url).path
+        )
+        client = httpx.AsyncClient(base_url=base_url, auth=auth, transport=transport)
+        _nef_clients[client_key] = client
+
+    return client
+
+
+async def check_nef_login(nef_settings: NEFSettings) -> None:
+    """
+    Makes sure that the gateway holds a valid token for the NEF, logging in if
+    needed. Raises if the NEF can't be reached or rejects the credentials.
+    """
+    client = get_nef_client(nef_settings)
+    await _get_nef_auth(nef_settings).ensure_token(client)
+
+
+async def close_nef_clients() -> None:
+    clients = list(_nef_clients.values())
+    _nef_clients.clear()
+
+    for client in clients:
+        await client.aclose()
@@ -9,6 +9,7 @@ from app.interfaces.otp import (
     OTPNotFoundError,
     OTPTooManyAttemptsError,
 )
+from app.metrics import instrumented
 
 
 @dataclass
@@ -22,6 +23,7 @@ _storage: dict[str, OTPCell] = {}
 
 
 class MemoryOTPInterface(OTPInterface):
+    @instrumented("otp", "store")
     async def store_otp(
         self,
         authentication_id: str,
@@ -35,6 +37,7 @@ class MemoryOTPInterface(OTPInterface):
             expires_at=datetime.now() + timedelta(seconds=expires_secs),
         )
 
+    @instrumented("otp", "verify")
     async def verify_otp(self, authentication_id: str, code: str) -> None:
         data = _storage.get(authentication_id)
         if data is None:
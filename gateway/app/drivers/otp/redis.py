@@ -3,6 +3,7 @@ import logging
 from redis.asyncio import WatchError
 
 from app.redis import get_redis
+from app.metrics import instrumented
 from app.interfaces.otp import (
     OTPInterface,
     OTPInvalidCodeError,
@@ -15,6 +16,7 @@ LOG = logging.getLogger(__name__)
 
 
 class RedisOTPInterface(OTPInterface):
+    @instrumented("otp", "store")
     async def store_otp(
         self,
         authentication_id: str,
@@ -40,6 +42,7 @@ class RedisOTPInterface(OTPInterface):
         await p.expire(key, expires_secs)
         await p.execute()
 
+    @instrumented("otp", "verify")
     async def verify_otp(self, authentication_id: str, code: str) -> None:
         redis = get_redis()
 
@@ -1,9 +1,20 @@
+from typing import AsyncIterator
+from contextlib import asynccontextmanager
+
 from app.schemas.nef_schemas.afSessionWithQos import UserPlaneNotificationData
-from fastapi import APIRouter
+from fastapi import APIRouter, FastAPI
 
 from app.drivers.qodProvisioning.nef import nef_qod_provisioning_interface
 
-router = APIRouter()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await nef_qod_provisioning_interface.migrate_device_keys()
+
+    yield
+
+
+router = APIRouter(lifespan=lifespan)
 
 
 @router.post("/qos/{provisioning_id}")
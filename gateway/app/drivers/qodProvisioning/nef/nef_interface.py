@@ -2,10 +2,11 @@ import datetime
 import logging
 import uuid
 
-import httpx
+from fastapi.encoders import jsonable_encoder
 
 from app.exceptions import ResourceNotFound
-from app.drivers.nef_auth import NEFAuth
+from app.drivers.nef_auth import get_nef_client
+from app.drivers.qos_profiles.nef import get_qos_profiles_cache
 from app.interfaces.qodProvisioning import (
     ProvisioningConflict,
     QoDProvisioningInterface,
@@ -36,10 +37,13 @@ from app.schemas.qodProvisioning import (
     StatusInfo,
 )
 from app.settings import NEFSettings
+from app.utils.device_index import DeviceIndex
+from app.utils.webhook_delivery import get_webhook_delivery
 
 _prefix_info = "qodprovisioninginfo"
 _prefix_gateway_nef = "qodprovisioningnef"
-_prefix_device = "qodDevice"
+# Provisioning id per device identifier, replaced by the device index
+_prefix_legacy_device = "qodDevice"
 LOG = logging.getLogger(__name__)
 
 
@@ -47,23 +51,22 @@ class NEFQoDProvisioningInterface(QoDProvisioningInterface):
     def __init__(self, nef_settings: NEFSettings, source: str) -> None:
         super().__init__()
 
-        nef_auth = NEFAuth(
-            nef_settings.url, nef_settings.username, nef_settings.password
-        )
-        self.httpx_client = httpx.AsyncClient(
-            base_url=nef_settings.get_base_url(), auth=nef_auth
-        )
-        self.httpx_client_callback = httpx.AsyncClient()
+        self.httpx_client = get_nef_client(nef_settings)
+        self.qos_profiles = get_qos_profiles_cache(nef_settings)
+        self.webhook_delivery = get_webhook_delivery()
 
         self.af_id = nef_settings.gateway_af_id
         self.source = source
         self.notification_url = nef_settings.get_notification_url()
 
         self.redis = get_redis()
+        self.device_index = DeviceIndex("qodprovisioning")
 
     async def create_provisioning(
         self, req: TriggerProvisioning, device: Device
     ) -> ProvisioningInfo:
+        await self.qos_profiles.validate_profile(req.qosProfile)
+
         provisioning_id = uuid.uuid4()
 
         payload = AsSessionWithQoSSubscription(
@@ -120,24 +123,10 @@ class NEFQoDProvisioningInterface(QoDProvisioningInterface):
 
         await self._save_subscription_info(str(provisioning_id), response)
 
-        key = f"{_prefix_gateway_nef}:{str(provisioning_id)}"
-        await self.redis.set(key, nef_sub_id)
-
-        if device.phoneNumber:
-            key = f"{_prefix_device}:{device.phoneNumber}"
-            await self.redis.set(key, str(provisioning_id))
-        if device.networkAccessIdentifier:
-            key = f"{_prefix_device}:{device.networkAccessIdentifier}"
-            await self.redis.set(key, str(provisioning_id))
-        if device.ipv4Address and device.ipv4Address.privateAddress:
-            key = f"{_prefix_device}:{device.ipv4Address.privateAddress}"
-            await self.redis.set(key, str(provisioning_id))
-        if device.ipv4Address and device.ipv4Address.publicPort:
-            key = f"{_prefix_device}:{device.ipv4Address.publicAddress}:{device.ipv4Address.publicPort}"
-            await self.redis.set(key, str(provisioning_id))
-        if device.ipv6Address:
-            key = f"{_prefix_device}:{device.ipv6Address.exploded}"
-            await self.redis.set(key, str(provisioning_id))
+        async with self.redis.pipeline(transaction=True) as p:
+            p.set(f"{_prefix_gateway_nef}:{str(provisioning_id)}", nef_sub_id)
+            self.device_index.add(p, device, str(provisioning_id))
+            await p.execute()
 
         return response
 
@@ -171,30 +160,30 @@ class NEFQoDProvisioningInterface(QoDProvisioningInterface):
         return sub_info
 
     async def get_qod_information_device(self, device: Device) -> ProvisioningInfo:
-        id = ""
-
-        if device.phoneNumber:
-            key = f"{_prefix_device}:{device.phoneNumber}"
-            id = await self.redis.get(key)
-        elif device.networkAccessIdentifier:
-            key = f"{_prefix_device}:{device.networkAccessIdentifier}"
-            id = await self.redis.get(key)
-        elif device.ipv4Address and device.ipv4Address.privateAddress:
-            key = f"{_prefix_device}:{device.ipv4Address.privateAddress}"
-            id = await self.redis.get(key)
-        elif device.ipv4Address and device.ipv4Address.publicPort:
-            key = f"{_prefix_device}:{device.ipv4Address.publicAddress}:{device.ipv4Address.publicPort}"
-            id = await self.redis.get(key)
-        elif device.ipv6Address:
-            key = f"{_prefix_device}:{device.ipv6Address.exploded}"
-            id = await self.redis.get(key)
-
-        if id == "" or id is None:
+        ids = await self.device_index.lookup(device)
+        if len(ids) == 0:
             raise ResourceNotFound()
 
-        sub_info = await self.get_qod_information_by_id(id)
+        data = await self.redis.mget([f"{_prefix_info}:{id}" for id in ids])
 
-        return sub_info
+        provisionings = [
+            ProvisioningInfo.model_validate_json(info_data)
+            for info_data in data
+            if info_data is not None
+        ]
+        provisionings = [
+            info for info in provisionings if info.status != Status.UNAVAILABLE
+        ]
+
+        if len(provisionings) == 0:
+            raise ResourceNotFound()
+
+        # A device has a single provisioning, but there might be more than one
+        # briefly while one is replaced by another
+        return max(
+            provisionings,
+            key=lambda info: info.startedAt or datetime.datetime.min,
+        )
 
     async def send_callback_message(
         self, body: UserPlaneNotificationData, id: str
@@ -235,8 +224,8 @@ class NEFQoDProvisioningInterface(QoDProvisioningInterface):
         if sink is None:
             raise ResourceNotFound()
 
-        await self.httpx_client_callback.post(
-            str(sink), content=cloud_event.model_dump_json(exclude_unset=True)
+        await self.webhook_delivery.deliver(
+            str(sink), jsonable_encoder(cloud_event, exclude_unset=True)
         )
 
         await self._save_subscription_info(id, sub_info)
@@ -254,7 +243,52 @@ class NEFQoDProvisioningInterface(QoDProvisioningInterface):
                 status = Status.AVAILABLE
         return status
 
+    async def migrate_device_keys(self) -> None:
+        """
+        Adds the provisionings referenced by the device keys written before
+        the device index was introduced to it, deleting the keys. The QoD
+        sessions used the same prefix for lists, which are left alone.
+        """
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis.scan(
+                cursor, match=f"{_prefix_legacy_device}:*", count=1000, _type="string"
+            )
+
+            if len(keys) != 0:
+                ids = [id for id in await self.redis.mget(keys) if id is not None]
+                results = (
+                    await self.redis.mget([f"{_prefix_info}:{id}" for id in ids])
+                    if len(ids) != 0
+                    else []
+                )
+
+                async with self.redis.pipeline(transaction=True) as p:
+                    for id, result in zip(ids, results):
+                        if result is None:
+                            continue
+
+                        info = ProvisioningInfo.model_validate_json(result)
+                        if (
+                            info.status != Status.UNAVAILABLE
+                            and info.device is not None
+                        ):
+                            self.device_index.add(p, info.device, id)
+
+                    p.delete(*keys)
+                    await p.execute()
+
+            if cursor == 0:
+                break
+
     async def _save_subscription_info(self, id: str, data: ProvisioningInfo) -> None:
         key = f"{_prefix_info}:{id}"
 
-        await self.redis.set(key, data.model_dump_json(exclude_unset=True))
+        async with self.redis.pipeline(transaction=True) as p:
+            p.set(key, data.model_dump_json(exclude_unset=True))
+
+            # Provisionings that ended are no longer returned for the device
+            if data.status == Status.UNAVAILABLE and data.device is not None:
+                self.device_index.remove(p, data.device, id)
+
+            await p.execute()
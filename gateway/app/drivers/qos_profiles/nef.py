@@ -1,11 +1,14 @@
-from typing import List
+import time
+import asyncio
+import logging
+from typing import List, Optional
 
 import math
-import httpx
 from pydantic import TypeAdapter
 
-from app.drivers.nef_auth import NEFAuth
-from app.interfaces.qos_profiles import QoSProfilesInterface
+from app.drivers.nef_auth import get_nef_client
+from app.interfaces.qos_profiles import QoSProfileNotFound, QoSProfilesInterface
+from app.redis import get_redis
 from app.schemas.nef import NEFNamedQoSProfile, NEFQoSProfile
 from app.schemas.qos_profiles import (
     Duration,
@@ -16,7 +19,13 @@ from app.schemas.qos_profiles import (
     RateUnitEnum,
     TimeUnitEnum,
 )
-from app.settings import NEFSettings
+from app.settings import NEFSettings, QoSProfilesCacheSettings, settings
+
+LOG = logging.getLogger(__name__)
+
+_prefix_profiles = "qosprofiles"
+
+_profiles_adapter = TypeAdapter(List[NEFNamedQoSProfile])
 
 
 def _calculate_rates_table() -> List[tuple[int, RateUnitEnum]]:
@@ -63,42 +72,144 @@ def _convert_nef_profile(name: str, nef_profile: NEFQoSProfile) -> QosProfile:
     return profile
 
 
-class NefQoSProfilesInterface(QoSProfilesInterface):
-    def __init__(self, nef_settings: NEFSettings) -> None:
-        super().__init__()
-
-        nef_auth = NEFAuth(
-            nef_settings.url, nef_settings.username, nef_settings.password
-        )
-        self.httpx_client = httpx.AsyncClient(
-            base_url=str(nef_settings.url), auth=nef_auth
-        )
-
-    async def get_qos_profiles(self, req: QosProfileDeviceRequest) -> List[QosProfile]:
-        if req.name is not None:
-            res = await self.httpx_client.get(
-                f"/api/v1/qosInfo/qosCharacteristics/{req.name}"
-            )
-
-            if res.status_code == 404:
-                return []
+def _log_refresh_failure(task: asyncio.Task[None]) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        LOG.warning("Failed to refresh the QoS profiles: %s", task.exception())
+
+
+class QoSProfilesCache:
+    """
+    Keeps the QoS profiles of a NEF in memory, converted to the CAMARA schema.
+
+    The profiles are fetched when first needed and again once they are older
+    than `ttl_secs`. For `stale_secs` after that the old profiles are still
+    returned while a single background request refreshes them. When
+    `use_redis` is enabled the response of the NEF is also kept in redis, so
+    that the other replicas don't need to fetch it.
+    """
+
+    def __init__(
+        self,
+        nef_settings: NEFSettings,
+        cache_settings: QoSProfilesCacheSettings = settings.qos_profiles_cache,
+    ) -> None:
+        self.httpx_client = get_nef_client(nef_settings, base_url=str(nef_settings.url))
+        self.settings = cache_settings
+
+        self.redis = get_redis()
+        self.redis_key = f"{_prefix_profiles}:{str(nef_settings.url).rstrip('/')}"
+
+        self._profiles: Optional[dict[str, QosProfile]] = None
+        self._fetched_at = 0.0
+        self._refresh_task: Optional[asyncio.Task[None]] = None
+
+    async def get_profiles(self) -> dict[str, QosProfile]:
+        age = time.monotonic() - self._fetched_at
+        if self._profiles is not None and age < self.settings.ttl_secs:
+            return self._profiles
+
+        refresh = self._refresh()
+        if (
+            self._profiles is not None
+            and age < self.settings.ttl_secs + self.settings.stale_secs
+        ):
+            return self._profiles
+
+        # Shielded so that a cancelled request doesn't cancel the refresh
+        # other requests are waiting for
+        await asyncio.shield(refresh)
+        assert self._profiles is not None
+        return self._profiles
+
+    async def validate_profile(self, name: str) -> None:
+        """
+        Raises `QoSProfileNotFound` if the NEF doesn't have the profile `name`.
+
+        If the profiles can't be fetched the check is skipped, leaving it to
+        the NEF when the profile is used.
+        """
+        try:
+            profiles = await self.get_profiles()
+        except Exception as e:
+            LOG.warning("Skipping the validation of QoS profile %s: %s", name, e)
+            return
+
+        if name not in profiles:
+            raise QoSProfileNotFound()
+
+    def _refresh(self) -> asyncio.Task[None]:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+            self._refresh_task.add_done_callback(_log_refresh_failure)
+
+        return self._refresh_task
+
+    async def _fetch(self) -> None:
+        ttl_ms = int(self.settings.ttl_secs * 1000)
+        content: Optional[str] = None
+        age_ms = 0
+
+        if self.settings.use_redis:
+            try:
+                async with self.redis.pipeline(transaction=False) as p:
+                    p.get(self.redis_key)
+                    p.pttl(self.redis_key)
+                    content, remaining_ms = await p.execute()
+                    if content is not None:
+                        age_ms = max(ttl_ms - remaining_ms, 0)
+            except Exception as e:
+                LOG.warning("Failed to get the shared QoS profiles: %s", e)
+
+        if content is None:
+            res = await self.httpx_client.get("/api/v1/qosInfo/qosCharacteristics")
 
             if not res.is_success:
                 raise Exception(
                     f"Expected succesful response, got {res.status_code}: {res.text}"
                 )
 
-            nef_profile = NEFQoSProfile.model_validate_json(res.content)
-            return [_convert_nef_profile(req.name, nef_profile)]
-        else:
-            res = await self.httpx_client.get("/api/v1/qosInfo/qosCharacteristics")
+            content = res.text
 
-            if not res.is_success:
-                raise Exception(
-                    f"Expected succesful response, got {res.status_code}: {res.text}"
-                )
+            if self.settings.use_redis:
+                try:
+                    await self.redis.set(self.redis_key, content, px=ttl_ms)
+                except Exception as e:
+                    LOG.warning("Failed to share the QoS profiles: %s", e)
+
+        profiles = _profiles_adapter.validate_json(content)
+        self._profiles = {
+            prof.name: _convert_nef_profile(prof.name, prof) for prof in profiles
+        }
+        self._fetched_at = time.monotonic() - age_ms / 1000
+
+
+_caches: dict[tuple[str, str], QoSProfilesCache] = {}
+
+
+def get_qos_profiles_cache(nef_settings: NEFSettings) -> QoSProfilesCache:
+    """
+    Returns the cache of the QoS profiles of the NEF, shared by every driver.
+    """
+    key = (str(nef_settings.url).rstrip("/"), nef_settings.username)
+    cache = _caches.get(key)
+    if cache is None:
+        cache = QoSProfilesCache(nef_settings)
+        _caches[key] = cache
+
+    return cache
+
+
+class NefQoSProfilesInterface(QoSProfilesInterface):
+    def __init__(self, nef_settings: NEFSettings) -> None:
+        super().__init__()
+
+        self.cache = get_qos_profiles_cache(nef_settings)
+
+    async def get_qos_profiles(self, req: QosProfileDeviceRequest) -> List[QosProfile]:
+        profiles = await self.cache.get_profiles()
+
+        if req.name is not None:
+            profile = profiles.get(req.name)
+            return [profile] if profile is not None else []
 
-            profiles = TypeAdapter(List[NEFNamedQoSProfile]).validate_json(res.content)
-            return list(
-                map(lambda prof: _convert_nef_profile(prof.name, prof), profiles)
-            )
+        return list(profiles.values())
@@ -1,10 +1,21 @@
 from http import HTTPStatus
+from typing import AsyncIterator
+from contextlib import asynccontextmanager
+
 from app.schemas.nef_schemas.afSessionWithQos import UserPlaneNotificationData
-from fastapi import APIRouter
+from fastapi import APIRouter, FastAPI
 
 from app.drivers.quality_on_demand.nef import nef_qod_interface
 
-router = APIRouter()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await nef_qod_interface.migrate_device_lists()
+
+    yield
+
+
+router = APIRouter(lifespan=lifespan)
 
 
 @router.post("/qod/{provisioning_id}", status_code=HTTPStatus.NO_CONTENT)
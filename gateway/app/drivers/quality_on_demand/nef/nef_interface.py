@@ -1,11 +1,12 @@
 import datetime
 import logging
-from typing import Awaitable, List
+from typing import List
 import uuid
 
-import httpx
+from fastapi.encoders import jsonable_encoder
 
-from app.drivers.nef_auth import NEFAuth
+from app.drivers.nef_auth import get_nef_client
+from app.drivers.qos_profiles.nef import get_qos_profiles_cache
 from app.exceptions import (
     InternalServerError,
     ResourceNotFound,
@@ -46,10 +47,13 @@ from app.schemas.quality_on_demand import (
 )
 from app.schemas.subscriptions import Datacontenttype, Specversion
 from app.settings import NEFSettings
+from app.utils.device_index import DeviceIndex
+from app.utils.webhook_delivery import get_webhook_delivery
 
 _prefix_info = "qodinfo"
 _prefix_gateway_nef = "qodnef"
-_prefix_device = "qodDevice"
+# Lists of session ids per device identifier, replaced by the device index
+_prefix_legacy_device = "qodDevice"
 LOG = logging.getLogger(__name__)
 
 
@@ -57,23 +61,22 @@ class NEFQoDInterface(QoDInterface):
     def __init__(self, nef_settings: NEFSettings, source: str) -> None:
         super().__init__()
 
-        nef_auth = NEFAuth(
-            nef_settings.url, nef_settings.username, nef_settings.password
-        )
-        self.httpx_client = httpx.AsyncClient(
-            base_url=nef_settings.get_base_url(), auth=nef_auth
-        )
-        self.httpx_client_callback = httpx.AsyncClient()
+        self.httpx_client = get_nef_client(nef_settings)
+        self.qos_profiles = get_qos_profiles_cache(nef_settings)
+        self.webhook_delivery = get_webhook_delivery()
 
         self.af_id = nef_settings.gateway_af_id
         self.source = source
         self.notification_url = nef_settings.get_notification_url()
 
         self.redis = get_redis()
+        self.device_index = DeviceIndex("qod")
 
     async def create_provisioning(
         self, req: CreateSession, device: Device
     ) -> SessionInfo:
+        await self.qos_profiles.validate_profile(req.qosProfile)
+
         qod_id = uuid.uuid4()
 
         response = SessionInfo(
@@ -131,24 +134,10 @@ class NEFQoDInterface(QoDInterface):
 
         nef_sub_id = str(subcription_result.self)
 
-        key = f"{_prefix_gateway_nef}:{str(qod_id)}"
-        await self.redis.set(key, nef_sub_id)
-
-        if device.phoneNumber:
-            key = f"{_prefix_device}:{device.phoneNumber}"
-            await self._save_device(key, str(qod_id))
-        if device.networkAccessIdentifier:
-            key = f"{_prefix_device}:{device.networkAccessIdentifier}"
-            await self._save_device(key, str(qod_id))
-        if device.ipv4Address and device.ipv4Address.privateAddress:
-            key = f"{_prefix_device}:{device.ipv4Address.privateAddress}"
-            await self._save_device(key, str(qod_id))
-        if device.ipv4Address and device.ipv4Address.publicPort:
-            key = f"{_prefix_device}:{device.ipv4Address.publicAddress}:{device.ipv4Address.publicPort}"
-            await self._save_device(key, str(qod_id))
-        if device.ipv6Address:
-            key = f"{_prefix_device}:{device.ipv6Address.exploded}"
-            await self._save_device(key, str(qod_id))
+        async with self.redis.pipeline(transaction=True) as p:
+            p.set(f"{_prefix_gateway_nef}:{str(qod_id)}", nef_sub_id)
+            self.device_index.add(p, device, str(qod_id))
+            await p.execute()
 
         return response
 
@@ -156,18 +145,17 @@ class NEFQoDInterface(QoDInterface):
         key = f"{_prefix_info}:{id}"
 
         data = await self.redis.get(key)
+        if data is None:
+            raise ResourceNotFound()
 
         return SessionInfo.model_validate_json(data)
 
     async def delete_qod_session(self, id: str) -> SessionInfo:
-        sub_info = await self.get_qod_information_by_id(id)
+        sub_info, nef_id = await self._get_session(id)
 
         if sub_info.qosStatus == Status.UNAVAILABLE:
             return sub_info
 
-        key = f"{_prefix_gateway_nef}:{id}"
-        nef_id = await self.redis.get(key)
-
         res = await self.httpx_client.delete(nef_id)
 
         if res.status_code == 404:
@@ -185,36 +173,40 @@ class NEFQoDInterface(QoDInterface):
         return sub_info
 
     async def get_qod_information_device(self, device: Device) -> List[SessionInfo]:
-        id = []
-
-        if device.phoneNumber:
-            key = f"{_prefix_device}:{device.phoneNumber}"
-            id = await self._get_device(key)
-        elif device.networkAccessIdentifier:
-            key = f"{_prefix_device}:{device.networkAccessIdentifier}"
-            id = await self._get_device(key)
-        elif device.ipv4Address and device.ipv4Address.privateAddress:
-            key = f"{_prefix_device}:{device.ipv4Address.privateAddress}"
-            id = await self._get_device(key)
-        elif device.ipv4Address and device.ipv4Address.publicPort:
-            key = f"{_prefix_device}:{device.ipv4Address.publicAddress}:{device.ipv4Address.publicPort}"
-            id = await self._get_device(key)
-        elif device.ipv6Address:
-            key = f"{_prefix_device}:{device.ipv6Address.exploded}"
-            id = await self._get_device(key)
-
-        if len(id) == 0 or id is None:
+        ids = await self.device_index.lookup(device)
+        if len(ids) == 0:
             raise ResourceNotFound()
 
-        sub_info = []
+        data = await self.redis.mget([f"{_prefix_info}:{id}" for id in ids])
 
-        for sub_id in id:
-            sub_info.append(await self.get_qod_information_by_id(sub_id))
+        sub_info = []
+        stale_ids = []
+        for sub_id, sub_data in zip(ids, data):
+            if sub_data is None:
+                stale_ids.append(sub_id)
+                continue
+
+            info = SessionInfo.model_validate_json(sub_data)
+            if info.qosStatus == Status.UNAVAILABLE:
+                stale_ids.append(sub_id)
+                continue
+
+            sub_info.append(info)
+
+        # Sessions that ended before the index was pruned on termination
+        if len(stale_ids) != 0:
+            async with self.redis.pipeline(transaction=True) as p:
+                for sub_id in stale_ids:
+                    self.device_index.remove(p, device, sub_id)
+                await p.execute()
+
+        if len(sub_info) == 0:
+            raise ResourceNotFound()
 
         return sub_info
 
     async def extend_session(self, id: str, req: ExtendSessionDuration) -> SessionInfo:
-        sub_info = await self.get_qod_information_by_id(id)
+        sub_info, nef_id = await self._get_session(id)
 
         if sub_info.qosStatus == Status.UNAVAILABLE:
             return sub_info
@@ -235,9 +227,6 @@ class NEFQoDInterface(QoDInterface):
 
         await self._save_subscription_info(id, sub_info)
 
-        key = f"{_prefix_gateway_nef}:{id}"
-        nef_id = await self.redis.get(key)
-
         payload = AsSessionWithQoSSubscriptionPatch(
             usageThreshold=UsageThreshold(
                 duration=sub_info.duration,
@@ -293,9 +282,8 @@ class NEFQoDInterface(QoDInterface):
             time=datetime.datetime.now(),
         )
 
-        await self.httpx_client_callback.post(
-            str(sink),
-            content=cloud_event.model_dump_json(exclude_unset=True, by_alias=True),
+        await self.webhook_delivery.deliver(
+            str(sink), jsonable_encoder(cloud_event, exclude_unset=True)
         )
 
         await self._save_subscription_info(id, sub_info)
@@ -313,12 +301,65 @@ class NEFQoDInterface(QoDInterface):
                 status = Status.AVAILABLE
         return status
 
+    async def _get_session(self, id: str) -> tuple[SessionInfo, str]:
+        """
+        Returns the session information and the url of its NEF subscription.
+        """
+        data, nef_id = await self.redis.mget(
+            f"{_prefix_info}:{id}", f"{_prefix_gateway_nef}:{id}"
+        )
+        if data is None:
+            raise ResourceNotFound()
+
+        return SessionInfo.model_validate_json(data), nef_id
+
+    async def migrate_device_lists(self) -> None:
+        """
+        Adds the sessions listed in the device lists written before the
+        device index was introduced to it, deleting the lists.
+        """
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis.scan(
+                cursor, match=f"{_prefix_legacy_device}:*", count=1000, _type="list"
+            )
+
+            for key in keys:
+                ids: List[str] = await self.redis.lrange(key, 0, -1)  # type: ignore [misc]
+
+                async with self.redis.pipeline(transaction=True) as p:
+                    if len(ids) != 0:
+                        results = await self.redis.mget(
+                            [f"{_prefix_info}:{id}" for id in ids]
+                        )
+                        for id, result in zip(ids, results):
+                            if result is None:
+                                continue
+
+                            info = SessionInfo.model_validate_json(result)
+                            if (
+                                info.qosStatus != Status.UNAVAILABLE
+                                and info.device is not None
+                            ):
+                                self.device_index.add(p, info.device, id)
+
+                    p.delete(key)
+                    await p.execute()
+
+            if cursor == 0:
+                break
+
     async def _save_subscription_info(self, id: str, data: SessionInfo) -> None:
         key = f"{_prefix_info}:{id}"
 
-        await self.redis.set(
-            key, data.model_dump_json(exclude_unset=True, by_alias=True)
-        )
+        async with self.redis.pipeline(transaction=True) as p:
+            p.set(key, data.model_dump_json(exclude_unset=True, by_alias=True))
+
+            # Sessions that ended are no longer listed for the device
+            if data.qosStatus == Status.UNAVAILABLE and data.device is not None:
+                self.device_index.remove(p, data.device, id)
+
+            await p.execute()
 
     def _get_flow_info(self, req: BaseSessionInfo) -> List[FlowInfo]:
         flow = []
@@ -395,15 +436,3 @@ class NEFQoDInterface(QoDInterface):
             for ranges in port_specs.ranges[1:]:
                 ports += f",{ranges.from_}-{ranges.to}"
         return ports
-
-    async def _save_device(self, key: str, id: str) -> None:
-        res = self.redis.rpush(key, id)
-        if isinstance(res, Awaitable):
-            res = await res
-
-    async def _get_device(self, key: str) -> List[str]:
-        res = self.redis.lrange(key, 0, -1)
-        if isinstance(res, Awaitable):
-            res = await res
-
-        return res
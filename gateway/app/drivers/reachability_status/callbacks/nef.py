@@ -2,13 +2,14 @@ import asyncio
 import logging
 from http import HTTPStatus
 from typing import AsyncIterator
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import APIRouter, FastAPI
 
 from app.exceptions import ResourceNotFound
 from app.drivers.reachability_status.nef import nef_reachability_status_interface
 from app.schemas.nef_schemas.monitoringevent import (
+    MonitoringEventReport,
     MonitoringNotification,
     MonitoringType,
     ReachabilityType,
@@ -18,24 +19,12 @@ from app.schemas.reachability_status import (
     ReachabilityDataSmsDisconnected,
 )
 from app.schemas.subscriptions import SubscriptionStatus
+from app.utils.notification_coalescer import NotificationCoalescer
 
 
-@asynccontextmanager
-async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    task = asyncio.create_task(nef_reachability_status_interface.clear_loop())
-
-    yield
-
-    task.cancel()
-
-
-router = APIRouter(lifespan=lifespan)
-
-
-@router.post("/reachability-status/{sub_id}", status_code=HTTPStatus.NO_CONTENT)
-async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
-    logging.debug(notification)
-
+async def _handle_notification(
+    sub_id: str, notification: MonitoringNotification
+) -> None:
     if notification.monitoringEventReports is None:
         logging.debug("Received notification with no event reports")
         return
@@ -93,3 +82,60 @@ async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
             ),
             nef_subscription_url=str(notification.subscription),
         )
+
+
+def _merge_notifications(
+    old: MonitoringNotification, new: MonitoringNotification
+) -> MonitoringNotification:
+    """
+    Keeps the reports of the state the device ended up in, the last loss of
+    connectivity if nothing was reported after it, otherwise the last data
+    and SMS reachability reports received after it.
+    """
+    reports = [
+        *(old.monitoringEventReports or []),
+        *(new.monitoringEventReports or []),
+    ]
+
+    net: list[MonitoringEventReport] = []
+    for report in reversed(reports):
+        if report.monitoringType == MonitoringType.LOSS_OF_CONNECTIVITY:
+            if len(net) == 0:
+                net.append(report)
+            break
+
+        if report.monitoringType == MonitoringType.UE_REACHABILITY and all(
+            r.reachabilityType != report.reachabilityType for r in net
+        ):
+            net.append(report)
+
+    return new.model_copy(update={"monitoringEventReports": net[::-1] or None})
+
+
+_coalescer = NotificationCoalescer(
+    "reachability_status", _handle_notification, _merge_notifications
+)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await nef_reachability_status_interface.rebuild_subscription_index()
+    task = asyncio.create_task(nef_reachability_status_interface.clear_loop())
+
+    yield
+
+    task.cancel()
+    # Waits for the loop to release its lease
+    with suppress(asyncio.CancelledError):
+        await task
+    await _coalescer.close()
+
+
+router = APIRouter(lifespan=lifespan)
+
+
+@router.post("/reachability-status/{sub_id}", status_code=HTTPStatus.NO_CONTENT)
+async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
+    logging.debug(notification)
+
+    await _coalescer.submit(sub_id, notification)
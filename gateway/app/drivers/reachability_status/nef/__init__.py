@@ -8,5 +8,5 @@ if settings.reachability_status.backend != ReachabilityStatusBackend.Nef:
     )
 
 nef_reachability_status_interface = NefReachabilityStatusInterface(
-    settings.reachability_status.nef, str(settings.gateway_public_url)
+    settings.reachability_status, str(settings.gateway_public_url)
 )
@@ -1,13 +1,14 @@
 import enum
+import time
 import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
 from pydantic import AnyHttpUrl, AnyUrl
 from fastapi.encoders import jsonable_encoder
 
-from app.settings import NEFSettings
+from app.settings import NefReachabilityStatusSettings
 from app.schemas.device import Device
 from app.interfaces.reachability_status import ReachabilityStatusInterface
 from app.schemas.nef_schemas.monitoringevent import (
@@ -31,7 +32,9 @@ from app.schemas.reachability_status import (
 from app.schemas.subscriptions import (
     TerminationReason,
 )
+from app.utils.device_index import device_key
 from app.utils.nef_driver_base import NefDriverBase
+from app.utils.standing_monitors import StandingMonitors
 from app.utils.subscription_driver_redis import SubscriptionDriverRedis
 
 _prefix_nef_url = "reachability_status_nef_url"
@@ -43,6 +46,21 @@ class _ConnectivityStatus(enum.Enum):
     Unknown = enum.auto()
 
 
+_connectivity_types = {
+    ReachabilityType.DATA: ConnectivityType.DATA,
+    ReachabilityType.SMS: ConnectivityType.SMS,
+}
+
+
+def _connectivity_status(report: MonitoringEventReport) -> _ConnectivityStatus:
+    if report.monitoringType == "LOSS_OF_CONNECTIVITY":
+        return _ConnectivityStatus.NoConnectivity
+    elif report.monitoringType == "UE_REACHABILITY":
+        return _ConnectivityStatus.Connected
+
+    return _ConnectivityStatus.Unknown
+
+
 class NefReachabilityStatusInterface(
     ReachabilityStatusInterface,
     NefDriverBase,
@@ -53,13 +71,34 @@ class NefReachabilityStatusInterface(
         CloudEventData,
     ],
 ):
-    def __init__(self, nef_settings: NEFSettings, source: str) -> None:
-        NefDriverBase.__init__(self, nef_settings)
+    def __init__(
+        self, reachability_settings: NefReachabilityStatusSettings, source: str
+    ) -> None:
+        NefDriverBase.__init__(self, reachability_settings.nef)
         SubscriptionDriverRedis.__init__(
             self, source, "reachability_status", SubscriptionTypeAdapter
         )
 
-        self.notification_url = nef_settings.get_notification_url()
+        self.notification_url = reachability_settings.nef.get_notification_url()
+        self.settings = reachability_settings
+
+        self.standing_monitors = {
+            type: StandingMonitors(
+                f"reachability_status_{type.value.lower()}",
+                reachability_settings.nef,
+                f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
+            )
+            for type in (ReachabilityType.DATA, ReachabilityType.SMS)
+        }
+
+        # Insertion ordered, so the first entry is the oldest
+        self._cache: dict[str, tuple[float, ReachabilityStatusResponse]] = {}
+        self._in_flight: dict[str, asyncio.Task[ReachabilityStatusResponse]] = {}
+
+    def get_subscription_device(
+        self, details: CreateSubscriptionDetail
+    ) -> Optional[Device]:
+        return details.device
 
     async def _check_connectivity(
         self, device: Device, type: ReachabilityType
@@ -74,6 +113,17 @@ class NefReachabilityStatusInterface(
 
         sub = self.install_device_identifiers(sub, device)
 
+        standing = await self.standing_monitors[type].lookup(device_key(device), sub)
+        if standing is not None:
+            return _connectivity_status(standing.report)
+
+        # Shielded so that the subscription the NEF might create is still
+        # deleted when the probe times out or is cancelled in the meantime
+        return await asyncio.shield(self._request_report(sub))
+
+    async def _request_report(
+        self, sub: MonitoringEventSubscription
+    ) -> _ConnectivityStatus:
         res = await self.httpx_client.post(
             f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
             json=jsonable_encoder(sub, exclude_unset=True),
@@ -91,62 +141,133 @@ class NefReachabilityStatusInterface(
             asyncio.create_task(self.delete_nef_subscription(sub.self))
             return _ConnectivityStatus.Unknown
 
-        report = MonitoringEventReport.model_validate(res.json())
+        return _connectivity_status(MonitoringEventReport.model_validate(res.json()))
 
-        if report.monitoringType == "LOSS_OF_CONNECTIVITY":
-            return _ConnectivityStatus.NoConnectivity
-        elif report.monitoringType == "UE_REACHABILITY":
-            return _ConnectivityStatus.Connected
-
-        return _ConnectivityStatus.Unknown
+    async def _probe(
+        self, device: Device, type: ReachabilityType
+    ) -> _ConnectivityStatus:
+        try:
+            async with asyncio.timeout(self.settings.probe_timeout_secs):
+                return await self._check_connectivity(device, type)
+        except TimeoutError:
+            logging.warning("Timed out checking the %s connectivity", type.value)
+            return _ConnectivityStatus.Unknown
 
     async def get_reachability_status(
         self, device: Device
     ) -> ReachabilityStatusResponse:
-        res = ReachabilityStatusResponse(lastStatusTime=datetime.now(), reachable=False)
+        """
+        Returns the status of the device, reusing the one obtained in the
+        last `cache_secs` and sharing the probes between concurrent requests
+        for the same device.
+        """
+        key = device_key(device)
+
+        entry = self._cache.get(key)
+        if entry is not None:
+            fetched_at, status = entry
+            if time.monotonic() - fetched_at < self.settings.cache_secs:
+                return status
+            del self._cache[key]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_reachability_status(key, device))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shielded so that a cancelled request doesn't cancel the others
+        return await asyncio.shield(task)
+
+    async def _fetch_reachability_status(
+        self, key: str, device: Device
+    ) -> ReachabilityStatusResponse:
+        """
+        Probes the DATA and SMS connectivity concurrently. The device is
+        unreachable as soon as one of them reports a loss of connectivity, in
+        which case the other probe is cancelled.
+        """
+        probes = {
+            asyncio.create_task(self._probe(device, type)): type
+            for type in (ReachabilityType.DATA, ReachabilityType.SMS)
+        }
+        connected: list[ReachabilityType] = []
 
-        data_connectivity = await self._check_connectivity(
-            device, ReachabilityType.DATA
+        try:
+            pending = set(probes)
+            while len(pending) != 0:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for probe in done:
+                    connectivity = probe.result()
+                    if connectivity == _ConnectivityStatus.NoConnectivity:
+                        connected = []
+                        pending = set()
+                        break
+                    elif connectivity == _ConnectivityStatus.Connected:
+                        connected.append(probes[probe])
+        finally:
+            for probe in probes:
+                probe.cancel()
+
+        res = ReachabilityStatusResponse(
+            lastStatusTime=datetime.now(timezone.utc), reachable=len(connected) != 0
         )
+        if len(connected) != 0:
+            res.connectivity = [
+                connectivity_type
+                for type, connectivity_type in _connectivity_types.items()
+                if type in connected
+            ]
 
-        if data_connectivity == _ConnectivityStatus.NoConnectivity:
-            res.reachable = False
-            return res
-        elif data_connectivity == _ConnectivityStatus.Connected:
-            res.reachable = True
-            res.connectivity = [ConnectivityType.DATA]
-
-        sms_connectivity = await self._check_connectivity(device, ReachabilityType.SMS)
-
-        if sms_connectivity == _ConnectivityStatus.NoConnectivity:
-            res.reachable = False
-            res.connectivity = None
-            return res
-        elif data_connectivity == _ConnectivityStatus.Connected:
-            res.reachable = True
-            if res.connectivity is None:
-                res.connectivity = []
-            res.connectivity.append(ConnectivityType.SMS)
+        if self.settings.cache_secs != 0:
+            self._cache.pop(key, None)
+            self._cache[key] = (time.monotonic(), res)
+
+            while len(self._cache) > self.settings.cache_size:
+                del self._cache[next(iter(self._cache))]
 
         return res
 
+    async def create_subscriptions(
+        self, req: SubscriptionRequest, devices: list[Device]
+    ) -> list[Subscription | BaseException]:
+        return await SubscriptionDriverRedis.create_subscriptions(self, req, devices)
+
+    async def delete_subscriptions(
+        self, sub_ids: list[str]
+    ) -> list[None | BaseException]:
+        return await SubscriptionDriverRedis.delete_subscriptions(self, sub_ids)
+
     async def get_subscription(self, sub_id: str) -> Subscription:
         return await SubscriptionDriverRedis.get_subscription(self, sub_id)
 
-    async def get_subscriptions(self) -> list[Subscription]:
-        return await SubscriptionDriverRedis.get_subscriptions(self)
+    async def get_subscriptions(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> tuple[list[Subscription], Optional[str]]:
+        return await SubscriptionDriverRedis.get_subscriptions(self, cursor, limit)
 
     async def create_subscription(
         self, req: SubscriptionRequest, device: Device
     ) -> Subscription:
-        req.config.subscriptionDetail.device = device
-        sub = await self.create_gateway_subscription(req)
+        return await SubscriptionDriverRedis.create_subscription(self, req, device)
+
+    def set_subscription_device(
+        self, details: CreateSubscriptionDetail, device: Device
+    ) -> None:
+        details.device = device
+
+    async def setup_subscription(self, sub: Subscription) -> None:
+        device = sub.config.subscriptionDetail.device
+        assert device is not None
 
         # Create monitoring event subscription
         monType: MonitoringType
         reachabilityType: Optional[ReachabilityType] = None
 
-        match req.types[0]:
+        match sub.types[0]:
             case SubscriptionEventType.v0_reachability_data:
                 monType = MonitoringType.UE_REACHABILITY
                 reachabilityType = ReachabilityType.DATA
@@ -156,43 +277,37 @@ class NefReachabilityStatusInterface(
             case SubscriptionEventType.v0_reachability_disconnected:
                 monType = MonitoringType.LOSS_OF_CONNECTIVITY
 
-        try:
-            body = MonitoringEventSubscription(
-                notificationDestination=AnyUrl(
-                    f"{self.notification_url}/callbacks/v1/reachability-status/{sub.id}"
-                ),
-                monitoringType=monType,
-                reachabilityType=reachabilityType,
-                monitorExpireTime=req.config.subscriptionExpireTime or datetime.max,
-                immediateRep=req.config.initialEvent,
-            )
+        body = MonitoringEventSubscription(
+            notificationDestination=AnyUrl(
+                f"{self.notification_url}/callbacks/v1/reachability-status/{sub.id}"
+            ),
+            monitoringType=monType,
+            reachabilityType=reachabilityType,
+            monitorExpireTime=sub.config.subscriptionExpireTime or datetime.max,
+            immediateRep=sub.config.initialEvent,
+        )
 
-            body = self.install_device_identifiers(body, device)
+        body = self.install_device_identifiers(body, device)
 
-            res = await self.httpx_client.post(
-                f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
-                json=jsonable_encoder(body, exclude_unset=True, exclude_none=True),
-            )
-
-            # Check success of monitoring event subscription
-            if not res.is_success:
-                raise RuntimeError()
+        res = await self.httpx_client.post(
+            f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
+            json=jsonable_encoder(body, exclude_unset=True, exclude_none=True),
+        )
 
-            subscription_result = MonitoringEventSubscription.model_validate_json(
-                res.content
-            )
+        # Check success of monitoring event subscription
+        if not res.is_success:
+            raise RuntimeError()
 
-            if subscription_result.self is None:
-                logging.error("No 'self' in monitoring subscription response")
-                raise RuntimeError()
+        subscription_result = MonitoringEventSubscription.model_validate_json(
+            res.content
+        )
 
-            self_key = f"{_prefix_nef_url}:{sub.id}"
-            await self.redis.set(self_key, subscription_result.self.unicode_string())
+        if subscription_result.self is None:
+            logging.error("No 'self' in monitoring subscription response")
+            raise RuntimeError()
 
-            return sub
-        except BaseException as e:
-            await self.permanently_delete_subscription(sub)
-            raise e
+        self_key = f"{_prefix_nef_url}:{sub.id}"
+        await self.redis.set(self_key, subscription_result.self.unicode_string())
 
     async def delete_subscription(
         self,
@@ -2,7 +2,7 @@ import asyncio
 import logging
 from http import HTTPStatus
 from typing import AsyncIterator
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import APIRouter, FastAPI
 
@@ -22,25 +22,13 @@ from app.schemas.roaming_status import (
     SubscriptionEventType,
 )
 from app.schemas.subscriptions import SubscriptionStatus
+from app.utils.notification_coalescer import NotificationCoalescer
 from app.utils.mcc_to_country_code import get_country_names
 
 
-@asynccontextmanager
-async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    task = asyncio.create_task(nef_roaming_status_interface.clear_loop())
-
-    yield
-
-    task.cancel()
-
-
-router = APIRouter(lifespan=lifespan)
-
-
-@router.post("/roaming-status/{sub_id}", status_code=HTTPStatus.NO_CONTENT)
-async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
-    logging.debug(notification)
-
+async def _handle_notification(
+    sub_id: str, notification: MonitoringNotification
+) -> None:
     if notification.monitoringEventReports is None:
         logging.debug("Received notification with no event reports")
         return
@@ -172,3 +160,51 @@ async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
                 data,
                 nef_subscription_url=str(notification.subscription),
             )
+
+
+def _merge_notifications(
+    old: MonitoringNotification, new: MonitoringNotification
+) -> MonitoringNotification:
+    """
+    Keeps the last roaming report, the transitions are computed against the
+    state the device ended up in.
+    """
+    reports = [
+        report
+        for report in [
+            *(old.monitoringEventReports or []),
+            *(new.monitoringEventReports or []),
+        ]
+        if report.monitoringType == MonitoringType.ROAMING_STATUS
+        and report.roamingStatus is not None
+    ]
+    return new.model_copy(update={"monitoringEventReports": reports[-1:] or None})
+
+
+_coalescer = NotificationCoalescer(
+    "roaming_status", _handle_notification, _merge_notifications
+)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await nef_roaming_status_interface.rebuild_subscription_index()
+    task = asyncio.create_task(nef_roaming_status_interface.clear_loop())
+
+    yield
+
+    task.cancel()
+    # Waits for the loop to release its lease
+    with suppress(asyncio.CancelledError):
+        await task
+    await _coalescer.close()
+
+
+router = APIRouter(lifespan=lifespan)
+
+
+@router.post("/roaming-status/{sub_id}", status_code=HTTPStatus.NO_CONTENT)
+async def webhook(sub_id: str, notification: MonitoringNotification) -> None:
+    logging.debug(notification)
+
+    await _coalescer.submit(sub_id, notification)
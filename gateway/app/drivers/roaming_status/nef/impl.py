@@ -1,7 +1,7 @@
 from typing import Optional
 import asyncio
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 
 from pydantic import AnyHttpUrl, AnyUrl
 from fastapi.encoders import jsonable_encoder
@@ -24,7 +24,9 @@ from app.schemas.subscriptions import (
 )
 from app.settings import NEFSettings
 from app.schemas.device import Device
+from app.utils.device_index import device_key
 from app.utils.nef_driver_base import NefDriverBase
+from app.utils.standing_monitors import StandingMonitors
 from app.schemas.nef_schemas.monitoringevent import (
     MonitoringEventReport,
     MonitoringEventSubscription,
@@ -62,6 +64,16 @@ class NefRoamingStatusInterface(
         )
 
         self.notification_url = nef_settings.get_notification_url()
+        self.standing_monitors = StandingMonitors(
+            "roaming_status",
+            nef_settings,
+            f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
+        )
+
+    def get_subscription_device(
+        self, details: CreateSubscriptionDetail
+    ) -> Optional[Device]:
+        return details.device
 
     async def get_roaming_status(self, device: Device) -> RoamingStatusResponse:
         sub = MonitoringEventSubscription(
@@ -73,6 +85,29 @@ class NefRoamingStatusInterface(
 
         sub = self.install_device_identifiers(sub, device)
 
+        standing = await self.standing_monitors.lookup(device_key(device), sub)
+        if standing is not None:
+            report = standing.report
+            last_status_time = standing.received_at
+        else:
+            report = await self._query_roaming_status(sub)
+            last_status_time = datetime.now(timezone.utc)
+
+        assert report.roamingStatus is not None
+
+        res = RoamingStatusResponse(
+            lastStatusTime=last_status_time,
+            roaming=report.roamingStatus,
+        )
+
+        if report.roamingStatus and report.plmnId is not None:
+            res.countryCode = report.plmnId.mcc
+
+        return res
+
+    async def _query_roaming_status(
+        self, sub: MonitoringEventSubscription
+    ) -> MonitoringEventReport:
         nef_res = await self.httpx_client.post(
             f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
             json=jsonable_encoder(sub, exclude_unset=True),
@@ -88,69 +123,72 @@ class NefRoamingStatusInterface(
             asyncio.create_task(self.delete_nef_subscription(sub.self))
             raise RuntimeError("Expected report received subscription")
 
-        report = MonitoringEventReport.model_validate(nef_res.json())
-        assert report.roamingStatus is not None
+        return MonitoringEventReport.model_validate(nef_res.json())
 
-        res = RoamingStatusResponse(
-            lastStatusTime=datetime.now(),
-            roaming=report.roamingStatus,
-        )
+    async def create_subscriptions(
+        self, req: SubscriptionRequest, devices: list[Device]
+    ) -> list[Subscription | BaseException]:
+        return await SubscriptionDriverRedis.create_subscriptions(self, req, devices)
 
-        if report.roamingStatus and report.plmnId is not None:
-            res.countryCode = report.plmnId.mcc
-
-        return res
+    async def delete_subscriptions(
+        self, sub_ids: list[str]
+    ) -> list[None | BaseException]:
+        return await SubscriptionDriverRedis.delete_subscriptions(self, sub_ids)
 
     async def get_subscription(self, sub_id: str) -> Subscription:
         return await SubscriptionDriverRedis.get_subscription(self, sub_id)
 
-    async def get_subscriptions(self) -> list[Subscription]:
-        return await SubscriptionDriverRedis.get_subscriptions(self)
+    async def get_subscriptions(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> tuple[list[Subscription], Optional[str]]:
+        return await SubscriptionDriverRedis.get_subscriptions(self, cursor, limit)
 
     async def create_subscription(
         self, req: SubscriptionRequest, device: Device
     ) -> Subscription:
-        req.config.subscriptionDetail.device = device
-        sub = await self.create_gateway_subscription(req)
-
-        try:
-            # Create monitoring event subscription
-            body = MonitoringEventSubscription(
-                notificationDestination=AnyUrl(
-                    f"{self.notification_url}/callbacks/v1/roaming-status/{sub.id}"
-                ),
-                monitoringType=MonitoringType.ROAMING_STATUS,
-                monitorExpireTime=req.config.subscriptionExpireTime or datetime.max,
-                immediateRep=req.config.initialEvent,
-                plmnIndication=True,
-            )
-
-            body = self.install_device_identifiers(body, device)
-
-            res = await self.httpx_client.post(
-                f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
-                json=jsonable_encoder(body, exclude_unset=True, exclude_none=True),
-            )
-
-            # Check success of monitoring event subscription
-            if not res.is_success:
-                raise RuntimeError()
-
-            subscription_result = MonitoringEventSubscription.model_validate_json(
-                res.content
-            )
-
-            if subscription_result.self is None:
-                logging.error("No 'self' in monitoring subscription response")
-                raise RuntimeError()
-
-            self_key = f"{_prefix_nef_url}:{sub.id}"
-            await self.redis.set(self_key, subscription_result.self.unicode_string())
-
-            return sub
-        except BaseException as e:
-            await self.permanently_delete_subscription(sub)
-            raise e
+        return await SubscriptionDriverRedis.create_subscription(self, req, device)
+
+    def set_subscription_device(
+        self, details: CreateSubscriptionDetail, device: Device
+    ) -> None:
+        details.device = device
+
+    async def setup_subscription(self, sub: Subscription) -> None:
+        device = sub.config.subscriptionDetail.device
+        assert device is not None
+
+        # Create monitoring event subscription
+        body = MonitoringEventSubscription(
+            notificationDestination=AnyUrl(
+                f"{self.notification_url}/callbacks/v1/roaming-status/{sub.id}"
+            ),
+            monitoringType=MonitoringType.ROAMING_STATUS,
+            monitorExpireTime=sub.config.subscriptionExpireTime or datetime.max,
+            immediateRep=sub.config.initialEvent,
+            plmnIndication=True,
+        )
+
+        body = self.install_device_identifiers(body, device)
+
+        res = await self.httpx_client.post(
+            f"3gpp-monitoring-event/v1/{self.af_id}/subscriptions",
+            json=jsonable_encoder(body, exclude_unset=True, exclude_none=True),
+        )
+
+        # Check success of monitoring event subscription
+        if not res.is_success:
+            raise RuntimeError()
+
+        subscription_result = MonitoringEventSubscription.model_validate_json(
+            res.content
+        )
+
+        if subscription_result.self is None:
+            logging.error("No 'self' in monitoring subscription response")
+            raise RuntimeError()
+
+        self_key = f"{_prefix_nef_url}:{sub.id}"
+        await self.redis.set(self_key, subscription_result.self.unicode_string())
 
     def _state_key(self, id: str) -> str:
         return f"{_prefix_roaming_state}:{id}"
@@ -0,0 +1,46 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from typing import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+
+from fastapi import APIRouter, FastAPI
+
+from app.exceptions import ResourceNotFound
+from app.schemas.nef_schemas.monitoringevent import MonitoringNotification
+from app.settings import settings
+from app.utils.standing_monitors import get_standing_monitors, retire_loop
+
+LOG = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    if not settings.standing_monitors.enabled:
+        yield
+        return
+
+    task = asyncio.create_task(retire_loop())
+
+    yield
+
+    task.cancel()
+    # Waits for the loop to release its lease
+    with suppress(asyncio.CancelledError):
+        await task
+
+
+router = APIRouter(prefix="/callbacks/v1", lifespan=lifespan)
+
+
+@router.post("/monitors/{kind}/{monitor_id}", status_code=HTTPStatus.NO_CONTENT)
+async def webhook(
+    kind: str, monitor_id: str, notification: MonitoringNotification
+) -> None:
+    LOG.debug(notification)
+
+    monitors = get_standing_monitors(kind)
+    if monitors is None:
+        raise ResourceNotFound()
+
+    await monitors.store_reports(monitor_id, notification)
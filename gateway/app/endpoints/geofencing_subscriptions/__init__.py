@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 
 from . import (
+    batch,
     create_subscription,
     delete_subscription,
     get_subscriptions,
@@ -12,3 +13,4 @@ router.include_router(get_subscriptions.router)
 router.include_router(get_subscriptions_by_id.router)
 router.include_router(delete_subscription.router)
 router.include_router(create_subscription.router)
+router.include_router(batch.router)
@@ -1,13 +1,49 @@
-from fastapi import APIRouter
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Query, Response
+from pydantic import PositiveInt
 
 from app.drivers.geofencing import GeofencingSubscriptionInterfaceDep
+from app.exceptions import BadRequest
 from app.schemas.geofencing import Subscription
+from app.schemas.subscriptions import NEXT_CURSOR_HEADER
 
 router = APIRouter()
 
 
 @router.get("/subscriptions", response_model_exclude_unset=True)
 async def get_subscription(
+    response: Response,
     geofencing_subscription_interface: GeofencingSubscriptionInterfaceDep,
+    cursor: Annotated[Optional[str], Query()] = None,
+    limit: Annotated[Optional[PositiveInt], Query()] = None,
+    latitude: Annotated[Optional[float], Query(ge=-90, le=90)] = None,
+    longitude: Annotated[Optional[float], Query(ge=-180, le=180)] = None,
+    radius: Annotated[Optional[float], Query(gt=0)] = None,
 ) -> list[Subscription]:
-    return await geofencing_subscription_interface.get_subscriptions()
+    """
+    Lists the subscriptions, or if `latitude` and `longitude` are given only
+    the active ones whose area contains the point, or intersects the circle
+    around it if `radius` is also given. The filtered results aren't paginated.
+    """
+    if latitude is not None or longitude is not None or radius is not None:
+        if latitude is None or longitude is None:
+            raise BadRequest(
+                "latitude and longitude are both required to filter by area"
+            )
+        if cursor is not None:
+            raise BadRequest("The area filter can't be combined with cursor")
+
+        return await geofencing_subscription_interface.get_area_subscriptions(
+            latitude, longitude, radius
+        )
+
+    (
+        subscriptions,
+        next_cursor,
+    ) = await geofencing_subscription_interface.get_subscriptions(cursor, limit)
+
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    return subscriptions
@@ -1,11 +1,12 @@
 from fastapi import APIRouter
 
-from app.exceptions import MissingDevice
+from app.exceptions import ApiException, MissingDevice
 from app.schemas.location import (
     RetrievalLocationRequest,
     Location,
 )
 from app.drivers.location import LocationInterfaceDep
+from app.utils import geometry
 
 router = APIRouter(prefix="/location-retrieval/v0.4")
 
@@ -17,6 +18,18 @@ async def retrieve_location(
     if body.device is None:
         raise MissingDevice()
 
-    return await location_interface.retrieve_location(
+    location = await location_interface.retrieve_location(
         body.device, body.maxAge, body.maxSurface
     )
+
+    if (
+        body.maxSurface is not None
+        and geometry.from_area(location.area).area_m2() > body.maxSurface
+    ):
+        raise ApiException(
+            status=422,
+            code="LOCATION_RETRIEVAL.UNABLE_TO_FULFILL_MAX_SURFACE",
+            message="Unable to provide expected surface for location",
+        )
+
+    return location
@@ -1,19 +1,72 @@
-from fastapi import APIRouter, HTTPException
-from geopy import distance
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 
 from app.drivers.location import LocationInterfaceDep
-from app.exceptions import MissingDevice
+from app.exception_handlers import error_info
+from app.exceptions import BadRequest, MissingDevice
+from app.interfaces.location import LocationInterface
 from app.schemas.location import (
+    BatchVerifyLocationRequest,
+    BatchVerifyLocationResponse,
+    BatchVerifyLocationResult,
+    Location,
     VerifyLocationRequest,
     VerifyLocationResponse,
-    AreaType,
     Circle,
     VerificationResult,
 )
+from app.settings import settings
+from app.utils import geometry
 
 router = APIRouter(prefix="/location-verification/v2")
 
 
+def _verification(loc: Location, match_rate: Optional[float]) -> VerifyLocationResponse:
+    if match_rate is None:
+        return VerifyLocationResponse(
+            lastLocationTime=loc.lastLocationTime,
+            verificationResult=VerificationResult.UNKNOWN,
+        )
+
+    percent = round(match_rate * 100)
+
+    if percent >= 100:
+        return VerifyLocationResponse(
+            lastLocationTime=loc.lastLocationTime,
+            verificationResult=VerificationResult.TRUE,
+        )
+
+    if percent <= 0:
+        return VerifyLocationResponse(
+            lastLocationTime=loc.lastLocationTime,
+            verificationResult=VerificationResult.FALSE,
+        )
+
+    return VerifyLocationResponse(
+        lastLocationTime=loc.lastLocationTime,
+        verificationResult=VerificationResult.PARTIAL,
+        matchRate=min(percent, 99),
+    )
+
+
+def _match_rates(pairs: list[tuple[Location, Circle]]) -> list[Optional[float]]:
+    """
+    Returns the fraction of each located area that is inside the area to
+    verify, or None if the device wasn't located.
+    """
+    return [
+        geometry.overlap(
+            geometry.from_area(loc.area), geometry.circle(area.center, area.radius)
+        )
+        if loc
+        else None
+        for loc, area in pairs
+    ]
+
+
 @router.post("/verify")
 async def retrieve_location(
     body: VerifyLocationRequest, location_interface: LocationInterfaceDep
@@ -23,27 +76,63 @@ async def retrieve_location(
 
     loc = await location_interface.retrieve_location(body.device, body.maxAge, 3)
 
-    if not loc:
-        return VerifyLocationResponse(
-            lastLocationTime=loc.lastLocationTime,
-            verificationResult=VerificationResult.UNKNOWN,
-        )
+    [match_rate] = _match_rates([(loc, body.area)])
+    return _verification(loc, match_rate)
 
-    if loc.area.areaType != AreaType.CIRCLE:
-        raise HTTPException(status_code=501, detail="Area Type not implemented")
 
-    assert isinstance(loc.area, Circle)
-    pt1 = [loc.area.center.latitude, loc.area.center.longitude]
-    pt2 = [body.area.center.latitude, body.area.center.longitude]
-    d = distance.distance(pt1, pt2).m
+async def _locate_items(
+    items: list[VerifyLocationRequest], location_interface: LocationInterface
+) -> list[Location | BaseException]:
+    semaphore = asyncio.Semaphore(settings.location.batch_concurrency)
 
-    if d <= body.area.radius:
-        return VerifyLocationResponse(
-            lastLocationTime=loc.lastLocationTime,
-            verificationResult=VerificationResult.TRUE,
+    async def locate(item: VerifyLocationRequest) -> Location:
+        if item.device is None:
+            raise MissingDevice()
+
+        async with semaphore:
+            return await location_interface.retrieve_location(
+                item.device, item.maxAge, 3
+            )
+
+    return await asyncio.gather(
+        *(locate(item) for item in items), return_exceptions=True
+    )
+
+
+@router.post("/verify-batch")
+async def verify_location_batch(
+    body: BatchVerifyLocationRequest, location_interface: LocationInterfaceDep
+) -> BatchVerifyLocationResponse:
+    """
+    Verifies the location of several devices, each against its own area.
+
+    The locations are retrieved concurrently and a failure only affects its
+    own item, which gets an error instead of a result.
+    """
+    if len(body.items) > settings.location.batch_max_items:
+        raise BadRequest(
+            f"At most {settings.location.batch_max_items} items can be verified at once."
         )
 
-    return VerifyLocationResponse(
-        lastLocationTime=loc.lastLocationTime,
-        verificationResult=VerificationResult.FALSE,
+    locations = await _locate_items(body.items, location_interface)
+
+    located = [
+        (i, loc, item.area)
+        for i, (loc, item) in enumerate(zip(locations, body.items))
+        if isinstance(loc, Location)
+    ]
+    # Computing the overlaps of a large batch would block the event loop
+    match_rates = await run_in_threadpool(
+        _match_rates, [(loc, area) for _, loc, area in located]
     )
+
+    results = [
+        BatchVerifyLocationResult(error=error_info(loc))
+        if isinstance(loc, BaseException)
+        else BatchVerifyLocationResult()
+        for loc in locations
+    ]
+    for (i, loc, _), match_rate in zip(located, match_rates):
+        results[i].result = _verification(loc, match_rate)
+
+    return BatchVerifyLocationResponse(results=results)
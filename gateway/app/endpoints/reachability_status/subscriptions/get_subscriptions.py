@@ -1,6 +1,10 @@
-from fastapi import APIRouter
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Query, Response
+from pydantic import PositiveInt
 
 from app.schemas.reachability_status import Subscription
+from app.schemas.subscriptions import NEXT_CURSOR_HEADER
 from app.drivers.reachability_status import ReachabilityStatusInterfaceDep
 
 router = APIRouter()
@@ -8,6 +12,19 @@ router = APIRouter()
 
 @router.get("/subscriptions", response_model_exclude_unset=True)
 async def get_subscription(
+    response: Response,
     reachability_status_subscription_interface: ReachabilityStatusInterfaceDep,
+    cursor: Annotated[Optional[str], Query()] = None,
+    limit: Annotated[Optional[PositiveInt], Query()] = None,
 ) -> list[Subscription]:
-    return await reachability_status_subscription_interface.get_subscriptions()
+    (
+        subscriptions,
+        next_cursor,
+    ) = await reachability_status_subscription_interface.get_subscriptions(
+        cursor, limit
+    )
+
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    return subscriptions
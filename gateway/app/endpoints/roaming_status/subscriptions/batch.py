@@ -0,0 +1,43 @@
+from fastapi import APIRouter
+
+from app.drivers.roaming_status import RoamingStatusSubscriptionInterfaceDep
+from app.schemas.roaming_status import (
+    BatchSubscriptionRequest,
+    BatchSubscriptionResponse,
+)
+from app.schemas.subscriptions import (
+    BatchDeleteSubscriptionsRequest,
+    BatchDeleteSubscriptionsResponse,
+)
+from app.utils import subscription_batch
+
+router = APIRouter()
+
+
+@router.post("/subscriptions/create-batch", response_model_exclude_unset=True)
+async def post_subscriptions_batch(
+    body: BatchSubscriptionRequest,
+    roaming_status_subscription_interface: RoamingStatusSubscriptionInterfaceDep,
+) -> BatchSubscriptionResponse:
+    """
+    Creates a subscription with the same config for each of the devices.
+
+    A failure only affects its own device, which gets an error instead of a
+    subscription.
+    """
+    return await subscription_batch.create_subscriptions_batch(
+        body, roaming_status_subscription_interface
+    )
+
+
+@router.post("/subscriptions/delete-batch", response_model_exclude_none=True)
+async def delete_subscriptions_batch(
+    body: BatchDeleteSubscriptionsRequest,
+    roaming_status_subscription_interface: RoamingStatusSubscriptionInterfaceDep,
+) -> BatchDeleteSubscriptionsResponse:
+    """
+    Deletes several subscriptions, a failure only affects its own id.
+    """
+    return await subscription_batch.delete_subscriptions_batch(
+        body, roaming_status_subscription_interface
+    )
@@ -1,6 +1,10 @@
-from fastapi import APIRouter
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Query, Response
+from pydantic import PositiveInt
 
 from app.schemas.roaming_status import Subscription
+from app.schemas.subscriptions import NEXT_CURSOR_HEADER
 from app.drivers.roaming_status import RoamingStatusSubscriptionInterfaceDep
 
 router = APIRouter()
@@ -8,6 +12,17 @@ router = APIRouter()
 
 @router.get("/subscriptions", response_model_exclude_unset=True)
 async def get_subscription(
+    response: Response,
     roaming_status_subscription_interface: RoamingStatusSubscriptionInterfaceDep,
+    cursor: Annotated[Optional[str], Query()] = None,
+    limit: Annotated[Optional[PositiveInt], Query()] = None,
 ) -> list[Subscription]:
-    return await roaming_status_subscription_interface.get_subscriptions()
+    (
+        subscriptions,
+        next_cursor,
+    ) = await roaming_status_subscription_interface.get_subscriptions(cursor, limit)
+
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    return subscriptions
@@ -1,4 +1,6 @@
-from fastapi import FastAPI, Request
+import logging
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse, Response
@@ -6,6 +8,27 @@ from fastapi.responses import JSONResponse, Response
 from app.exceptions import ApiException
 from app.schemas import ErrorInfo
 
+LOG = logging.getLogger(__name__)
+
+
+def error_info(e: BaseException) -> ErrorInfo:
+    """
+    Returns the error returned for an exception raised by one of the items of
+    a batch request, which fails only that item.
+    """
+    if isinstance(e, ApiException):
+        return ErrorInfo(status=e.status, code=e.code, message=e.message)
+
+    if isinstance(e, HTTPException):
+        return ErrorInfo(status=e.status_code, code="ERROR", message=str(e.detail))
+
+    LOG.error("Failed to process a batch item", exc_info=e)
+    return ErrorInfo(
+        status=500,
+        code="INTERNAL_SERVER_ERROR",
+        message="An unknown error has occured.",
+    )
+
 
 def install_exception_handlers(app: FastAPI) -> None:
     @app.exception_handler(RequestValidationError)
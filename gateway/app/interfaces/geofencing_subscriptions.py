@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 
 from app.schemas.device import Device
 from app.schemas.geofencing import Subscription, SubscriptionRequest
@@ -11,14 +12,47 @@ class GeofencingSubscriptionInterface(ABC):
     ) -> Subscription:
         pass
 
+    @abstractmethod
+    async def create_subscriptions(
+        self, req: SubscriptionRequest, devices: list[Device]
+    ) -> list[Subscription | BaseException]:
+        """
+        Creates a subscription with the config of `req` for each device,
+        returning the subscription of each device or the exception that
+        prevented its creation.
+        """
+        pass
+
     @abstractmethod
     async def delete_subscription(self, sub_id: str) -> None:
         pass
 
+    @abstractmethod
+    async def delete_subscriptions(
+        self, sub_ids: list[str]
+    ) -> list[None | BaseException]:
+        """
+        Deletes the subscriptions, returning None for each deleted
+        subscription or the exception that prevented its deletion.
+        """
+        pass
+
     @abstractmethod
     async def get_subscription(self, sub_id: str) -> Subscription:
         pass
 
     @abstractmethod
-    async def get_subscriptions(self) -> list[Subscription]:
+    async def get_subscriptions(
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> tuple[list[Subscription], Optional[str]]:
+        pass
+
+    @abstractmethod
+    async def get_area_subscriptions(
+        self, latitude: float, longitude: float, radius_m: Optional[float] = None
+    ) -> list[Subscription]:
+        """
+        Returns the active subscriptions whose area contains the point, or
+        intersects the circle around it if `radius_m` is given.
+        """
         pass
@@ -1,9 +1,19 @@
 from abc import ABC, abstractmethod
 from typing import List
 
+from app.exceptions import ApiException
 from app.schemas.qos_profiles import QosProfile, QosProfileDeviceRequest
 
 
+class QoSProfileNotFound(ApiException):
+    def __init__(self) -> None:
+        super().__init__(
+            status=400,
+            code="INVALID_ARGUMENT",
+            message="The requested QoS profile does not exist",
+        )
+
+
 class QoSProfilesInterface(ABC):
     @abstractmethod
     async def get_qos_profiles(self, req: QosProfileDeviceRequest) -> List[QosProfile]:
@@ -1,21 +1,37 @@
 from typing import Any
-from collections.abc import Awaitable, Callable
+from contextlib import asynccontextmanager
+from collections.abc import AsyncIterator, Awaitable, Callable
 
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
 from fastapi.requests import Request
 from fastapi.responses import Response
 
-from app import drivers, endpoints, probes
+from app import drivers, endpoints, metrics, probes
+from app.drivers.nef_auth import close_nef_clients
 from app.exception_handlers import install_exception_handlers
+from app.utils.http_clients import get_outbound_clients
+from app.utils.webhook_delivery import get_webhook_delivery
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    yield
+
+    await get_webhook_delivery().close()
+    await get_outbound_clients().close()
+    await close_nef_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(probes.router)
 app.include_router(endpoints.router)
 app.include_router(drivers.router, include_in_schema=False)
 
 install_exception_handlers(app)
 
+app.middleware("http")(metrics.track_requests)
+
 
 @app.middleware("http")
 async def add_correlation_header(
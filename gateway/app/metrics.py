@@ -0,0 +1,231 @@
+import time
+import functools
+from typing import Any, Optional
+from contextlib import contextmanager
+from collections.abc import Awaitable, Callable, Coroutine, Iterator
+
+import httpx
+from fastapi.requests import Request
+from fastapi.responses import Response
+from prometheus_client import Counter, Gauge, Histogram
+
+# HTTP API of the gateway
+http_requests = Counter(
+    "gateway_http_requests_total",
+    "Requests handled by the gateway",
+    ["method", "route", "status"],
+)
+http_request_duration = Histogram(
+    "gateway_http_request_duration_seconds",
+    "Time spent handling requests",
+    ["method", "route"],
+)
+http_requests_in_flight = Gauge(
+    "gateway_http_requests_in_flight",
+    "Requests being handled",
+    ["method"],
+)
+
+# Requests made by the gateway to other services (NEF, sinks, ...)
+outbound_requests = Counter(
+    "gateway_outbound_requests_total",
+    "Requests sent to other services",
+    ["target", "operation", "status"],
+)
+outbound_request_duration = Histogram(
+    "gateway_outbound_request_duration_seconds",
+    "Time until the response of requests sent to other services",
+    ["target", "operation"],
+)
+outbound_requests_in_flight = Gauge(
+    "gateway_outbound_requests_in_flight",
+    "Requests sent to other services waiting for a response",
+    ["target", "operation"],
+)
+
+# Redis commands, pipelines count as a single command
+redis_commands = Counter(
+    "gateway_redis_commands_total",
+    "Redis commands executed",
+    ["command", "status"],
+)
+redis_command_duration = Histogram(
+    "gateway_redis_command_duration_seconds",
+    "Time spent executing redis commands",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Internal operations of the drivers
+operations = Counter(
+    "gateway_operations_total",
+    "Operations performed by the drivers",
+    ["component", "operation", "status"],
+)
+operation_duration = Histogram(
+    "gateway_operation_duration_seconds",
+    "Time spent in operations performed by the drivers",
+    ["component", "operation"],
+)
+operations_in_flight = Gauge(
+    "gateway_operations_in_flight",
+    "Operations being performed by the drivers",
+    ["component", "operation"],
+)
+
+# Notifications merged into one that was already waiting to be handled
+coalesced_notifications = Counter(
+    "gateway_coalesced_notifications_total",
+    "Notifications coalesced with a pending notification",
+    ["coalescer"],
+)
+
+
+def _error_status(e: BaseException) -> str:
+    return type(e).__name__
+
+
+@contextmanager
+def track_operation(component: str, operation: str) -> Iterator[None]:
+    """
+    Records the duration and outcome of the operation run in the context, the
+    status is `ok` or the name of the exception raised.
+    """
+    in_flight = operations_in_flight.labels(component, operation)
+    in_flight.inc()
+    start = time.perf_counter()
+    status = "ok"
+
+    try:
+        yield
+    except BaseException as e:
+        status = _error_status(e)
+        raise
+    finally:
+        operation_duration.labels(component, operation).observe(
+            time.perf_counter() - start
+        )
+        operations.labels(component, operation, status).inc()
+        in_flight.dec()
+
+
+def instrumented[**P, R](
+    component: str, operation: str
+) -> Callable[
+    [Callable[P, Coroutine[Any, Any, R]]], Callable[P, Coroutine[Any, Any, R]]
+]:
+    """
+    Decorator version of `track_operation` for coroutine functions.
+    """
+
+    def decorator(
+        f: Callable[P, Coroutine[Any, Any, R]],
+    ) -> Callable[P, Coroutine[Any, Any, R]]:
+        @functools.wraps(f)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with track_operation(component, operation):
+                return await f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def track_redis_command(command: str) -> Iterator[None]:
+    start = time.perf_counter()
+    status = "ok"
+
+    try:
+        yield
+    except BaseException as e:
+        status = _error_status(e)
+        raise
+    finally:
+        redis_command_duration.labels(command).observe(time.perf_counter() - start)
+        redis_commands.labels(command, status).inc()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport that records the requests sent to `target`.
+
+    The operation is the method and, if `base_path` is given, the first path
+    segment after it, which identifies the API without including any ids.
+    Requests outside of `base_path` are labelled with their full path.
+    """
+
+    def __init__(
+        self,
+        target: str,
+        transport: httpx.AsyncBaseTransport,
+        base_path: Optional[str] = None,
+    ) -> None:
+        self.target = target
+        self.transport = transport
+        self.base_path = base_path.rstrip("/") if base_path is not None else None
+
+    def _operation(self, request: httpx.Request) -> str:
+        if self.base_path is None:
+            return request.method
+
+        path = request.url.path
+        if not path.startswith(self.base_path + "/"):
+            return f"{request.method} {path}"
+
+        api = path.removeprefix(self.base_path).strip("/").split("/", 1)[0]
+        return f"{request.method} /{api}"
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        operation = self._operation(request)
+        in_flight = outbound_requests_in_flight.labels(self.target, operation)
+        in_flight.inc()
+        start = time.perf_counter()
+        status = "error"
+
+        try:
+            res = await self.transport.handle_async_request(request)
+            status = str(res.status_code)
+            return res
+        except BaseException as e:
+            status = _error_status(e)
+            raise
+        finally:
+            outbound_request_duration.labels(self.target, operation).observe(
+                time.perf_counter() - start
+            )
+            outbound_requests.labels(self.target, operation, status).inc()
+            in_flight.dec()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+async def track_requests(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    """
+    Middleware that records the requests handled by the gateway, labelled by
+    the path template of the route so that ids don't end up in the labels.
+
+    The route is only known once the router matched the request, so the
+    requests in flight are labelled by method only.
+    """
+    method = request.method
+
+    in_flight = http_requests_in_flight.labels(method)
+    in_flight.inc()
+    start = time.perf_counter()
+    status = "500"
+
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        # Set by the router on the scope shared with the middlewares
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+
+        http_request_duration.labels(method, route).observe(time.perf_counter() - start)
+        http_requests.labels(method, route, status).inc()
+        in_flight.dec()
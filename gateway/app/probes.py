@@ -1,23 +1,154 @@
+import time
+import asyncio
 import logging
 from http import HTTPStatus
-from collections.abc import Sequence
+from collections.abc import Awaitable, Callable, Sequence
+from typing import Any, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from app.drivers.nef_auth import check_nef_login
+from app.redis import get_redis
+from app.settings import NEFSettings, OTPBackend, settings
+
+LOG = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Management"])
 
+# Backends that keep their state in redis when they are enabled
+_redis_backends = [
+    "qod",
+    "qod_provisioning",
+    "geofencing",
+    "reachability_status",
+    "roaming_status",
+]
+
 
 class _ProbesFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool | logging.LogRecord:
         if not isinstance(record.args, Sequence):
             return record
 
-        return record.args[2] not in ["/health"]
+        return record.args[2] not in ["/health", "/ready", "/metrics"]
 
 
 logging.getLogger("uvicorn.access").addFilter(_ProbesFilter())
 
 
+async def _check(name: str, check: Callable[[], Awaitable[Any]]) -> str:
+    try:
+        await asyncio.wait_for(check(), settings.readiness.timeout_secs)
+    except TimeoutError:
+        LOG.warning("Readiness check of %s timed out", name)
+        return "timeout"
+    except Exception as e:
+        LOG.warning("Readiness check of %s failed: %s", name, e)
+        return str(e) or type(e).__name__
+
+    return "ok"
+
+
+class _Readiness:
+    """
+    Checks the services used by the enabled backends: redis is pinged and the
+    gateway logs in to the NEF if it doesn't hold a valid token.
+
+    The result is reused for `cache_secs`, and concurrent probes wait for the
+    same run of the checks.
+    """
+
+    def __init__(self) -> None:
+        self._lock = asyncio.Lock()
+        self._expires_at = 0.0
+        self._result: dict[str, dict[str, str]] = {}
+
+    async def get(self) -> dict[str, dict[str, str]]:
+        async with self._lock:
+            if time.monotonic() >= self._expires_at:
+                self._result = await self._run()
+                self._expires_at = time.monotonic() + settings.readiness.cache_secs
+
+            return self._result
+
+    async def _run(self) -> dict[str, dict[str, str]]:
+        redis_check: Optional[asyncio.Task[str]] = None
+        nef_checks: dict[tuple[str, str], asyncio.Task[str]] = {}
+
+        def check_redis() -> asyncio.Task[str]:
+            nonlocal redis_check
+            if redis_check is None:
+                redis_check = asyncio.create_task(_check("redis", get_redis().ping))
+            return redis_check
+
+        def check_nef(nef: NEFSettings) -> asyncio.Task[str]:
+            # Backends using the same NEF user share the token
+            key = (str(nef.url), nef.username)
+            if key not in nef_checks:
+                nef_checks[key] = asyncio.create_task(
+                    _check(f"NEF {nef.url}", lambda: check_nef_login(nef))
+                )
+            return nef_checks[key]
+
+        checks: dict[str, dict[str, asyncio.Task[str]]] = {}
+        for name in type(settings).model_fields:
+            backend_settings = getattr(settings, name)
+            backend = getattr(
+                backend_settings,
+                "backend",
+                getattr(backend_settings, "sms_backend", None),
+            )
+            if backend is None or backend == "disabled":
+                continue
+
+            backend_checks = checks[name] = {}
+
+            nef = getattr(backend_settings, "nef", None)
+            if nef is not None:
+                backend_checks["nef"] = check_nef(nef)
+
+            if (
+                name in _redis_backends
+                or getattr(backend_settings, "otp_backend", None) == OTPBackend.Redis
+            ):
+                backend_checks["redis"] = check_redis()
+
+        return {
+            name: {dependency: await task for dependency, task in tasks.items()}
+            for name, tasks in checks.items()
+        }
+
+
+_readiness = _Readiness()
+
+
 @router.get("/health", status_code=HTTPStatus.NO_CONTENT)
 def get_health() -> None:
     return
+
+
+@router.get(
+    "/ready",
+    responses={HTTPStatus.SERVICE_UNAVAILABLE: {"description": "Not ready"}},
+)
+async def get_ready() -> JSONResponse:
+    """
+    Reports the status of the services used by each enabled backend, answering
+    with 503 if any of them is unavailable.
+    """
+    backends = await _readiness.get()
+
+    ready = all(
+        status == "ok" for checks in backends.values() for status in checks.values()
+    )
+    return JSONResponse(
+        {"backends": backends},
+        status_code=HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE,
+    )
+
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
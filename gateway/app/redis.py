@@ -2,12 +2,38 @@ from fastapi import Depends
 
 from typing import Annotated
 import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
 
+from app.metrics import track_redis_command
 from app.settings import settings
 
-# This function isn't typed
+# The redis client isn't typed
 # mypy: ignore-errors
-_client: redis.Redis = redis.from_url(
+
+
+class _InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error=True):
+        command = "MULTI" if self.is_transaction else "PIPELINE"
+        with track_redis_command(command):
+            return await super().execute(raise_on_error)
+
+
+class _InstrumentedRedis(redis.Redis):
+    """
+    Redis client that records the commands it executes.
+    """
+
+    async def execute_command(self, *args, **options):
+        with track_redis_command(str(args[0]).upper()):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return _InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+_client: redis.Redis = _InstrumentedRedis.from_url(
     str(settings.redis.url),
     encoding="utf-8",
     decode_responses=True,
@@ -65,8 +65,7 @@ class SubscriptionEnds(BaseModel):
     subscriptionId: subscriptions.SubscriptionId
 
 
-class SubscriptionDetail(BaseModel):
-    device: Optional[Device] = None
+class SubscriptionDetail(subscriptions.DeviceSubscriptionDetail):
     area: Circle
 
 
@@ -77,3 +76,12 @@ SubscriptionTypeAdapter: TypeAdapter[Subscription] = TypeAdapter(Subscription)
 SubscriptionRequest = subscriptions.SubscriptionRequest[
     SubscriptionEventType, SubscriptionDetail
 ]
+BatchSubscriptionRequest = subscriptions.BatchSubscriptionRequest[
+    SubscriptionEventType, SubscriptionDetail
+]
+BatchSubscriptionResponse = subscriptions.BatchSubscriptionResponse[
+    SubscriptionEventType, SubscriptionDetail
+]
+BatchSubscriptionResult = subscriptions.BatchSubscriptionResult[
+    SubscriptionEventType, SubscriptionDetail
+]
@@ -4,6 +4,7 @@ from typing import Annotated, Optional, Self
 
 from pydantic import BaseModel, Field, SerializeAsAny, model_validator
 
+from app.schemas import ErrorInfo
 from app.schemas.common import Point
 from app.schemas.device import Device
 
@@ -109,3 +110,28 @@ class VerifyLocationResponse(BaseModel):
             raise ValueError("Only partial values can contain a match rate")
 
         return self
+
+
+class BatchVerifyLocationRequest(BaseModel):
+    items: Annotated[
+        list[VerifyLocationRequest],
+        Field(min_length=1, description="Devices and areas to verify"),
+    ]
+
+
+class BatchVerifyLocationResult(BaseModel):
+    result: Annotated[
+        Optional[VerifyLocationResponse],
+        Field(description="Verification of the item, absent if it failed"),
+    ] = None
+    error: Annotated[
+        Optional[ErrorInfo],
+        Field(description="Reason why the item failed, absent if it succeeded"),
+    ] = None
+
+
+class BatchVerifyLocationResponse(BaseModel):
+    results: Annotated[
+        list[BatchVerifyLocationResult],
+        Field(description="Results in the same order as the items of the request"),
+    ]
@@ -25,8 +25,8 @@ class RequestReachabilityStatus(BaseModel):
     device: Optional[Device] = None
 
 
-class CreateSubscriptionDetail(BaseModel):
-    device: Optional[Device] = None
+class CreateSubscriptionDetail(subscriptions.DeviceSubscriptionDetail):
+    pass
 
 
 class SubscriptionEventType(str, Enum):
@@ -67,3 +67,12 @@ SubscriptionTypeAdapter: TypeAdapter[Subscription] = TypeAdapter(Subscription)
 SubscriptionRequest = subscriptions.SubscriptionRequest[
     SubscriptionEventType, CreateSubscriptionDetail
 ]
+BatchSubscriptionRequest = subscriptions.BatchSubscriptionRequest[
+    SubscriptionEventType, CreateSubscriptionDetail
+]
+BatchSubscriptionResponse = subscriptions.BatchSubscriptionResponse[
+    SubscriptionEventType, CreateSubscriptionDetail
+]
+BatchSubscriptionResult = subscriptions.BatchSubscriptionResult[
+    SubscriptionEventType, CreateSubscriptionDetail
+]
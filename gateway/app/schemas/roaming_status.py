@@ -87,8 +87,8 @@ class SubscriptionEnds(BasicDeviceEventData):
     terminationDescription: Optional[str] = None
 
 
-class CreateSubscriptionDetail(BaseModel):
-    device: Optional[Device] = None
+class CreateSubscriptionDetail(subscriptions.DeviceSubscriptionDetail):
+    pass
 
 
 CloudEventData = Union[
@@ -102,3 +102,12 @@ SubscriptionTypeAdapter: TypeAdapter[Subscription] = TypeAdapter(Subscription)
 SubscriptionRequest = subscriptions.SubscriptionRequest[
     SubscriptionEventType, CreateSubscriptionDetail
 ]
+BatchSubscriptionRequest = subscriptions.BatchSubscriptionRequest[
+    SubscriptionEventType, CreateSubscriptionDetail
+]
+BatchSubscriptionResponse = subscriptions.BatchSubscriptionResponse[
+    SubscriptionEventType, CreateSubscriptionDetail
+]
+BatchSubscriptionResult = subscriptions.BatchSubscriptionResult[
+    SubscriptionEventType, CreateSubscriptionDetail
+]
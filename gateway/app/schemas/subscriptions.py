@@ -4,6 +4,9 @@ from datetime import datetime
 
 from pydantic import AnyUrl, BaseModel, Field
 
+from app.schemas import ErrorInfo
+from app.schemas.device import Device
+
 
 class SubscriptionStatus(str, Enum):
     ACTIVATION_REQUESTED = "ACTIVATION_REQUESTED"
@@ -185,6 +188,10 @@ SubscriptionId = Annotated[
 ]
 
 
+# Response header with the cursor of the next page when listing subscriptions
+NEXT_CURSOR_HEADER = "x-next-cursor"
+
+
 class SubscriptionAsync(BaseModel):
     id: Optional[SubscriptionId] = None
 
@@ -235,6 +242,10 @@ class CloudEvent[NotificationEventType: str, CloudEventData](BaseModel):
     time: DateTime
 
 
+class DeviceSubscriptionDetail(BaseModel):
+    device: Optional[Device] = None
+
+
 class SubscriptionConfig[SubscriptionDetails](BaseModel):
     subscriptionDetail: SubscriptionDetails
     subscriptionExpireTime: Annotated[
@@ -420,3 +431,62 @@ type SubscriptionRequest[SubscriptionEventType: str, SubscriptionDetail] = Annot
     ],
     Field(discriminator="protocol"),
 ]
+
+
+class BatchSubscriptionRequest[SubscriptionEventType: str, SubscriptionDetail](
+    BaseModel
+):
+    subscription: Annotated[
+        SubscriptionRequest[SubscriptionEventType, SubscriptionDetail],
+        Field(
+            description="Subscription created for each of the devices, its subscription detail must not include a device"
+        ),
+    ]
+    devices: Annotated[
+        List[Device],
+        Field(min_length=1, description="Devices to create a subscription for"),
+    ]
+
+
+class BatchSubscriptionResult[SubscriptionEventType: str, SubscriptionDetail](
+    BaseModel
+):
+    subscription: Annotated[
+        Optional[Subscription[SubscriptionEventType, SubscriptionDetail]],
+        Field(description="Subscription created for the device, absent if it failed"),
+    ] = None
+    error: Annotated[
+        Optional[ErrorInfo],
+        Field(description="Reason why the device failed, absent if it succeeded"),
+    ] = None
+
+
+class BatchSubscriptionResponse[SubscriptionEventType: str, SubscriptionDetail](
+    BaseModel
+):
+    results: Annotated[
+        List[BatchSubscriptionResult[SubscriptionEventType, SubscriptionDetail]],
+        Field(description="Results in the same order as the devices of the request"),
+    ]
+
+
+class BatchDeleteSubscriptionsRequest(BaseModel):
+    subscriptionIds: Annotated[
+        List[str],
+        Field(min_length=1, description="Ids of the subscriptions to delete"),
+    ]
+
+
+class BatchDeleteSubscriptionResult(BaseModel):
+    subscriptionId: str
+    error: Annotated[
+        Optional[ErrorInfo],
+        Field(description="Reason why the deletion failed, absent if it succeeded"),
+    ] = None
+
+
+class BatchDeleteSubscriptionsResponse(BaseModel):
+    results: Annotated[
+        List[BatchDeleteSubscriptionResult],
+        Field(description="Results in the same order as the ids of the request"),
+    ]
@@ -1,11 +1,23 @@
 import types
 import typing
 import logging
+import importlib.util
 from enum import Enum
 from collections.abc import Generator
-from typing import Annotated, Any, Literal, Optional, TypeAliasType, Union
-
-from pydantic import AnyHttpUrl, BaseModel, Field, PositiveInt, RedisDsn
+from typing import Annotated, Any, Literal, Optional, Self, TypeAliasType, Union
+
+from pydantic import (
+    AnyHttpUrl,
+    BaseModel,
+    Field,
+    NonNegativeFloat,
+    NonNegativeInt,
+    PositiveFloat,
+    PositiveInt,
+    RedisDsn,
+    field_validator,
+    model_validator,
+)
 from pydantic.fields import FieldInfo
 from pydantic_settings import (
     BaseSettings,
@@ -216,7 +228,10 @@ class LocationBackend(str, Enum):
 
 
 class BaseLocationSettings(BaseModel):
-    pass
+    # Maximum number of items in a batch verification request
+    batch_max_items: PositiveInt = 1000
+    # Maximum number of locations retrieved at the same time for a batch
+    batch_concurrency: PositiveInt = 50
 
 
 class DisabledLocationSettings(BaseLocationSettings):
@@ -231,6 +246,12 @@ class NEFLocationSettings(BaseLocationSettings):
     backend: Literal[LocationBackend.Nef] = LocationBackend.Nef
     nef: NEFSettings
 
+    # Time during which a location fetched from the NEF is reused for requests
+    # whose maxAge allows it, 0 disables the cache
+    cache_secs: NonNegativeFloat = 60
+    # Maximum number of devices with a cached location
+    cache_size: PositiveInt = 10000
+
 
 type LocationSettings = Annotated[
     DisabledLocationSettings | MockLocationSettings | NEFLocationSettings,
@@ -327,6 +348,15 @@ class NefReachabilityStatusSettings(BaseReachabilityStatusSettings):
     backend: Literal[ReachabilityStatusBackend.Nef] = ReachabilityStatusBackend.Nef
     nef: NEFSettings
 
+    # Time to wait for each of the DATA and SMS probes before considering
+    # their connectivity unknown
+    probe_timeout_secs: PositiveFloat = 5
+    # Time during which the status of a device is reused instead of probing
+    # the NEF again, 0 disables the cache
+    cache_secs: NonNegativeFloat = 5
+    # Maximum number of devices with a cached status
+    cache_size: PositiveInt = 10000
+
 
 type ReachabilityStatusSettings = Annotated[
     DisabledReachabilityStatusSettings | NefReachabilityStatusSettings,
@@ -364,6 +394,133 @@ class RedisSettings(BaseModel):
     password: Optional[str] = None
 
 
+class SubscriptionsSettings(BaseModel):
+    # Maximum number of subscriptions returned in a single page, also used as
+    # the batch size when fetching subscriptions from redis
+    page_size: PositiveInt = 100
+
+    # Bounds for the time the expiry scheduler sleeps between runs, it sleeps
+    # until the next subscription is due but never less than the minimum or
+    # more than the maximum (in case the wake up published when a subscription
+    # is created was missed, such as while reconnecting to redis).
+    expiry_min_tick_secs: PositiveFloat = 0.1
+    expiry_max_tick_secs: PositiveFloat = 5
+    # Maximum number of expired subscriptions processed in a single run
+    expiry_batch_size: PositiveInt = 100
+    # Time to live of the lease that elects the replica processing expired
+    # subscriptions, renewed on every tick
+    expiry_lease_secs: PositiveFloat = 15
+
+    # Maximum number of devices or ids in a batch request
+    batch_max_items: PositiveInt = 1000
+    # Maximum number of subscriptions of a batch being created or deleted at
+    # the same time, which bounds the concurrent requests to the NEF
+    batch_concurrency: PositiveInt = 50
+
+    @model_validator(mode="after")
+    def check_expiry_lease(self) -> Self:
+        if self.expiry_lease_secs <= self.expiry_max_tick_secs:
+            raise ValueError(
+                "expiry_lease_secs must be larger than expiry_max_tick_secs, or the lease expires between ticks"
+            )
+
+        return self
+
+
+class CallbacksSettings(BaseModel):
+    # Maximum number of events waiting to be delivered to a single sink
+    queue_size: PositiveInt = 1000
+    # Time to wait for space in a full sink queue before dead lettering the event
+    enqueue_timeout_secs: PositiveFloat = 5
+    # Maximum number of concurrent deliveries to a single sink
+    workers_per_sink: PositiveInt = 4
+    # Time after which an idle sink worker exits
+    worker_idle_secs: PositiveFloat = 30
+    # Maximum number of concurrent deliveries across all sinks
+    max_in_flight: PositiveInt = 100
+
+    request_timeout_secs: PositiveFloat = 10
+    connect_timeout_secs: PositiveFloat = 5
+    max_retries: NonNegativeInt = 5
+    # Delay before the first retry, doubled on each retry up to the maximum
+    retry_backoff_secs: PositiveFloat = 0.5
+    retry_max_backoff_secs: PositiveFloat = 30
+
+    # Maximum number of undeliverable events kept in redis
+    dead_letter_max_length: PositiveInt = 10000
+    # Time to wait for the queues to drain when the gateway shuts down
+    shutdown_timeout_secs: PositiveFloat = 10
+
+    # Connection pool of each sink host, shared by all the APIs
+    # HTTP/2 requires the h2 package (`httpx[http2]`)
+    http2: bool = False
+    max_connections_per_host: PositiveInt = 20
+    max_keepalive_connections_per_host: PositiveInt = 10
+    keepalive_expiry_secs: PositiveFloat = 60
+    # Maximum number of hosts with a connection pool, the least recently used
+    # pools are closed when there are more hosts
+    max_pooled_hosts: PositiveInt = 1000
+
+    @field_validator("http2")
+    @classmethod
+    def check_http2(cls, http2: bool) -> bool:
+        if http2 and importlib.util.find_spec("h2") is None:
+            raise ValueError(
+                "HTTP/2 requires the h2 package, install httpx with the http2 extra"
+            )
+
+        return http2
+
+
+class NEFAuthSettings(BaseModel):
+    # Time before the token expires at which a new one is requested
+    refresh_margin_secs: NonNegativeFloat = 30
+    # Share the NEF tokens between the gateway replicas through redis
+    share_tokens: bool = False
+
+
+class QoSProfilesCacheSettings(BaseModel):
+    # Time during which the QoS profiles fetched from the NEF are used as is
+    ttl_secs: PositiveFloat = 300
+    # Time after the ttl during which the expired profiles are still used while
+    # they are refreshed in the background
+    stale_secs: NonNegativeFloat = 3600
+    # Share the profiles between the gateway replicas through redis
+    use_redis: bool = False
+
+
+class ReadinessSettings(BaseModel):
+    # Time during which the result of the readiness checks is reused
+    cache_secs: NonNegativeFloat = 5
+    # Time after which a check that didn't finish is considered failed
+    timeout_secs: PositiveFloat = 2
+
+
+class StandingMonitorsSettings(BaseModel):
+    # Whether the devices queried often get a long lived NEF subscription whose
+    # reports answer their one time queries (roaming, reachability, location)
+    enabled: bool = False
+    # Queries within `window_secs` after which a device gets a subscription
+    hot_queries: PositiveInt = 10
+    window_secs: PositiveInt = 60
+    # Time without queries after which the subscription of a device is deleted
+    idle_secs: PositiveFloat = 300
+    # Interval between the checks for idle subscriptions
+    retire_interval_secs: PositiveFloat = 30
+    # Age after which the last report of a subscription no longer answers the
+    # queries, which are then sent to the NEF
+    max_report_age_secs: PositiveFloat = 300
+
+
+class NotificationCoalescingSettings(BaseModel):
+    # Window during which the NEF notifications of a subscription are merged
+    # and handled once with their net result, 0 handles each one as it arrives
+    debounce_secs: NonNegativeFloat = 0
+    # Subscriptions waiting for their window to close after which the
+    # notifications are no longer delayed
+    max_pending: PositiveInt = 10000
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
         toml_file="config.toml",
@@ -375,6 +532,15 @@ class Settings(BaseSettings):
     log_level: LogLevel = "INFO"
 
     redis: RedisSettings = RedisSettings()
+    subscriptions: SubscriptionsSettings = SubscriptionsSettings()
+    callbacks: CallbacksSettings = CallbacksSettings()
+    nef_auth: NEFAuthSettings = NEFAuthSettings()
+    readiness: ReadinessSettings = ReadinessSettings()
+    qos_profiles_cache: QoSProfilesCacheSettings = QoSProfilesCacheSettings()
+    standing_monitors: StandingMonitorsSettings = StandingMonitorsSettings()
+    notification_coalescing: NotificationCoalescingSettings = (
+        NotificationCoalescingSettings()
+    )
 
     gateway_public_url: AnyHttpUrl = AnyHttpUrl("http://localhost:8000")
 
@@ -0,0 +1,125 @@
+from ipaddress import IPv6Address, IPv6Network
+from typing import List
+
+from redis.asyncio.client import Pipeline
+
+from app.redis import get_redis
+from app.schemas.device import Device, DeviceIpv4Addr
+
+_prefix = "deviceindex"
+
+
+def _msisdn(phone_number: str) -> str:
+    return f"msisdn:+{phone_number.strip().lstrip('+')}"
+
+
+def _nai(network_access_identifier: str) -> str:
+    # The domain part is case insensitive
+    nai = network_access_identifier.strip()
+    local, sep, domain = nai.rpartition("@")
+    return f"nai:{local}@{domain.lower()}" if sep else f"nai:{nai}"
+
+
+def _ipv4(address: DeviceIpv4Addr) -> List[str]:
+    identifiers = []
+    if address.privateAddress is not None:
+        identifiers.append(f"ipv4:{address.publicAddress}/{address.privateAddress}")
+    if address.publicPort is not None:
+        identifiers.append(f"ipv4:{address.publicAddress}:{address.publicPort}")
+
+    return identifiers
+
+
+def _ipv6(address: IPv6Address) -> str:
+    return f"ipv6:{IPv6Network((address, 64), strict=False)}"
+
+
+def device_identifiers(device: Device) -> List[str]:
+    """
+    Returns the normalised identifiers of a device, a device given with
+    different but equivalent identifiers yields the same values.
+
+    IPv4 addresses are only identifying together with the private address or
+    the public port, and IPv6 addresses are reduced to their /64 prefix since
+    any address of the subnet allocated to the device identifies it.
+    """
+    identifiers = []
+
+    if device.phoneNumber is not None:
+        identifiers.append(_msisdn(device.phoneNumber))
+    if device.networkAccessIdentifier is not None:
+        identifiers.append(_nai(device.networkAccessIdentifier))
+    if device.ipv4Address is not None:
+        identifiers.extend(_ipv4(device.ipv4Address))
+    if device.ipv6Address is not None:
+        identifiers.append(_ipv6(device.ipv6Address))
+
+    return identifiers
+
+
+def device_key(device: Device) -> str:
+    """
+    Returns the identifier of the device in the NEF requests (the phone
+    number, then the public IPv4 address, the IPv6 address and the network
+    access identifier), for state shared by the requests about a device such
+    as its NEF monitors.
+
+    It's exactly what the NEF is asked about, so the devices it can't tell
+    apart, like those behind the same public IPv4 address, share a key, and
+    a device given with different private addresses or ports doesn't get
+    several.
+    """
+    if device.phoneNumber is not None:
+        return _msisdn(device.phoneNumber)
+    elif device.ipv4Address is not None:
+        return f"ipv4:{device.ipv4Address.publicAddress}"
+    elif device.ipv6Address is not None:
+        return f"ipv6:{device.ipv6Address}"
+    elif device.networkAccessIdentifier is not None:
+        return f"nai:{device.networkAccessIdentifier}"
+
+    return ""
+
+
+class DeviceIndex:
+    """
+    Maps the identifiers of a device to the ids of the resources created for
+    it (sessions, subscriptions, ...).
+
+    Each identifier has a set of ids under its own key, namespaced so that
+    different APIs don't see each other's resources. A device is matched by
+    any of its identifiers, so a lookup returns the resources that share at
+    least one identifier with the given device.
+    """
+
+    def __init__(self, namespace: str) -> None:
+        self.namespace = namespace
+        self.redis = get_redis()
+
+    def keys(self, device: Device) -> List[str]:
+        return [
+            f"{_prefix}:{self.namespace}:{identifier}"
+            for identifier in device_identifiers(device)
+        ]
+
+    def add(self, p: Pipeline, device: Device, id: str) -> None:
+        """
+        Queues in `p` the commands that add the resource `id` to the index.
+        """
+        for key in self.keys(device):
+            p.sadd(key, id)
+
+    def remove(self, p: Pipeline, device: Device, id: str) -> None:
+        """
+        Queues in `p` the commands that remove the resource `id` from the index.
+        """
+        for key in self.keys(device):
+            p.srem(key, id)
+
+    async def lookup(self, device: Device) -> List[str]:
+        keys = self.keys(device)
+        if len(keys) == 0:
+            return []
+
+        ids: set[str] = await self.redis.sunion(keys)  # type: ignore [misc]
+        return list(ids)
@@ -0,0 +1,118 @@
+from typing import List
+
+from redis.asyncio.client import Pipeline
+
+from app.redis import get_redis
+from app.utils import geometry
+
+_prefix = "geoindex"
+
+# Upper bounds of the radius of the circles kept in each GEO set. A search
+# must look as far as the largest radius of a set, so grouping the circles by
+# size keeps the searches of the small circles from covering a huge area.
+# Larger circles are kept in an overflow set whose members are all candidates.
+_radius_buckets = [1_000, 10_000, 200_000]
+
+# Redis can't store points closer to the poles than this
+_max_latitude = 85.05112878
+
+
+def _bucket(radius_m: float) -> str:
+    bound = next((bound for bound in _radius_buckets if radius_m <= bound), None)
+    return "overflow" if bound is None else f"{bound:g}"
+
+
+class GeoIndex:
+    """
+    Maps circular areas to the ids of the resources created for them, stored
+    in redis GEO sets to find which areas contain a point or intersect a
+    circle without going through all of them.
+
+    The centers are kept in one GEO set per radius bucket, searched with the
+    largest radius of the bucket to find the candidates, which are then
+    checked exactly against their own radius. Centers closer to the poles
+    than ~85° are stored at the latitude limit of redis and may be missed.
+    """
+
+    def __init__(self, namespace: str) -> None:
+        self.namespace = namespace
+        self.redis = get_redis()
+
+        self.areas_key = f"{_prefix}:{namespace}:areas"
+
+    def _bucket_key(self, bucket: str) -> str:
+        return f"{_prefix}:{self.namespace}:{bucket}"
+
+    def add(self, p: Pipeline, area: geometry.CircleShape, id: str) -> None:
+        """
+        Queues in `p` the commands that add the resource `id` to the index.
+        """
+        lat = max(min(area.lat, _max_latitude), -_max_latitude)
+        p.geoadd(self._bucket_key(_bucket(area.radius_m)), [area.lon, lat, id])
+        p.hset(self.areas_key, id, f"{area.lat} {area.lon} {area.radius_m}")
+
+    def remove(self, p: Pipeline, area: geometry.CircleShape, id: str) -> None:
+        """
+        Queues in `p` the commands that remove the resource `id` from the index.
+        """
+        p.zrem(self._bucket_key(_bucket(area.radius_m)), id)
+        p.hdel(self.areas_key, id)
+
+    async def _candidates(
+        self, latitude: float, longitude: float, radius_m: float
+    ) -> dict[str, geometry.CircleShape]:
+        lat = max(min(latitude, _max_latitude), -_max_latitude)
+
+        async with self.redis.pipeline(transaction=False) as p:
+            for bound in _radius_buckets:
+                p.geosearch(
+                    self._bucket_key(f"{bound:g}"),
+                    longitude=longitude,
+                    latitude=lat,
+                    # Redis uses a sphere, leave room for the error
+                    radius=(radius_m + bound) * 1.01,
+                    unit="m",
+                )
+            p.zrange(self._bucket_key("overflow"), 0, -1)
+            results = await p.execute()
+
+        ids = [id for result in results for id in result]
+        if len(ids) == 0:
+            return {}
+
+        areas: List[str] = await self.redis.hmget(self.areas_key, ids)  # type: ignore [misc]
+
+        candidates = {}
+        for id, area in zip(ids, areas):
+            if area is None:
+                continue
+
+            area_lat, area_lon, area_radius = map(float, area.split())
+            candidates[id] = geometry.CircleShape(area_lat, area_lon, area_radius)
+
+        return candidates
+
+    async def containing(self, latitude: float, longitude: float) -> List[str]:
+        """
+        Returns the ids of the resources whose area contains the point.
+        """
+        candidates = await self._candidates(latitude, longitude, 0)
+
+        inside = geometry.classify(list(candidates.values()), latitude, longitude)
+        return [id for id, result in zip(candidates, inside) if result is not False]
+
+    async def intersecting(
+        self, latitude: float, longitude: float, radius_m: float
+    ) -> List[str]:
+        """
+        Returns the ids of the resources whose area intersects the circle.
+        """
+        area = geometry.CircleShape(latitude, longitude, radius_m)
+        candidates = await self._candidates(latitude, longitude, radius_m)
+
+        return [
+            id
+            for id, candidate in candidates.items()
+            if area.distance_m(candidate.lat, candidate.lon)
+            <= radius_m + candidate.radius_m
+        ]
@@ -0,0 +1,346 @@
+import math
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+from collections.abc import Callable, Sequence
+
+import geopy.distance
+
+from app.schemas.common import Point
+from app.schemas.location import Area, Circle, Polygon
+
+# Mean radius of the earth in meters
+EARTH_RADIUS_M = 6371008.8
+
+# Maximum relative difference between the haversine distance on a sphere and
+# the geodesic distance on the WGS-84 ellipsoid
+_haversine_error = 0.006
+
+# Points per axis sampled to estimate the overlap of shapes without a closed
+# form, the estimate is within a couple of percent which is enough for a
+# match rate given in whole percents
+_overlap_samples = 48
+
+
+def _wrap_lon(lon: float) -> float:
+    """
+    Normalises a longitude to [-180, 180).
+    """
+    return (lon + 180) % 360 - 180
+
+
+@dataclass(frozen=True)
+class BoundingBox:
+    """
+    Latitude and longitude bounds of a shape. When the shape crosses the
+    antimeridian `min_lon` is greater than `max_lon`, the longitudes going
+    east from `min_lon` to 180 and then from -180 to `max_lon`.
+    """
+
+    min_lat: float
+    min_lon: float
+    max_lat: float
+    max_lon: float
+
+    def _lon_ranges(self) -> list[tuple[float, float]]:
+        if self.min_lon <= self.max_lon:
+            return [(self.min_lon, self.max_lon)]
+
+        return [(self.min_lon, 180), (-180, self.max_lon)]
+
+    def contains(self, lat: float, lon: float) -> bool:
+        if not self.min_lat <= lat <= self.max_lat:
+            return False
+
+        if self.min_lon <= self.max_lon:
+            return self.min_lon <= lon <= self.max_lon
+
+        return lon >= self.min_lon or lon <= self.max_lon
+
+    def intersects(self, other: "BoundingBox") -> bool:
+        if self.min_lat > other.max_lat or other.min_lat > self.max_lat:
+            return False
+
+        return any(
+            min1 <= max2 and min2 <= max1
+            for min1, max1 in self._lon_ranges()
+            for min2, max2 in other._lon_ranges()
+        )
+
+
+class Projection:
+    """
+    Equirectangular projection to meters around a point, accurate enough for
+    areas spanning up to a few hundred kilometers.
+    """
+
+    def __init__(self, lat: float, lon: float) -> None:
+        self.lat = lat
+        self.lon = lon
+        self.cos_lat = math.cos(math.radians(lat))
+
+    def project(self, lat: float, lon: float) -> tuple[float, float]:
+        x = math.radians(_wrap_lon(lon - self.lon)) * self.cos_lat * EARTH_RADIUS_M
+        y = math.radians(lat - self.lat) * EARTH_RADIUS_M
+        return x, y
+
+
+class Shape(ABC):
+    bbox: BoundingBox
+
+    @abstractmethod
+    def contains(self, lat: float, lon: float) -> bool:
+        pass
+
+    @abstractmethod
+    def area_m2(self) -> float:
+        pass
+
+    @abstractmethod
+    def projected_contains(
+        self, projection: Projection
+    ) -> Callable[[float, float], bool]:
+        """
+        Returns a test for the points of the projection inside the shape.
+        """
+        pass
+
+
+class CircleShape(Shape):
+    def __init__(self, lat: float, lon: float, radius_m: float) -> None:
+        self.lat = lat
+        self.lon = lon
+        self.radius_m = radius_m
+
+        self.lat_rad = math.radians(lat)
+        self.lon_rad = math.radians(lon)
+        self.cos_lat = math.cos(self.lat_rad)
+
+        # Enlarged by the error of the spherical approximation, so that it
+        # also bounds the circle on the ellipsoid
+        angle = radius_m * (1 + _haversine_error) / EARTH_RADIUS_M
+        dlat = math.degrees(angle)
+        if abs(lat) + dlat < 90:
+            dlon = math.degrees(math.asin(math.sin(angle) / self.cos_lat))
+        else:
+            # Contains a pole
+            dlon = 180
+
+        if dlon >= 180:
+            min_lon, max_lon = -180.0, 180.0
+        else:
+            min_lon, max_lon = _wrap_lon(lon - dlon), _wrap_lon(lon + dlon)
+
+        self.bbox = BoundingBox(
+            min_lat=lat - dlat,
+            min_lon=min_lon,
+            max_lat=lat + dlat,
+            max_lon=max_lon,
+        )
+
+    def distance_m(self, lat: float, lon: float) -> float:
+        """
+        Geodesic distance in meters from the center to the point.
+        """
+        return float(geopy.distance.geodesic((self.lat, self.lon), (lat, lon)).m)
+
+    def contains(self, lat: float, lon: float) -> bool:
+        return classify([self], lat, lon)[0] is not False
+
+    def area_m2(self) -> float:
+        return math.pi * self.radius_m**2
+
+    def projected_contains(
+        self, projection: Projection
+    ) -> Callable[[float, float], bool]:
+        cx, cy = projection.project(self.lat, self.lon)
+        r2 = self.radius_m**2
+        return lambda x, y: (x - cx) ** 2 + (y - cy) ** 2 <= r2
+
+
+class PolygonShape(Shape):
+    def __init__(self, points: Sequence[tuple[float, float]]) -> None:
+        if len(points) < 3:
+            raise ValueError("A polygon needs at least 3 points")
+
+        self.points = list(points)
+
+        # Edges take the shortest way between their points, so the longitudes
+        # are unwrapped along the boundary, going past 180 when it crosses the
+        # antimeridian
+        lons = [self.points[0][1]]
+        for _, lon in self.points[1:]:
+            lons.append(lons[-1] + _wrap_lon(lon - lons[-1]))
+        self._vertices = [(lon, lat) for (lat, _), lon in zip(self.points, lons)]
+        self._center_lon = (min(lons) + max(lons)) / 2
+
+        lats = [lat for lat, _ in self.points]
+        if max(lons) - min(lons) >= 360:
+            min_lon, max_lon = -180.0, 180.0
+        else:
+            min_lon, max_lon = _wrap_lon(min(lons)), _wrap_lon(max(lons))
+        self.bbox = BoundingBox(
+            min_lat=min(lats),
+            min_lon=min_lon,
+            max_lat=max(lats),
+            max_lon=max_lon,
+        )
+
+    def contains(self, lat: float, lon: float) -> bool:
+        if not self.bbox.contains(lat, lon):
+            return False
+
+        lon = self._center_lon + _wrap_lon(lon - self._center_lon)
+        return _point_in_polygon(lon, lat, self._vertices)
+
+    def area_m2(self) -> float:
+        projection = Projection(*_bbox_center(self.bbox))
+        vertices = [projection.project(lat, lon) for lat, lon in self.points]
+
+        # Shoelace formula
+        area = 0.0
+        for (x1, y1), (x2, y2) in zip(vertices, vertices[1:] + vertices[:1]):
+            area += x1 * y2 - x2 * y1
+
+        return abs(area) / 2
+
+    def projected_contains(
+        self, projection: Projection
+    ) -> Callable[[float, float], bool]:
+        vertices = [projection.project(lat, lon) for lat, lon in self.points]
+        return lambda x, y: _point_in_polygon(x, y, vertices)
+
+
+def _point_in_polygon(x: float, y: float, vertices: list[tuple[float, float]]) -> bool:
+    # Even-odd rule, counts the edges crossed by a ray going right from the point
+    inside = False
+    for (x1, y1), (x2, y2) in zip(vertices, vertices[-1:] + vertices[:-1]):
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+
+    return inside
+
+
+def classify(
+    circles: Sequence[CircleShape], lat: float, lon: float
+) -> list[Optional[bool]]:
+    """
+    Evaluates the position of a point against several circles at once,
+    returning for each circle whether the point is inside, or None if it's
+    exactly on the border.
+
+    Circles whose bounding box doesn't contain the point are rejected right
+    away. The others are decided with the haversine distance, and only those
+    where the point is too close to the border for the error of the spherical
+    approximation fall back to the geodesic distance.
+    """
+    lat_rad = math.radians(lat)
+    lon_rad = math.radians(lon)
+    cos_lat = math.cos(lat_rad)
+    lon = _wrap_lon(lon)
+
+    results: list[Optional[bool]] = []
+    for circle in circles:
+        if not circle.bbox.contains(lat, lon):
+            results.append(False)
+            continue
+
+        a = (
+            math.sin((lat_rad - circle.lat_rad) / 2) ** 2
+            + cos_lat * circle.cos_lat * math.sin((lon_rad - circle.lon_rad) / 2) ** 2
+        )
+        d = 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1)))
+
+        if d * (1 + _haversine_error) < circle.radius_m:
+            results.append(True)
+        elif d * (1 - _haversine_error) > circle.radius_m:
+            results.append(False)
+        else:
+            d = circle.distance_m(lat, lon)
+            results.append(None if d == circle.radius_m else d < circle.radius_m)
+
+    return results
+
+
+def _bbox_center(bbox: BoundingBox) -> tuple[float, float]:
+    width = bbox.max_lon - bbox.min_lon
+    if width < 0:
+        width += 360
+    return (bbox.min_lat + bbox.max_lat) / 2, _wrap_lon(bbox.min_lon + width / 2)
+
+
+def _circles_overlap(network: CircleShape, requested: CircleShape) -> float:
+    r1 = network.radius_m
+    r2 = requested.radius_m
+    d = network.distance_m(requested.lat, requested.lon)
+
+    if d >= r1 + r2:
+        return 0
+    if d <= r2 - r1:
+        return 1
+    if d <= r1 - r2:
+        return r2**2 / r1**2
+
+    # Area of the lens where the circles intersect
+    a1 = r1**2 * math.acos((d**2 + r1**2 - r2**2) / (2 * d * r1))
+    a2 = r2**2 * math.acos((d**2 + r2**2 - r1**2) / (2 * d * r2))
+    a3 = 0.5 * math.sqrt((-d + r1 + r2) * (d + r1 - r2) * (d - r1 + r2) * (d + r1 + r2))
+
+    return (a1 + a2 - a3) / network.area_m2()
+
+
+def _sampled_overlap(network: Shape, requested: Shape) -> float:
+    projection = Projection(*_bbox_center(network.bbox))
+    x0, y0 = projection.project(network.bbox.min_lat, network.bbox.min_lon)
+    x1, y1 = projection.project(network.bbox.max_lat, network.bbox.max_lon)
+    in_network = network.projected_contains(projection)
+    in_requested = requested.projected_contains(projection)
+
+    inside_network = 0
+    inside_both = 0
+    for i in range(_overlap_samples):
+        x = x0 + (x1 - x0) * (i + 0.5) / _overlap_samples
+        for j in range(_overlap_samples):
+            y = y0 + (y1 - y0) * (j + 0.5) / _overlap_samples
+
+            if not in_network(x, y):
+                continue
+
+            inside_network += 1
+            if in_requested(x, y):
+                inside_both += 1
+
+    if inside_network == 0:
+        return 0
+
+    return inside_both / inside_network
+
+
+def overlap(network: Shape, requested: Shape) -> float:
+    """
+    Returns the fraction of the `network` area that is inside the `requested`
+    area, between 0 (disjoint) and 1 (fully contained).
+    """
+    if not network.bbox.intersects(requested.bbox):
+        return 0
+
+    if isinstance(network, CircleShape) and isinstance(requested, CircleShape):
+        return _circles_overlap(network, requested)
+
+    return _sampled_overlap(network, requested)
+
+
+def circle(center: Point, radius_m: float) -> CircleShape:
+    return CircleShape(center.latitude, center.longitude, radius_m)
+
+
+def from_area(area: Area) -> Shape:
+    if isinstance(area, Circle):
+        return circle(area.center, area.radius)
+
+    if isinstance(area, Polygon):
+        return PolygonShape(
+            [(point.latitude, point.longitude) for point in area.boundary]
+        )
+
+    raise ValueError(f"Unsupported area type {area.areaType}")
@@ -0,0 +1,79 @@
+import asyncio
+from collections import OrderedDict
+
+import httpx
+
+from app.metrics import InstrumentedTransport
+from app.settings import CallbacksSettings, settings
+
+
+class OutboundClients:
+    """
+    HTTP clients used to reach the application sinks, shared by every driver.
+
+    There's one client per origin (scheme, host and port) so that the
+    connection limits apply per host and connections to a sink are reused
+    no matter which API is sending events to it. The least recently used
+    clients are closed once there are more than `max_pooled_hosts`.
+    """
+
+    def __init__(self, callbacks_settings: CallbacksSettings) -> None:
+        self.settings = callbacks_settings
+
+        self._clients: OrderedDict[tuple[str, str, int | None], httpx.AsyncClient] = (
+            OrderedDict()
+        )
+        self._closing: set[asyncio.Task[None]] = set()
+
+    def client_for(self, url: str) -> httpx.AsyncClient:
+        parsed = httpx.URL(url)
+        origin = (parsed.scheme, parsed.host, parsed.port)
+
+        client = self._clients.get(origin)
+        if client is not None:
+            self._clients.move_to_end(origin)
+            return client
+
+        transport = httpx.AsyncHTTPTransport(
+            http2=self.settings.http2,
+            limits=httpx.Limits(
+                max_connections=self.settings.max_connections_per_host,
+                max_keepalive_connections=self.settings.max_keepalive_connections_per_host,
+                keepalive_expiry=self.settings.keepalive_expiry_secs,
+            ),
+        )
+        client = httpx.AsyncClient(
+            transport=InstrumentedTransport("sink", transport),
+            timeout=httpx.Timeout(
+                self.settings.request_timeout_secs,
+                connect=self.settings.connect_timeout_secs,
+            ),
+        )
+        self._clients[origin] = client
+
+        if len(self._clients) > self.settings.max_pooled_hosts:
+            _, evicted = self._clients.popitem(last=False)
+            task = asyncio.create_task(self._close_later(evicted))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+        return client
+
+    async def close(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+
+        for client in clients:
+            await client.aclose()
+
+    async def _close_later(self, client: httpx.AsyncClient) -> None:
+        # Give the requests still using the client time to finish
+        await asyncio.sleep(self.settings.request_timeout_secs)
+        await client.aclose()
+
+
+_outbound_clients = OutboundClients(settings.callbacks)
+
+
+def get_outbound_clients() -> OutboundClients:
+    return _outbound_clients
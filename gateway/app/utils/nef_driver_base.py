@@ -1,22 +1,16 @@
-import httpx
 import logging
 
 from pydantic import AnyUrl
 
 from app.settings import NEFSettings
 from app.schemas.device import Device
-from app.drivers.nef_auth import NEFAuth
+from app.drivers.nef_auth import get_nef_client
 from app.schemas.nef_schemas.monitoringevent import MonitoringEventSubscription
 
 
 class NefDriverBase:
     def __init__(self, nef_settings: NEFSettings) -> None:
-        nef_auth = NEFAuth(
-            nef_settings.url, nef_settings.username, nef_settings.password
-        )
-        self.httpx_client = httpx.AsyncClient(
-            base_url=nef_settings.get_base_url(), auth=nef_auth
-        )
+        self.httpx_client = get_nef_client(nef_settings)
 
         self.af_id = nef_settings.gateway_af_id
 
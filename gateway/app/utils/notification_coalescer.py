@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import Optional
+from collections.abc import Awaitable, Callable
+
+from app.metrics import coalesced_notifications
+from app.settings import NotificationCoalescingSettings, settings
+
+LOG = logging.getLogger(__name__)
+
+
+def keep_latest[T](_: T, new: T) -> T:
+    return new
+
+
+class NotificationCoalescer[T]:
+    """
+    Collapses the notifications received for the same key (usually a
+    subscription) within `debounce_secs` of each other into a single call of
+    `handler`, so that a burst of reports is handled once with its net result.
+
+    The first notification of a key opens a window that closes `debounce_secs`
+    later, the notifications received while it's open are combined with the
+    pending one by `merge`, which keeps the latest by default. The windows of
+    a key are handled in order, one at a time. Keys are only coalesced within
+    this process, and when `max_pending` keys are already waiting the
+    notification is handled right away, after the earlier windows of its key.
+    When the window is 0 notifications aren't coalesced at all.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[str, T], Awaitable[None]],
+        merge: Callable[[T, T], T] = keep_latest,
+        coalescing_settings: NotificationCoalescingSettings = settings.notification_coalescing,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.merge = merge
+        self.settings = coalescing_settings
+
+        self._pending: dict[str, T] = {}
+        self._tasks: dict[str, asyncio.Task[None]] = {}
+        self._closing = asyncio.Event()
+
+    async def submit(self, key: str, notification: T) -> None:
+        pending = self._pending.get(key)
+        if pending is not None:
+            self._pending[key] = self.merge(pending, notification)
+            coalesced_notifications.labels(self.name).inc()
+            return
+
+        if self.settings.debounce_secs == 0:
+            await self.handler(key, notification)
+            return
+
+        previous = self._tasks.get(key)
+        if self._closing.is_set() or len(self._pending) >= self.settings.max_pending:
+            # Not delayed, but still handled after the earlier windows of the key
+            task = asyncio.create_task(self._handle_after(key, notification, previous))
+            self._track(key, task)
+            await task
+            return
+
+        self._pending[key] = notification
+        self._track(key, asyncio.create_task(self._flush_later(key, previous)))
+
+    def _track(self, key: str, task: asyncio.Task[None]) -> None:
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._forget(key, task))
+
+    def _forget(self, key: str, task: asyncio.Task[None]) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    async def _flush_later(
+        self, key: str, previous: Optional[asyncio.Task[None]]
+    ) -> None:
+        try:
+            await asyncio.wait_for(
+                self._closing.wait(), timeout=self.settings.debounce_secs
+            )
+        except TimeoutError:
+            pass
+
+        # The previous window of the key might still be being handled
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        await self._handle(key, self._pending.pop(key))
+
+    async def _handle_after(
+        self, key: str, notification: T, previous: Optional[asyncio.Task[None]]
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        await self._handle(key, notification)
+
+    async def _handle(self, key: str, notification: T) -> None:
+        try:
+            await self.handler(key, notification)
+        except Exception as e:
+            LOG.exception("Failed to handle %s notification: %s", self.name, e)
+
+    async def close(self) -> None:
+        """
+        Handles the pending notifications without waiting for their windows
+        to close.
+        """
+        self._closing.set()
+
+        tasks = list(self._tasks.values())
+        if len(tasks) != 0:
+            await asyncio.wait(tasks)
+
+        self._closing = asyncio.Event()
@@ -0,0 +1,114 @@
+import uuid
+import socket
+import asyncio
+import logging
+from types import TracebackType
+from typing import Optional
+
+from app.redis import get_redis
+
+LOG = logging.getLogger(__name__)
+
+_prefix = "lease"
+
+# Extends the lease if it's still held by the given owner
+_renew_script = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Deletes the lease if it's still held by the given owner
+_release_script = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLease:
+    """
+    A lease stored in redis that is held by at most one gateway replica at a
+    time, used to elect the replica that runs a background task.
+
+    The lease expires on its own if the holder stops renewing it, so a replica
+    that crashes is replaced after at most `ttl_secs`.
+    """
+
+    def __init__(self, name: str, ttl_secs: float) -> None:
+        self.name = name
+        self.key = f"{_prefix}:{name}"
+        self.owner = f"{socket.gethostname()}:{uuid.uuid4()}"
+        self.ttl_ms = int(ttl_secs * 1000)
+
+        self.redis = get_redis()
+        self._renew = self.redis.register_script(_renew_script)
+        self._release = self.redis.register_script(_release_script)
+
+        self.held = False
+
+    async def acquire(self) -> bool:
+        """
+        Renews the lease if this replica holds it, otherwise tries to take it.
+        Returns whether this replica holds the lease.
+        """
+        held = bool(
+            await self._renew(keys=[self.key], args=[self.owner, self.ttl_ms])
+        ) or bool(await self.redis.set(self.key, self.owner, nx=True, px=self.ttl_ms))
+
+        if held != self.held:
+            LOG.info("%s lease %s", "Acquired" if held else "Lost", self.name)
+        self.held = held
+
+        return held
+
+    async def release(self) -> None:
+        await self._release(keys=[self.key], args=[self.owner])
+        self.held = False
+
+    async def release_if_held(self) -> None:
+        """
+        Releases the lease if this replica holds it, logging the failures
+        instead of raising since it's used when shutting down.
+        """
+        if not self.held:
+            return
+
+        try:
+            await self.release()
+            LOG.info("Released lease %s", self.name)
+        except Exception as e:
+            LOG.warning("Failed to release lease %s: %s", self.name, e)
+
+
+class RedisLock:
+    """
+    A lock stored in redis for short critical sections that must not run
+    concurrently in different gateway replicas.
+
+    The lock expires after `ttl_secs` so that it isn't held forever by a
+    replica that crashes while holding it.
+    """
+
+    def __init__(self, name: str, ttl_secs: float, retry_secs: float = 0.05) -> None:
+        self.key = f"{_prefix}:{name}"
+        self.owner = f"{socket.gethostname()}:{uuid.uuid4()}"
+        self.ttl_ms = int(ttl_secs * 1000)
+        self.retry_secs = retry_secs
+
+        self.redis = get_redis()
+        self._release = self.redis.register_script(_release_script)
+
+    async def __aenter__(self) -> None:
+        while not await self.redis.set(self.key, self.owner, nx=True, px=self.ttl_ms):
+            await asyncio.sleep(self.retry_secs)
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        await self._release(keys=[self.key], args=[self.owner])
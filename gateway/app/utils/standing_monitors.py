@@ -0,0 +1,289 @@
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Never, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import AnyUrl, BaseModel
+
+from app.drivers.nef_auth import get_nef_client
+from app.redis import get_redis
+from app.schemas.nef_schemas.monitoringevent import (
+    MonitoringEventReport,
+    MonitoringEventSubscription,
+    MonitoringNotification,
+)
+from app.settings import NEFSettings, StandingMonitorsSettings, settings
+from app.utils.redis_lease import RedisLease, RedisLock
+
+LOG = logging.getLogger(__name__)
+
+_prefix_hits = "standing_monitor_hits"
+_prefix_monitor = "standing_monitor"
+_prefix_device = "standing_monitor_device"
+_prefix_nef_url = "standing_monitor_nef_url"
+_prefix_report = "standing_monitor_report"
+_prefix_last_used = "standing_monitor_last_used"
+
+# Time after which the lock of a monitor is released if its holder crashed
+_monitor_lock_secs = 30
+
+_standing_monitors: dict[str, "StandingMonitors"] = {}
+
+
+class StandingReport(BaseModel):
+    received_at: datetime
+    report: MonitoringEventReport
+
+
+class StandingMonitors:
+    """
+    Long lived NEF subscriptions for the devices that are queried often, so
+    that their one time queries are answered from the last report pushed by
+    the NEF instead of creating a subscription for each query.
+
+    A device becomes hot after `hot_queries` queries within `window_secs`, at
+    which point a subscription reporting continuously is created for it. The
+    subscription is deleted once the device hasn't been queried for
+    `idle_secs`. Each `kind` of query has its own subscriptions.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        nef_settings: NEFSettings,
+        subscriptions_path: str,
+        monitors_settings: StandingMonitorsSettings = settings.standing_monitors,
+    ) -> None:
+        self.kind = kind
+        self.httpx_client = get_nef_client(nef_settings)
+        self.subscriptions_path = subscriptions_path
+        self.notification_url = nef_settings.get_notification_url()
+        self.settings = monitors_settings
+
+        self.redis = get_redis()
+        # Monitors scored by the time of their last query
+        self.last_used_key = f"{_prefix_last_used}:{kind}"
+        # Only the replica holding the lease retires the idle monitors
+        self._retire_lease = RedisLease(
+            f"{_prefix_monitor}_{kind}", monitors_settings.retire_interval_secs * 3
+        )
+
+        self._starting: dict[str, asyncio.Task[None]] = {}
+
+        _standing_monitors[kind] = self
+
+    def _monitor_key(self, device_key: str) -> str:
+        return f"{_prefix_monitor}:{self.kind}:{device_key}"
+
+    async def lookup(
+        self, device_key: str, subscription: MonitoringEventSubscription
+    ) -> Optional[StandingReport]:
+        """
+        Counts a query for the device and returns the last report of its
+        monitor, if it has one received in the last `max_report_age_secs`.
+
+        `subscription` is the one time subscription that answers the query
+        otherwise, it's used as the template of the monitor when the device
+        becomes hot.
+        """
+        if not self.settings.enabled or device_key == "":
+            return None
+
+        hits_key = f"{_prefix_hits}:{self.kind}:{device_key}"
+        async with self.redis.pipeline(transaction=False) as p:
+            p.set(hits_key, 0, ex=self.settings.window_secs, nx=True)
+            p.incr(hits_key)
+            p.get(self._monitor_key(device_key))
+            _, hits, monitor_id = await p.execute()
+
+        if monitor_id is not None:
+            async with self.redis.pipeline(transaction=False) as p:
+                p.zadd(self.last_used_key, {monitor_id: time.time()}, xx=True)
+                p.get(f"{_prefix_report}:{monitor_id}")
+                _, report = await p.execute()
+
+            if report is None:
+                return None
+
+            standing = StandingReport.model_validate_json(report)
+            age = datetime.now(timezone.utc) - standing.received_at
+            if age.total_seconds() > self.settings.max_report_age_secs:
+                return None
+
+            return standing
+
+        if hits >= self.settings.hot_queries and device_key not in self._starting:
+            task = asyncio.create_task(self._start(device_key, subscription))
+            self._starting[device_key] = task
+            task.add_done_callback(lambda _: self._starting.pop(device_key, None))
+
+        return None
+
+    async def _start(
+        self, device_key: str, subscription: MonitoringEventSubscription
+    ) -> None:
+        monitor_key = self._monitor_key(device_key)
+
+        async with RedisLock(monitor_key, _monitor_lock_secs):
+            if await self.redis.exists(monitor_key):
+                return
+
+            monitor_id = str(uuid.uuid4())
+            device_key_key = f"{_prefix_device}:{monitor_id}"
+
+            # Stored before creating the subscription so that its immediate
+            # report isn't taken as a report for an unknown monitor
+            await self.redis.set(device_key_key, device_key, ex=_monitor_lock_secs)
+
+            body = subscription.model_copy(
+                update={
+                    "notificationDestination": AnyUrl(
+                        f"{self.notification_url}/callbacks/v1/monitors/{self.kind}/{monitor_id}"
+                    ),
+                    "maximumNumberOfReports": None,
+                    "monitorExpireTime": datetime.max,
+                    "immediateRep": True,
+                }
+            )
+
+            try:
+                res = await self.httpx_client.post(
+                    self.subscriptions_path,
+                    json=jsonable_encoder(body, exclude_unset=True, exclude_none=True),
+                )
+
+                if not res.is_success:
+                    LOG.error(
+                        "Failed to create standing %s subscription (%d): %s",
+                        self.kind,
+                        res.status_code,
+                        res.content,
+                    )
+                    await self.redis.delete(device_key_key)
+                    return
+
+                created = MonitoringEventSubscription.model_validate_json(res.content)
+                if created.self is None:
+                    LOG.error("No 'self' in monitoring subscription response")
+                    await self.redis.delete(device_key_key)
+                    return
+            except Exception as e:
+                LOG.error("Failed to create standing %s subscription: %s", self.kind, e)
+                await self.redis.delete(device_key_key)
+                return
+
+            async with self.redis.pipeline(transaction=True) as p:
+                p.set(monitor_key, monitor_id)
+                p.set(device_key_key, device_key)
+                p.set(f"{_prefix_nef_url}:{monitor_id}", created.self.unicode_string())
+                p.zadd(self.last_used_key, {monitor_id: time.time()})
+                await p.execute()
+
+        LOG.debug("Started standing %s monitor for %s", self.kind, device_key)
+
+    async def store_reports(
+        self, monitor_id: str, notification: MonitoringNotification
+    ) -> None:
+        """
+        Keeps the last report of a notification sent to the monitor.
+        """
+        if notification.monitoringEventReports is None:
+            LOG.debug("Received notification with no event reports")
+            return
+
+        if not await self.redis.exists(f"{_prefix_device}:{monitor_id}"):
+            LOG.warning("Received notification for non existing monitor")
+            asyncio.create_task(
+                self._delete_nef_subscription(str(notification.subscription))
+            )
+            return
+
+        report = StandingReport(
+            received_at=datetime.now(timezone.utc),
+            report=notification.monitoringEventReports[-1],
+        )
+        await self.redis.set(f"{_prefix_report}:{monitor_id}", report.model_dump_json())
+
+    async def retire_idle(self) -> None:
+        """
+        Deletes the monitors that weren't queried in the last `idle_secs`.
+        """
+        deadline = time.time() - self.settings.idle_secs
+        idle = await self.redis.zrangebyscore(self.last_used_key, "-inf", deadline)
+
+        for monitor_id in idle:
+            # Claim the monitor so that it's retired exactly once
+            if await self.redis.zrem(self.last_used_key, monitor_id) == 0:
+                continue
+
+            device_key_key = f"{_prefix_device}:{monitor_id}"
+            nef_url_key = f"{_prefix_nef_url}:{monitor_id}"
+            monitor_keys = [
+                device_key_key,
+                nef_url_key,
+                f"{_prefix_report}:{monitor_id}",
+            ]
+
+            device_key = await self.redis.get(device_key_key)
+            if device_key is None:
+                # Already torn down, only the keys of the monitor might be left
+                nef_subscription_url = await self._delete_keys(
+                    nef_url_key, monitor_keys
+                )
+            else:
+                monitor_key = self._monitor_key(device_key)
+                async with RedisLock(monitor_key, _monitor_lock_secs):
+                    nef_subscription_url = await self._delete_keys(
+                        nef_url_key, [monitor_key, *monitor_keys]
+                    )
+
+            if nef_subscription_url is not None:
+                await self._delete_nef_subscription(nef_subscription_url)
+
+            LOG.debug("Retired standing %s monitor for %s", self.kind, device_key)
+
+    async def _delete_keys(self, nef_url_key: str, keys: list[str]) -> Optional[str]:
+        """
+        Deletes the keys, returning the NEF subscription url stored under
+        `nef_url_key` before.
+        """
+        async with self.redis.pipeline(transaction=True) as p:
+            p.get(nef_url_key)
+            p.delete(*keys)
+            results = await p.execute()
+
+        nef_subscription_url: Optional[str] = results[0]
+        return nef_subscription_url
+
+    async def _delete_nef_subscription(self, sub_url: str) -> None:
+        res = await self.httpx_client.delete(sub_url)
+
+        if not res.is_success and res.status_code != 404:
+            LOG.error(
+                "Failed to delete NEF subscription (code: %d): %s",
+                res.status_code,
+                res.content,
+            )
+
+
+def get_standing_monitors(kind: str) -> Optional[StandingMonitors]:
+    return _standing_monitors.get(kind)
+
+
+async def retire_loop() -> Never:
+    try:
+        while True:
+            for monitors in list(_standing_monitors.values()):
+                try:
+                    if await monitors._retire_lease.acquire():
+                        await monitors.retire_idle()
+                except Exception as e:
+                    LOG.error(e)
+
+            await asyncio.sleep(settings.standing_monitors.retire_interval_secs)
+    finally:
+        for monitors in list(_standing_monitors.values()):
+            await monitors._retire_lease.release_if_held()
@@ -0,0 +1,122 @@
+from http import HTTPStatus
+from typing import Protocol
+
+from app.exception_handlers import error_info
+from app.exceptions import ApiException, BadRequest, UnsupportedIdentifier
+from app.schemas.device import Device
+from app.schemas.subscriptions import (
+    BatchDeleteSubscriptionResult,
+    BatchDeleteSubscriptionsRequest,
+    BatchDeleteSubscriptionsResponse,
+    BatchSubscriptionRequest,
+    BatchSubscriptionResponse,
+    BatchSubscriptionResult,
+    DeviceSubscriptionDetail,
+    Protocol as SubscriptionProtocol,
+    Subscription,
+    SubscriptionRequest,
+)
+from app.settings import settings
+
+
+class BatchSubscriptionInterface[
+    SubscriptionEventType: str,
+    SubscriptionDetail: DeviceSubscriptionDetail,
+](Protocol):
+    async def create_subscriptions(
+        self,
+        req: SubscriptionRequest[SubscriptionEventType, SubscriptionDetail],
+        devices: list[Device],
+    ) -> list[Subscription[SubscriptionEventType, SubscriptionDetail] | BaseException]:
+        pass
+
+    async def delete_subscriptions(
+        self, sub_ids: list[str]
+    ) -> list[None | BaseException]:
+        pass
+
+
+async def create_subscriptions_batch[
+    SubscriptionEventType: str,
+    SubscriptionDetail: DeviceSubscriptionDetail,
+](
+    body: BatchSubscriptionRequest[SubscriptionEventType, SubscriptionDetail],
+    subscription_interface: BatchSubscriptionInterface[
+        SubscriptionEventType, SubscriptionDetail
+    ],
+) -> BatchSubscriptionResponse[SubscriptionEventType, SubscriptionDetail]:
+    """
+    Creates a subscription with the same config for each of the devices of
+    `body`, a failure only affects its own device, which gets an error
+    instead of a subscription.
+    """
+    req = body.subscription
+    if req.protocol != SubscriptionProtocol.HTTP:
+        raise ApiException(
+            status=HTTPStatus.BAD_REQUEST,
+            code="INVALID_PROTOCOL",
+            message="Only HTTP is supported.",
+        )
+
+    if len(body.devices) > settings.subscriptions.batch_max_items:
+        raise BadRequest(
+            f"At most {settings.subscriptions.batch_max_items} devices can be subscribed at once."
+        )
+
+    if req.config.subscriptionDetail.device is not None:
+        raise BadRequest(
+            "The subscription detail must not include a device, the devices are given separately."
+        )
+
+    results: list[
+        Subscription[SubscriptionEventType, SubscriptionDetail] | BaseException
+    ] = [UnsupportedIdentifier() for _ in body.devices]
+
+    supported = [
+        (i, device)
+        for i, device in enumerate(body.devices)
+        if device.networkAccessIdentifier is None
+    ]
+    devices = [device for _, device in supported]
+    created = await subscription_interface.create_subscriptions(req, devices)
+    for (i, _), result in zip(supported, created):
+        results[i] = result
+
+    return BatchSubscriptionResponse(
+        results=[
+            BatchSubscriptionResult(error=error_info(result))
+            if isinstance(result, BaseException)
+            else BatchSubscriptionResult(subscription=result)
+            for result in results
+        ]
+    )
+
+
+async def delete_subscriptions_batch[
+    SubscriptionEventType: str,
+    SubscriptionDetail: DeviceSubscriptionDetail,
+](
+    body: BatchDeleteSubscriptionsRequest,
+    subscription_interface: BatchSubscriptionInterface[
+        SubscriptionEventType, SubscriptionDetail
+    ],
+) -> BatchDeleteSubscriptionsResponse:
+    """
+    Deletes the subscriptions of `body`, a failure only affects its own id.
+    """
+    if len(body.subscriptionIds) > settings.subscriptions.batch_max_items:
+        raise BadRequest(
+            f"At most {settings.subscriptions.batch_max_items} subscriptions can be deleted at once."
+        )
+
+    results = await subscription_interface.delete_subscriptions(body.subscriptionIds)
+
+    return BatchDeleteSubscriptionsResponse(
+        results=[
+            BatchDeleteSubscriptionResult(
+                subscriptionId=sub_id,
+                error=error_info(result) if result is not None else None,
+            )
+            for sub_id, result in zip(body.subscriptionIds, results)
+        ]
+    )
@@ -1,29 +1,26 @@
 import uuid
-import asyncio
 from datetime import datetime, timezone
 
-import httpx
 from fastapi.encoders import jsonable_encoder
 
+from app.metrics import track_operation
 from app.schemas.subscriptions import CloudEvent, Subscription
+from app.utils.webhook_delivery import get_webhook_delivery
 
 
 class SubscriptionDriverBase[NotificationEventType: str, CloudEventData]:
     def __init__(self, source: str) -> None:
         super().__init__()
 
-        self.httpx_client_callback = httpx.AsyncClient()
+        self.webhook_delivery = get_webhook_delivery()
 
         self.source = source
 
-    def send_cloud_event(
+    async def send_cloud_event(
         self, sink: str, event: CloudEvent[NotificationEventType, CloudEventData]
     ) -> None:
-        asyncio.create_task(
-            self.httpx_client_callback.post(
-                sink,
-                json=jsonable_encoder(event, exclude_unset=True),
-            )
+        await self.webhook_delivery.deliver(
+            sink, jsonable_encoder(event, exclude_unset=True)
         )
 
     async def notify_sink[SubscriptionEventType: str, SubscriptionDetail](
@@ -44,4 +41,5 @@ class SubscriptionDriverBase[NotificationEventType: str, CloudEventData]:
             data=data,
         )
 
-        self.send_cloud_event(subscription.sink, res)
+        with track_operation("notify_sink", type.removeprefix("org.camaraproject.")):
+            await self.send_cloud_event(subscription.sink, res)
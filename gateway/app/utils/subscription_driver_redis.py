@@ -1,15 +1,18 @@
 import uuid
 import asyncio
 import logging
-from typing import Any, Never
+from typing import Any, Never, Optional
 from abc import ABC, abstractmethod
 from datetime import datetime, timezone
 
 from pydantic import TypeAdapter
-
+from redis.asyncio import WatchError
+from redis.asyncio.client import PubSub
 
 from app.exceptions import ResourceNotFound
 from app.redis import get_redis
+from app.settings import settings
+from app.schemas.device import Device
 from app.schemas.subscriptions import (
     HTTPSubscriptionResponse,
     Protocol,
@@ -18,6 +21,10 @@ from app.schemas.subscriptions import (
     SubscriptionStatus,
     TerminationReason,
 )
+from app.utils import geometry
+from app.utils.device_index import DeviceIndex
+from app.utils.geo_index import GeoIndex
+from app.utils.redis_lease import RedisLease
 from app.utils.subscription_driver_base import SubscriptionDriverBase
 
 _termination_reason_to_status = {
@@ -45,17 +52,60 @@ class SubscriptionDriverRedis[
 
         self.sub_prefix = prefix
         self.counter_prefix = prefix + "_counter"
+        # Sorted set with the ids of all the stored subscriptions, all members
+        # have the same score so that they are ordered lexicographically which
+        # allows using the last returned id as the pagination cursor.
+        self.index_key = prefix + "_index"
+        # Sorted set with the ids of the active subscriptions that have an
+        # expire time, scored by the expire timestamp. Subscriptions created
+        # with an expire time are also published on the channel of the same
+        # name, which wakes up the expiry scheduler of every replica as they
+        # might expire before it would wake up on its own.
+        self.expiry_key = prefix + "_expiry"
+        # Only the replica holding the lease processes expired subscriptions
+        self._expiry_lease = RedisLease(
+            prefix + "_expiry", settings.subscriptions.expiry_lease_secs
+        )
+
+        # Ids of the subscriptions of each device
+        self.device_index = DeviceIndex(prefix)
+        # Ids of the subscriptions by the area they are about
+        self.area_index = GeoIndex(prefix)
 
         self.type_adapter = type_adapter
 
         self.redis = get_redis()
 
+    @abstractmethod
+    def get_subscription_device(self, details: SubscriptionDetails) -> Optional[Device]:
+        """
+        Returns the device the subscription with `details` is about, if any.
+        """
+        pass
+
+    def get_subscription_area(
+        self, details: SubscriptionDetails
+    ) -> Optional[geometry.CircleShape]:
+        """
+        Returns the area the subscription with `details` is about, if any.
+        """
+        return None
+
     async def create_gateway_subscription(
         self,
         req: SubscriptionRequest[SubscriptionEventType, SubscriptionDetails],
     ) -> Subscription[SubscriptionEventType, SubscriptionDetails]:
-        sub_id = str(uuid.uuid4())
-        sub: Subscription[SubscriptionEventType, SubscriptionDetails] = (
+        (sub,) = await self.create_gateway_subscriptions([req])
+        return sub
+
+    async def create_gateway_subscriptions(
+        self,
+        reqs: list[SubscriptionRequest[SubscriptionEventType, SubscriptionDetails]],
+    ) -> list[Subscription[SubscriptionEventType, SubscriptionDetails]]:
+        """
+        Stores a subscription for each request, all in a single transaction.
+        """
+        subs: list[Subscription[SubscriptionEventType, SubscriptionDetails]] = [
             HTTPSubscriptionResponse(
                 protocol=Protocol.HTTP,
                 sink=req.sink,
@@ -66,50 +116,234 @@ class SubscriptionDriverRedis[
                     if req.config.subscriptionExpireTime is None
                     else req.config.subscriptionExpireTime.tzinfo
                 ),
-                id=sub_id,
+                id=str(uuid.uuid4()),
                 expiresAt=req.config.subscriptionExpireTime,
                 status=SubscriptionStatus.ACTIVE,
             )
-        )
-
-        await self.redis.set(
-            f"{self.sub_prefix}:{sub_id}", sub.model_dump_json(exclude_unset=True)
-        )
-
-        return sub
+            for req in reqs
+        ]
+
+        async with self.redis.pipeline(transaction=True) as p:
+            for sub in subs:
+                p.set(
+                    f"{self.sub_prefix}:{sub.id}",
+                    sub.model_dump_json(exclude_unset=True),
+                )
+                p.zadd(self.index_key, {sub.id: 0})
+                device = self.get_subscription_device(sub.config.subscriptionDetail)
+                if device is not None:
+                    self.device_index.add(p, device, sub.id)
+                area = self.get_subscription_area(sub.config.subscriptionDetail)
+                if area is not None:
+                    self.area_index.add(p, area, sub.id)
+                if sub.config.subscriptionExpireTime is not None:
+                    p.zadd(
+                        self.expiry_key,
+                        {sub.id: sub.config.subscriptionExpireTime.timestamp()},
+                    )
+            if any(sub.config.subscriptionExpireTime is not None for sub in subs):
+                p.publish(self.expiry_key, "")
+            await p.execute()
+
+        return subs
 
     async def permanently_delete_subscription(
         self, sub: Subscription[SubscriptionEventType, SubscriptionDetails]
     ) -> None:
-        await self.redis.delete(f"{self.sub_prefix}:{sub.id}")
+        await self.permanently_delete_subscriptions([sub])
+
+    async def permanently_delete_subscriptions(
+        self, subs: list[Subscription[SubscriptionEventType, SubscriptionDetails]]
+    ) -> None:
+        async with self.redis.pipeline(transaction=True) as p:
+            for sub in subs:
+                p.delete(f"{self.sub_prefix}:{sub.id}")
+                p.zrem(self.index_key, sub.id)
+                p.zrem(self.expiry_key, sub.id)
+                device = self.get_subscription_device(sub.config.subscriptionDetail)
+                if device is not None:
+                    self.device_index.remove(p, device, sub.id)
+                area = self.get_subscription_area(sub.config.subscriptionDetail)
+                if area is not None:
+                    self.area_index.remove(p, area, sub.id)
+            await p.execute()
 
     async def delete_gateway_subscription(
         self, id: str, termination_reason: TerminationReason
     ) -> Subscription[SubscriptionEventType, SubscriptionDetails] | None:
+        """
+        Marks the subscription as terminated, returning it if it was active or
+        None if it had already been terminated.
+
+        The status is updated in a transaction so that when the subscription
+        is terminated concurrently (e.g. deleted by the user while expiring)
+        it's only returned to one of the callers.
+        """
         subscription_key = f"{self.sub_prefix}:{id}"
-        subscription_raw = await self.redis.get(subscription_key)
-        if subscription_raw is None:
-            raise ResourceNotFound()
-
-        # Delete all the redis data besides the subscription
         counter_key = f"{self.counter_prefix}:{id}"
-        await self.redis.delete(counter_key)
 
-        subscription = self.type_adapter.validate_json(subscription_raw)
+        while True:
+            try:
+                async with self.redis.pipeline() as p:
+                    await p.watch(subscription_key)
+                    subscription_raw = await p.get(subscription_key)
+                    if subscription_raw is None:
+                        raise ResourceNotFound()
+
+                    subscription = self.type_adapter.validate_json(subscription_raw)
+
+                    # This function isn't typed
+                    p.multi()  # type: ignore [no-untyped-call]
+
+                    # Delete all the redis data besides the subscription
+                    p.delete(counter_key)
+                    p.zrem(self.expiry_key, id)
+                    device = self.get_subscription_device(
+                        subscription.config.subscriptionDetail
+                    )
+                    if device is not None:
+                        self.device_index.remove(p, device, id)
+                    area = self.get_subscription_area(
+                        subscription.config.subscriptionDetail
+                    )
+                    if area is not None:
+                        self.area_index.remove(p, area, id)
+
+                    terminated = subscription.status in (
+                        SubscriptionStatus.EXPIRED,
+                        SubscriptionStatus.DELETED,
+                    )
+                    if not terminated:
+                        subscription.status = _termination_reason_to_status[
+                            termination_reason
+                        ]
+                        p.set(
+                            subscription_key,
+                            subscription.model_dump_json(exclude_unset=True),
+                        )
+
+                    await p.execute()
+                break
+            except WatchError:
+                logging.debug("Delete for %s: Watch error, retrying", id)
+                continue
 
-        if subscription.status in (
-            SubscriptionStatus.EXPIRED,
-            SubscriptionStatus.DELETED,
-        ):
+        if terminated:
             return None
 
-        subscription.status = _termination_reason_to_status[termination_reason]
-        await self.redis.set(
-            subscription_key, subscription.model_dump_json(exclude_unset=True)
-        )
-
         return subscription
 
+    @abstractmethod
+    def set_subscription_device(
+        self, details: SubscriptionDetails, device: Device
+    ) -> None:
+        """
+        Sets the device the subscription with `details` is about.
+        """
+        pass
+
+    @abstractmethod
+    async def setup_subscription(
+        self, sub: Subscription[SubscriptionEventType, SubscriptionDetails]
+    ) -> None:
+        """
+        Sets up the monitoring of a subscription that was just stored, if
+        this raises the subscription is deleted.
+        """
+        pass
+
+    async def create_subscription(
+        self,
+        req: SubscriptionRequest[SubscriptionEventType, SubscriptionDetails],
+        device: Device,
+    ) -> Subscription[SubscriptionEventType, SubscriptionDetails]:
+        self.set_subscription_device(req.config.subscriptionDetail, device)
+        sub = await self.create_gateway_subscription(req)
+
+        try:
+            await self.setup_subscription(sub)
+        except BaseException as e:
+            await self.permanently_delete_subscription(sub)
+            raise e
+
+        return sub
+
+    async def create_subscriptions(
+        self,
+        req: SubscriptionRequest[SubscriptionEventType, SubscriptionDetails],
+        devices: list[Device],
+    ) -> list[Subscription[SubscriptionEventType, SubscriptionDetails] | BaseException]:
+        """
+        Creates a subscription with the config of `req` for each device.
+
+        The subscriptions are stored together, then set up with at most
+        `batch_concurrency` at the same time, and those that failed are
+        deleted together, as are those not set up yet if this is cancelled.
+        Returns the subscription of each device or the exception that
+        prevented its creation.
+        """
+        reqs = []
+        for device in devices:
+            device_req = req.model_copy(deep=True)
+            self.set_subscription_device(device_req.config.subscriptionDetail, device)
+            reqs.append(device_req)
+
+        subs = await self.create_gateway_subscriptions(reqs)
+
+        semaphore = asyncio.Semaphore(settings.subscriptions.batch_concurrency)
+        set_up: set[str] = set()
+
+        async def setup(
+            sub: Subscription[SubscriptionEventType, SubscriptionDetails],
+        ) -> Subscription[SubscriptionEventType, SubscriptionDetails]:
+            async with semaphore:
+                await self.setup_subscription(sub)
+                set_up.add(sub.id)
+                return sub
+
+        try:
+            results: list[
+                Subscription[SubscriptionEventType, SubscriptionDetails] | BaseException
+            ] = await asyncio.gather(
+                *(setup(sub) for sub in subs), return_exceptions=True
+            )
+        except BaseException as e:
+            # Cancelled, the subscriptions that are set up are kept
+            await self.permanently_delete_subscriptions(
+                [sub for sub in subs if sub.id not in set_up]
+            )
+            raise e
+
+        failed = [
+            sub
+            for sub, result in zip(subs, results)
+            if isinstance(result, BaseException)
+        ]
+        if len(failed) != 0:
+            await self.permanently_delete_subscriptions(failed)
+
+        return results
+
+    async def delete_subscriptions(
+        self, sub_ids: list[str]
+    ) -> list[None | BaseException]:
+        """
+        Deletes the subscriptions, at most `batch_concurrency` at the same
+        time. Returns None for each deleted subscription or the exception
+        that prevented its deletion.
+        """
+        semaphore = asyncio.Semaphore(settings.subscriptions.batch_concurrency)
+
+        async def delete(sub_id: str) -> None:
+            async with semaphore:
+                await self.delete_subscription(
+                    sub_id, termination_reason=TerminationReason.SUBSCRIPTION_DELETED
+                )
+
+        return await asyncio.gather(
+            *(delete(sub_id) for sub_id in sub_ids), return_exceptions=True
+        )
+
     @abstractmethod
     async def delete_subscription(
         self,
@@ -130,19 +364,139 @@ class SubscriptionDriverRedis[
         return self.type_adapter.validate_json(result)
 
     async def get_subscriptions(
-        self,
-    ) -> list[Subscription[SubscriptionEventType, SubscriptionDetails]]:
-        keys = await self.redis.keys(f"{self.sub_prefix}:*")
+        self, cursor: Optional[str] = None, limit: Optional[int] = None
+    ) -> tuple[
+        list[Subscription[SubscriptionEventType, SubscriptionDetails]], Optional[str]
+    ]:
+        """
+        Returns the subscriptions after `cursor` (exclusive) and the cursor for
+        the next page, or None if there are no more subscriptions.
+
+        If `limit` is None all the remaining subscriptions are returned.
+        """
+        page_size = settings.subscriptions.page_size
+        if limit is not None:
+            page_size = min(limit, page_size)
+
+        start = "-" if cursor is None else f"({cursor}"
         subscriptions = []
 
-        for key in keys:
-            result = await self.redis.get(key)
+        while True:
+            # Fetch one more id than needed to know if there's a next page
+            ids = await self.redis.zrangebylex(
+                self.index_key, start, "+", 0, page_size + 1
+            )
+            has_more = len(ids) > page_size
+            ids = ids[:page_size]
+
+            if len(ids) != 0:
+                results = await self.redis.mget(
+                    [f"{self.sub_prefix}:{sub_id}" for sub_id in ids]
+                )
+                for result in results:
+                    if result is None:
+                        continue
+                    subscriptions.append(self.type_adapter.validate_json(result))
+
+            if not has_more:
+                return subscriptions, None
+
+            if limit is not None:
+                return subscriptions, ids[-1]
+
+            start = f"({ids[-1]}"
+
+    async def get_device_subscriptions(
+        self, device: Device
+    ) -> list[Subscription[SubscriptionEventType, SubscriptionDetails]]:
+        """
+        Returns the active subscriptions of the device.
+        """
+        ids = await self.device_index.lookup(device)
+        return await self._get_active_subscriptions(ids)
+
+    async def _get_active_subscriptions(
+        self, ids: list[str]
+    ) -> list[Subscription[SubscriptionEventType, SubscriptionDetails]]:
+        if len(ids) == 0:
+            return []
+
+        results = await self.redis.mget(
+            [f"{self.sub_prefix}:{sub_id}" for sub_id in ids]
+        )
+
+        subscriptions = []
+        for result in results:
             if result is None:
                 continue
-            subscriptions.append(self.type_adapter.validate_json(result))
+
+            sub = self.type_adapter.validate_json(result)
+            if sub.status == SubscriptionStatus.ACTIVE:
+                subscriptions.append(sub)
 
         return subscriptions
 
+    async def get_area_subscriptions(
+        self, latitude: float, longitude: float, radius_m: Optional[float] = None
+    ) -> list[Subscription[SubscriptionEventType, SubscriptionDetails]]:
+        """
+        Returns the active subscriptions whose area contains the point, or
+        intersects the circle around it if `radius_m` is given.
+        """
+        if radius_m is None:
+            ids = await self.area_index.containing(latitude, longitude)
+        else:
+            ids = await self.area_index.intersecting(latitude, longitude, radius_m)
+
+        return await self._get_active_subscriptions(ids)
+
+    async def rebuild_subscription_index(self) -> None:
+        """
+        Adds the subscriptions stored before the indexes were introduced to
+        them.
+        """
+        cursor = 0
+        while True:
+            cursor, keys = await self.redis.scan(
+                cursor, match=f"{self.sub_prefix}:*", count=1000
+            )
+
+            if len(keys) != 0:
+                await self.redis.zadd(
+                    self.index_key, {key.split(":", 1)[1]: 0 for key in keys}, nx=True
+                )
+
+                async with self.redis.pipeline(transaction=False) as p:
+                    for result in await self.redis.mget(keys):
+                        if result is None:
+                            continue
+
+                        sub = self.type_adapter.validate_json(result)
+                        if sub.status != SubscriptionStatus.ACTIVE:
+                            continue
+
+                        if sub.config.subscriptionExpireTime is not None:
+                            p.zadd(
+                                self.expiry_key,
+                                {sub.id: sub.config.subscriptionExpireTime.timestamp()},
+                                nx=True,
+                            )
+
+                        device = self.get_subscription_device(
+                            sub.config.subscriptionDetail
+                        )
+                        if device is not None:
+                            self.device_index.add(p, device, sub.id)
+
+                        area = self.get_subscription_area(sub.config.subscriptionDetail)
+                        if area is not None:
+                            self.area_index.add(p, area, sub.id)
+
+                    await p.execute()
+
+            if cursor == 0:
+                break
+
     async def send_report(
         self,
         subscription: Subscription[SubscriptionEventType, SubscriptionDetails],
@@ -150,46 +504,116 @@ class SubscriptionDriverRedis[
         data: CloudEventData,
         **delete_kwargs: Any,
     ) -> None:
+        events = None
         if subscription.config.subscriptionMaxEvents is not None:
             counter_key = f"{self.counter_prefix}:{subscription.id}"
-            counter = await self.redis.incr(counter_key)
+            events = await self.redis.incr(counter_key)
 
-            if counter >= subscription.config.subscriptionMaxEvents:
-                await self.delete_subscription(
-                    subscription.id,
-                    termination_reason=TerminationReason.MAX_EVENTS_REACHED,
-                    **delete_kwargs,
-                )
+        await self.send_counted_report(
+            subscription, type, data, events, **delete_kwargs
+        )
+
+    async def send_counted_report(
+        self,
+        subscription: Subscription[SubscriptionEventType, SubscriptionDetails],
+        type: NotificationEventType,
+        data: CloudEventData,
+        events: Optional[int],
+        **delete_kwargs: Any,
+    ) -> None:
+        """
+        Sends a report whose event was already added to the counter of the
+        subscription, `events` being the value of the counter after it.
+        """
+        max_events = subscription.config.subscriptionMaxEvents
+        if max_events is not None and events is not None and events >= max_events:
+            await self.delete_subscription(
+                subscription.id,
+                termination_reason=TerminationReason.MAX_EVENTS_REACHED,
+                **delete_kwargs,
+            )
 
         await self.notify_sink(subscription, type, data)
 
     async def clear_loop(self) -> Never:
-        while True:
-            try:
-                logging.debug("Clearing expired subscriptions")
-                await self._clear_expired_subscriptions()
-                await asyncio.sleep(5)
-            except Exception as e:
-                logging.error(e)
-
-    async def _clear_expired_subscriptions(self) -> None:
-        keys = await self.redis.keys(f"{self.sub_prefix}:*")
-
-        for key in keys:
-            sub_key = f"{self.sub_prefix}:{key.split(':')[1]}"
-            sub = await self.redis.get(sub_key)
-            if sub is None:
-                continue
+        pubsub = self.redis.pubsub()
+        try:
+            while True:
+                delay = settings.subscriptions.expiry_max_tick_secs
+                try:
+                    if await self._expiry_lease.acquire():
+                        logging.debug("Clearing expired subscriptions")
+                        delay = await self._clear_expired_subscriptions()
+                except Exception as e:
+                    logging.error(e)
+
+                await self._wait_for_expiry_change(pubsub, delay)
+        finally:
+            # Let another replica take over right away instead of waiting for
+            # the lease to expire
+            await self._expiry_lease.release_if_held()
+            await pubsub.aclose()  # type: ignore [no-untyped-call]
+
+    async def _wait_for_expiry_change(self, pubsub: PubSub, delay: float) -> None:
+        """
+        Waits for up to `delay` seconds, or until a subscription with an expire
+        time is created by any of the replicas.
+        """
+        try:
+            if not pubsub.subscribed:
+                await pubsub.subscribe(self.expiry_key)
+
+            message = await pubsub.get_message(
+                ignore_subscribe_messages=True, timeout=delay
+            )
+            # A single run handles all the subscriptions created meanwhile
+            while message is not None:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=0
+                )
+        except Exception as e:
+            logging.error(e)
+            await asyncio.sleep(delay)
+
+    async def _clear_expired_subscriptions(self) -> float:
+        """
+        Deletes the subscriptions whose expire time has passed and returns the
+        number of seconds until the next run.
+        """
+        min_tick = settings.subscriptions.expiry_min_tick_secs
+        max_tick = settings.subscriptions.expiry_max_tick_secs
+        batch_size = settings.subscriptions.expiry_batch_size
+
+        now = datetime.now(timezone.utc).timestamp()
+        due = await self.redis.zrangebyscore(
+            self.expiry_key, "-inf", now, start=0, num=batch_size, withscores=True
+        )
 
-            sub = self.type_adapter.validate_json(sub)
-            if (
-                sub.status != SubscriptionStatus.ACTIVE
-                or sub.config.subscriptionExpireTime is None
-                or datetime.now(sub.config.subscriptionExpireTime.tzinfo)
-                < sub.config.subscriptionExpireTime
-            ):
+        for sub_id, expire_time in due:
+            # Claim the subscription so that it's processed exactly once even if
+            # the lease changed hands while this batch was being processed
+            if await self.redis.zrem(self.expiry_key, sub_id) == 0:
                 continue
 
-            await self.delete_subscription(
-                sub.id, termination_reason=TerminationReason.SUBSCRIPTION_EXPIRED
-            )
+            try:
+                await self.delete_subscription(
+                    sub_id, termination_reason=TerminationReason.SUBSCRIPTION_EXPIRED
+                )
+            except ResourceNotFound:
+                pass
+            except Exception:
+                # Put it back so that it's retried on the next run
+                await self.redis.zadd(self.expiry_key, {sub_id: expire_time})
+                raise
+
+        # There might be more expired subscriptions
+        if len(due) == batch_size:
+            return min_tick
+
+        next_due = await self.redis.zrange(self.expiry_key, 0, 0, withscores=True)
+        if len(next_due) == 0:
+            return max_tick
+
+        _, next_expire_time = next_due[0]
+        delay = float(next_expire_time) - datetime.now(timezone.utc).timestamp()
+        return min(max(delay, min_tick), max_tick)
@@ -0,0 +1,252 @@
+import json
+import random
+import asyncio
+import logging
+from typing import Any, Iterator
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+import httpx
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+from app.redis import get_redis
+from app.settings import CallbacksSettings, settings
+from app.utils.http_clients import OutboundClients, get_outbound_clients
+
+LOG = logging.getLogger(__name__)
+
+_dead_letter_key = "webhook_dead_letter"
+
+# Statuses that might succeed if the request is retried
+_retryable_statuses = {408, 425, 429}
+
+
+@dataclass
+class DeliveryStats:
+    enqueued: int = 0
+    delivered: int = 0
+    retried: int = 0
+    dead_lettered: int = 0
+
+
+class _SinkQueue:
+    def __init__(self, queue_size: int) -> None:
+        self.queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=queue_size)
+        self.workers: set[asyncio.Task[None]] = set()
+
+
+class WebhookDelivery:
+    """
+    Delivers events to the sinks of the applications.
+
+    Each sink has a bounded queue served by a bounded number of workers, so a
+    slow sink doesn't hold back the others. When a queue is full the caller
+    waits for space, and if there's still no space after a while the event
+    is dead lettered. Failed deliveries are retried with exponential backoff
+    and dead lettered once the retries are exhausted.
+
+    Dead lettered events are kept in a redis list for inspection.
+
+    The queues, and the events waiting for a retry, only live in the memory
+    of the replica. A graceful shutdown dead letters them, but they are lost
+    if the replica crashes or is killed.
+    """
+
+    def __init__(
+        self, callbacks_settings: CallbacksSettings, clients: OutboundClients
+    ) -> None:
+        self.settings = callbacks_settings
+        self.stats = DeliveryStats()
+
+        self.clients = clients
+        self.redis = get_redis()
+
+        self._sinks: dict[str, _SinkQueue] = {}
+        self._in_flight = asyncio.Semaphore(callbacks_settings.max_in_flight)
+        self._closing = False
+
+    def queue_depths(self) -> dict[str, int]:
+        return {sink: entry.queue.qsize() for sink, entry in self._sinks.items()}
+
+    async def deliver(self, sink: str, payload: Any) -> None:
+        """
+        Queues the JSON `payload` to be posted to `sink`.
+        """
+        if self._closing:
+            await self._dead_letter(sink, payload, "Gateway shutting down")
+            return
+
+        entry = self._sinks.get(sink)
+        if entry is None:
+            entry = _SinkQueue(self.settings.queue_size)
+            self._sinks[sink] = entry
+
+        try:
+            await asyncio.wait_for(
+                entry.queue.put(payload), self.settings.enqueue_timeout_secs
+            )
+        except TimeoutError:
+            LOG.warning("Delivery queue for %s is full", sink)
+            await self._dead_letter(sink, payload, "Delivery queue full")
+            return
+
+        self.stats.enqueued += 1
+
+        if len(entry.workers) < min(
+            self.settings.workers_per_sink, entry.queue.qsize()
+        ):
+            task = asyncio.create_task(self._worker(sink, entry))
+            entry.workers.add(task)
+
+    async def close(self) -> None:
+        """
+        Waits for the queued events to be delivered and dead letters the ones
+        that couldn't be delivered in time.
+        """
+        self._closing = True
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(entry.queue.join() for entry in self._sinks.values())),
+                self.settings.shutdown_timeout_secs,
+            )
+        except TimeoutError:
+            LOG.warning("Timed out waiting for the delivery queues to drain")
+
+        for sink, entry in list(self._sinks.items()):
+            for task in entry.workers:
+                task.cancel()
+
+            while not entry.queue.empty():
+                await self._dead_letter(
+                    sink, entry.queue.get_nowait(), "Gateway shutting down"
+                )
+
+        self._sinks.clear()
+
+    async def _worker(self, sink: str, entry: _SinkQueue) -> None:
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(
+                        entry.queue.get(), self.settings.worker_idle_secs
+                    )
+                except TimeoutError:
+                    return
+
+                try:
+                    await self._send(sink, payload)
+                except asyncio.CancelledError:
+                    await self._dead_letter(sink, payload, "Gateway shutting down")
+                    raise
+                except Exception as e:
+                    LOG.error("Unexpected error delivering to %s: %s", sink, e)
+                finally:
+                    entry.queue.task_done()
+        finally:
+            task = asyncio.current_task()
+            if task is not None:
+                entry.workers.discard(task)
+
+            if (
+                len(entry.workers) == 0
+                and entry.queue.empty()
+                and self._sinks.get(sink) is entry
+            ):
+                del self._sinks[sink]
+
+    async def _send(self, sink: str, payload: Any) -> None:
+        reason = ""
+
+        for attempt in range(self.settings.max_retries + 1):
+            if attempt != 0:
+                backoff = min(
+                    self.settings.retry_backoff_secs * 2 ** (attempt - 1),
+                    self.settings.retry_max_backoff_secs,
+                )
+                # Add some jitter so that retries to the same sink are spread out
+                await asyncio.sleep(backoff * random.uniform(0.5, 1))
+                self.stats.retried += 1
+
+            async with self._in_flight:
+                try:
+                    res = await self.clients.client_for(sink).post(sink, json=payload)
+                except httpx.HTTPError as e:
+                    LOG.debug("Delivery to %s failed: %s", sink, e)
+                    reason = str(e) or type(e).__name__
+                    continue
+
+            if res.is_success:
+                self.stats.delivered += 1
+                return
+
+            LOG.debug("Delivery to %s failed with status %d", sink, res.status_code)
+            reason = f"Sink responded with status {res.status_code}"
+
+            if res.status_code < 500 and res.status_code not in _retryable_statuses:
+                break
+
+        await self._dead_letter(sink, payload, reason)
+
+    async def _dead_letter(self, sink: str, payload: Any, reason: str) -> None:
+        LOG.warning("Dead lettering event for %s: %s", sink, reason)
+        self.stats.dead_lettered += 1
+
+        entry = json.dumps(
+            {
+                "sink": sink,
+                "payload": payload,
+                "reason": reason,
+                "time": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+
+        try:
+            async with self.redis.pipeline(transaction=True) as p:
+                p.lpush(_dead_letter_key, entry)
+                p.ltrim(_dead_letter_key, 0, self.settings.dead_letter_max_length - 1)
+                await p.execute()
+        except Exception as e:
+            LOG.error("Failed to store dead lettered event: %s", e)
+
+
+class _DeliveryCollector(Collector):
+    def __init__(self, delivery: WebhookDelivery) -> None:
+        self.delivery = delivery
+
+    def collect(self) -> Iterator[Metric]:
+        events = CounterMetricFamily(
+            "gateway_webhook_events",
+            "Events handled by the delivery engine",
+            labels=["outcome"],
+        )
+        for outcome, value in asdict(self.delivery.stats).items():
+            events.add_metric([outcome], value)
+        yield events
+
+        depths = self.delivery.queue_depths()
+        yield GaugeMetricFamily(
+            "gateway_webhook_queued_events",
+            "Events waiting to be delivered",
+            value=sum(depths.values()),
+        )
+        yield GaugeMetricFamily(
+            "gateway_webhook_max_queue_depth",
+            "Events waiting to be delivered to the most backed up sink",
+            value=max(depths.values(), default=0),
+        )
+        yield GaugeMetricFamily(
+            "gateway_webhook_active_sinks",
+            "Sinks with events being delivered",
+            value=len(depths),
+        )
+
+
+_webhook_delivery = WebhookDelivery(settings.callbacks, get_outbound_clients())
+REGISTRY.register(_DeliveryCollector(_webhook_delivery))
+
+
+def get_webhook_delivery() -> WebhookDelivery:
+    return _webhook_delivery
@@ -0,0 +1,384 @@
+"""
+Benchmarks the gateway against a fake NEF and a fake application sink.
+
+Everything runs in this process: the gateway, the fake NEF and the sink are
+served by uvicorn on local ports and redis is replaced by fakeredis unless
+`--redis-url` is given. Each scenario sends `--requests` requests with
+`--concurrency` requests in flight and reports the latency percentiles and
+the throughput.
+
+    $ uv run --with "fakeredis[lua]" python -m benchmarks
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import logging
+from typing import Any, Awaitable, Callable, Literal
+from dataclasses import dataclass, field
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from benchmarks.fakes import FakeSink, create_fake_nef
+
+_nef_base_path = "/nef/api/v1"
+
+_apis = ["qod", "location", "geofencing"]
+
+
+@dataclass
+class Context:
+    client: httpx.AsyncClient
+    gateway_url: str
+    sink_url: str
+    nef_url: str
+    # Notification destinations and self links of the geofencing NEF
+    # subscriptions
+    geofencing_callbacks: list[tuple[str, str]] = field(default_factory=list)
+
+
+@dataclass
+class Result:
+    name: str
+    latencies: list[float]
+    errors: int
+    elapsed: float
+
+    def percentile(self, p: float) -> float:
+        if len(self.latencies) == 0:
+            return 0
+
+        ordered = sorted(self.latencies)
+        index = min(int(len(ordered) * p / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "rps": len(self.latencies) / self.elapsed if self.elapsed > 0 else 0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+        }
+
+
+def _phone_number(i: int) -> str:
+    return f"+3519{i:08d}"
+
+
+async def qod_create(ctx: Context, i: int) -> httpx.Response:
+    return await ctx.client.post(
+        f"{ctx.gateway_url}/quality-on-demand/v1/sessions",
+        json={
+            "device": {
+                "phoneNumber": _phone_number(i),
+                "ipv4Address": {
+                    "publicAddress": "84.125.93.10",
+                    "publicPort": 1024 + i % 60000,
+                },
+            },
+            "applicationServer": {"ipv4Address": "192.168.0.1"},
+            "qosProfile": "QOS_E",
+            "duration": 3600,
+            "sink": ctx.sink_url,
+        },
+    )
+
+
+async def location_retrieve(ctx: Context, i: int) -> httpx.Response:
+    return await ctx.client.post(
+        f"{ctx.gateway_url}/location-retrieval/v0.4/retrieve",
+        json={"device": {"phoneNumber": _phone_number(i)}},
+    )
+
+
+async def subscription_create(ctx: Context, i: int) -> httpx.Response:
+    return await ctx.client.post(
+        f"{ctx.gateway_url}/geofencing-subscriptions/v0.4/subscriptions",
+        json={
+            "protocol": "HTTP",
+            "sink": ctx.sink_url,
+            "types": ["org.camaraproject.geofencing-subscriptions.v0.area-entered"],
+            "config": {
+                "subscriptionDetail": {
+                    "device": {"phoneNumber": _phone_number(i)},
+                    "area": {
+                        "areaType": "CIRCLE",
+                        "center": {"latitude": 40.6333, "longitude": -8.6583},
+                        "radius": 2000,
+                    },
+                },
+                "initialEvent": True,
+            },
+        },
+    )
+
+
+async def subscription_list(ctx: Context, i: int) -> httpx.Response:
+    return await ctx.client.get(
+        f"{ctx.gateway_url}/geofencing-subscriptions/v0.4/subscriptions",
+        params={"limit": 100},
+    )
+
+
+async def callback_ingest(ctx: Context, i: int) -> httpx.Response:
+    callbacks = ctx.geofencing_callbacks
+    destination, nef_subscription = callbacks[i % len(callbacks)]
+
+    # Alternate between inside and outside of the area so that every
+    # notification results in an event for the sink
+    lat = 40.6333 if (i // len(callbacks)) % 2 == 0 else 41.6333
+
+    return await ctx.client.post(
+        destination,
+        json={
+            "subscription": nef_subscription,
+            "monitoringEventReports": [
+                {
+                    "monitoringType": "LOCATION_REPORTING",
+                    "locationInfo": {
+                        "geographicArea": {
+                            "shape": "POINT",
+                            "point": {"lat": lat, "lon": -8.6583},
+                        }
+                    },
+                }
+            ],
+        },
+    )
+
+
+Scenario = Callable[[Context, int], Awaitable[httpx.Response]]
+
+# The order matters, the callbacks are sent to the subscriptions created before
+_scenarios: dict[str, Scenario] = {
+    "qod_create": qod_create,
+    "location_retrieve": location_retrieve,
+    "subscription_create": subscription_create,
+    "subscription_list": subscription_list,
+    "callback_ingest": callback_ingest,
+}
+
+
+async def run_scenario(
+    ctx: Context, name: str, requests: int, concurrency: int
+) -> Result:
+    scenario = _scenarios[name]
+    latencies: list[float] = []
+    errors = 0
+    next_request = 0
+
+    async def worker() -> None:
+        nonlocal errors, next_request
+
+        while next_request < requests:
+            i = next_request
+            next_request += 1
+
+            start = time.perf_counter()
+            try:
+                res = await scenario(ctx, i)
+                if not res.is_success:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return Result(name, latencies, errors, time.perf_counter() - start)
+
+
+def _reserve_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Inherited by the accepted connections, otherwise small responses are
+    # held back by Nagle's algorithm until the client acknowledges the headers
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+def _url(sock: socket.socket) -> str:
+    host, port = sock.getsockname()
+    return f"http://{host}:{port}"
+
+
+def _configure_gateway(
+    args: argparse.Namespace, nef_url: str, gateway_url: str
+) -> None:
+    """
+    Points the gateway to the fake NEF, must be called before importing it.
+    """
+    os.environ["GATEWAY_LOG_LEVEL"] = "WARNING"
+    os.environ["GATEWAY_NEF__URL"] = nef_url
+    os.environ["GATEWAY_NEF__BASE_PATH"] = _nef_base_path
+    os.environ["GATEWAY_NEF__GATEWAY_AF_ID"] = "benchmark"
+    os.environ["GATEWAY_NEF__GATEWAY_NOTIFICATION_URL"] = gateway_url
+    os.environ["GATEWAY_NEF__USERNAME"] = "benchmark"
+    os.environ["GATEWAY_NEF__PASSWORD"] = "benchmark"
+    for api in _apis:
+        os.environ[f"GATEWAY_{api.upper()}__BACKEND"] = "nef"
+
+    if args.redis_url is not None:
+        os.environ["GATEWAY_REDIS__URL"] = args.redis_url
+
+
+def _use_fakeredis() -> None:
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit(
+            'fakeredis is not installed, run with `uv run --with "fakeredis[lua]"` '
+            "or pass --redis-url"
+        )
+
+    import app.redis
+
+    app.redis._client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+async def _serve(
+    app: FastAPI, sock: socket.socket, lifespan: Literal["on", "off"]
+) -> uvicorn.Server:
+    config = uvicorn.Config(
+        app, log_level="warning", access_log=False, lifespan=lifespan
+    )
+    server = uvicorn.Server(config)
+
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+
+    return server
+
+
+async def main(args: argparse.Namespace) -> None:
+    gateway_sock = _reserve_socket()
+    nef_sock = _reserve_socket()
+    sink_sock = _reserve_socket()
+
+    _configure_gateway(args, _url(nef_sock), _url(gateway_sock))
+    if args.redis_url is None:
+        _use_fakeredis()
+
+    # The gateway reads its settings when it's imported
+    from app.main import app as gateway_app
+    from app.utils.webhook_delivery import get_webhook_delivery
+
+    sink = FakeSink()
+    nef = create_fake_nef(_nef_base_path, args.nef_latency_ms / 1000)
+    servers = [
+        await _serve(nef, nef_sock, "off"),
+        await _serve(sink.app, sink_sock, "off"),
+        await _serve(gateway_app, gateway_sock, "on"),
+    ]
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        ctx = Context(
+            client=client,
+            gateway_url=_url(gateway_sock),
+            sink_url=f"{_url(sink_sock)}/events",
+            nef_url=_url(nef_sock),
+        )
+
+        results = []
+        for name in _scenarios:
+            if name not in args.scenarios:
+                continue
+            if name == "callback_ingest":
+                ctx.geofencing_callbacks = [
+                    (destination, nef_subscription)
+                    for nef_subscription, destination in nef.state.subscriptions.items()
+                    if "/geofencing/" in destination
+                ]
+                if len(ctx.geofencing_callbacks) == 0:
+                    logging.warning("Skipping %s, it needs subscription_create", name)
+                    continue
+
+            results.append(
+                await run_scenario(ctx, name, args.requests, args.concurrency)
+            )
+
+        # Wait for the events to be delivered to the sink
+        delivery = get_webhook_delivery()
+        deadline = time.monotonic() + 30
+        while (
+            sum(delivery.queue_depths().values()) != 0 and time.monotonic() < deadline
+        ):
+            await asyncio.sleep(0.1)
+
+    for server in reversed(servers):
+        server.should_exit = True
+    await asyncio.sleep(0.5)
+
+    report = {result.name: result.to_dict() for result in results}
+    report["sink"] = {"events_received": sink.received}
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    header = f"{'scenario':<22}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}\n"
+    sys.stdout.write(header)
+    sys.stdout.write("-" * (len(header) - 1) + "\n")
+    for result in results:
+        row = result.to_dict()
+        sys.stdout.write(
+            f"{result.name:<22}{row['requests']:>10}{row['errors']:>8}{row['rps']:>10.1f}"
+            f"{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}\n"
+        )
+    sys.stdout.write(f"\nEvents received by the sink: {sink.received}\n")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=50,
+        help="requests in flight (default: 50)",
+    )
+    parser.add_argument(
+        "-n",
+        "--requests",
+        type=int,
+        default=1000,
+        help="requests per scenario (default: 1000)",
+    )
+    parser.add_argument(
+        "-s",
+        "--scenarios",
+        nargs="+",
+        choices=list(_scenarios),
+        default=list(_scenarios),
+        help="scenarios to run (default: all)",
+    )
+    parser.add_argument(
+        "--nef-latency-ms",
+        type=float,
+        default=0,
+        help="latency added to each NEF request (default: 0)",
+    )
+    parser.add_argument("--redis-url", help="use this redis instead of fakeredis")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
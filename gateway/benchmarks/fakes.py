@@ -0,0 +1,105 @@
+"""
+Stand-ins for the services the gateway talks to: the NEF and the sinks of the
+applications.
+"""
+
+import json
+import time
+import uuid
+import base64
+import asyncio
+from typing import Any
+
+from fastapi import FastAPI, Request, Response
+
+
+def _fake_jwt(expires_in_secs: int) -> str:
+    def encode(data: dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    header = encode({"alg": "none", "typ": "JWT"})
+    payload = encode({"sub": "gateway", "exp": int(time.time()) + expires_in_secs})
+    return f"{header}.{payload}.signature"
+
+
+def create_fake_nef(base_path: str, latency_secs: float) -> FastAPI:
+    """
+    A NEF that accepts every request, answering the subscription requests by
+    echoing them back with a `self` link, the location requests with a fixed
+    point and the QoS requests with a few profiles. Each request takes at
+    least `latency_secs`.
+    """
+    app = FastAPI()
+    base_path = "/" + base_path.strip("/")
+
+    # Notification destination of each subscription, by its self link
+    app.state.subscriptions = {}
+
+    async def delay() -> None:
+        if latency_secs > 0:
+            await asyncio.sleep(latency_secs)
+
+    @app.post("/api/v1/login/access-token")
+    async def login() -> dict[str, str]:
+        await delay()
+        return {"access_token": _fake_jwt(3600), "token_type": "bearer"}
+
+    @app.get("/api/v1/qosInfo/qosCharacteristics")
+    async def qos_characteristics() -> list[dict[str, Any]]:
+        await delay()
+        return [
+            {"name": name, "downlinkBitRate": rate, "uplinkBitRate": rate}
+            for name, rate in [("QOS_S", 10**6), ("QOS_M", 10**7), ("QOS_E", 10**8)]
+        ]
+
+    @app.post(base_path + "/{api}/v1/{af_id}/subscriptions", status_code=201)
+    async def create_subscription(api: str, af_id: str, request: Request) -> Any:
+        await delay()
+        body = await request.json()
+
+        if body.get("maximumNumberOfReports") == 1:
+            # One time location requests are answered right away
+            return {
+                "externalId": body.get("externalId"),
+                "monitoringType": body.get("monitoringType"),
+                "locationInfo": {
+                    "geographicArea": {
+                        "shape": "POINT",
+                        "point": {"lat": 40.6333, "lon": -8.6583},
+                    }
+                },
+            }
+
+        body["self"] = (
+            f"{request.base_url}{base_path.lstrip('/')}/{api}/v1/{af_id}/subscriptions/{uuid.uuid4()}"
+        )
+        app.state.subscriptions[body["self"]] = body.get("notificationDestination")
+        return body
+
+    @app.patch(base_path + "/{api}/v1/{af_id}/subscriptions/{sub_id}")
+    async def update_subscription(request: Request) -> Any:
+        await delay()
+        return await request.json()
+
+    @app.delete(base_path + "/{api}/v1/{af_id}/subscriptions/{sub_id}")
+    async def delete_subscription(request: Request) -> Response:
+        await delay()
+        app.state.subscriptions.pop(str(request.url), None)
+        return Response(status_code=204)
+
+    return app
+
+
+class FakeSink:
+    """
+    Collects the events delivered by the gateway.
+    """
+
+    def __init__(self) -> None:
+        self.received = 0
+        self.app = FastAPI()
+
+        @self.app.post("/{path:path}", status_code=204)
+        async def receive(path: str, request: Request) -> None:
+            await request.body()
+            self.received += 1
@@ -4,3 +4,19 @@ import pytest
 @pytest.fixture
 def anyio_backend():
     return "asyncio"
+
+
+@pytest.fixture
+def redis(monkeypatch: pytest.MonkeyPatch):
+    """
+    Replaces the redis client with an in-memory one, the objects using redis
+    must be created after it.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+
+    import app.redis
+
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(app.redis, "_client", client)
+    return client
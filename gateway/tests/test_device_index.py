@@ -0,0 +1,84 @@
+from typing import Any
+
+import pytest
+
+# The drivers import the standing monitors, which must not be imported first
+import app.drivers  # noqa: F401
+from app.schemas.device import Device
+from app.schemas.nef_schemas.monitoringevent import (
+    MonitoringEventSubscription,
+    MonitoringType,
+)
+from app.settings import NEFSettings
+from app.utils.device_index import device_identifiers, device_key
+from app.utils.nef_driver_base import NefDriverBase
+
+_nef = NefDriverBase(
+    NEFSettings.model_validate(
+        {
+            "url": "http://nef",
+            "base_path": "/nef/api/v1",
+            "gateway_af_id": "gateway",
+            "gateway_notification_url": "http://gateway",
+            "username": "admin",
+            "password": "admin",
+        }
+    )
+)
+
+
+def _device(**fields: Any) -> Device:
+    return Device.model_validate(fields)
+
+
+def _nef_identifier(device: Device) -> dict[str, Any]:
+    sub = MonitoringEventSubscription.model_validate(
+        {
+            "monitoringType": MonitoringType.LOCATION_REPORTING,
+            "notificationDestination": "https://0.0.0.0",
+        }
+    )
+    return _nef.install_device_identifiers(sub, device).model_dump(
+        include={"msisdn", "ipv4Addr", "ipv6Addr", "externalId"}, exclude_none=True
+    )
+
+
+_devices = [
+    _device(phoneNumber="+351911111111"),
+    _device(
+        phoneNumber="+351911111111",
+        ipv4Address={"publicAddress": "1.1.1.1", "publicPort": 1},
+    ),
+    _device(ipv4Address={"publicAddress": "1.1.1.1", "publicPort": 1}),
+    _device(ipv4Address={"publicAddress": "1.1.1.1", "privateAddress": "10.0.0.1"}),
+    _device(ipv4Address={"publicAddress": "1.1.1.1", "privateAddress": "10.0.0.2"}),
+    _device(ipv4Address={"publicAddress": "2.2.2.2", "publicPort": 1}),
+    _device(ipv6Address="2001:db8::1"),
+    _device(ipv6Address="2001:db8::2"),
+    _device(ipv6Address="2001:db8::1", networkAccessIdentifier="a@example.com"),
+    _device(networkAccessIdentifier="a@example.com"),
+    _device(networkAccessIdentifier="b@example.com"),
+]
+
+
+@pytest.mark.parametrize("device", _devices)
+@pytest.mark.parametrize("other", _devices)
+def test_device_key_follows_the_nef_identifier(device: Device, other: Device) -> None:
+    same_key = device_key(device) == device_key(other)
+    assert same_key == (_nef_identifier(device) == _nef_identifier(other))
+
+
+def test_devices_behind_the_same_public_address() -> None:
+    by_port = _device(ipv4Address={"publicAddress": "1.1.1.1", "publicPort": 1})
+    by_private = _device(
+        ipv4Address={"publicAddress": "1.1.1.1", "privateAddress": "10.0.0.1"}
+    )
+    other = _device(
+        ipv4Address={"publicAddress": "1.1.1.1", "privateAddress": "10.0.0.2"}
+    )
+
+    # The NEF is asked about the public address, so they share its state
+    assert device_key(by_port) == device_key(by_private) == device_key(other)
+
+    # But they are still told apart when looking up their resources
+    assert set(device_identifiers(by_private)).isdisjoint(device_identifiers(other))
@@ -0,0 +1,138 @@
+import random
+
+import pytest
+import geopy.distance
+
+from app.utils import geometry
+
+
+def test_circle_contains() -> None:
+    area = geometry.CircleShape(40.0, -8.0, 1000)
+
+    assert area.contains(40.0, -8.0)
+    assert area.contains(40.008, -8.0)
+    assert not area.contains(40.01, -8.0)
+    assert not area.contains(41.0, -8.0)
+
+
+def test_polygon_contains() -> None:
+    square = geometry.PolygonShape(
+        [(39.99, -8.01), (40.01, -8.01), (40.01, -7.99), (39.99, -7.99)]
+    )
+
+    assert square.contains(40.0, -8.0)
+    assert not square.contains(40.02, -8.0)
+    assert not square.contains(40.0, -7.98)
+
+
+def test_circles_overlap() -> None:
+    small = geometry.CircleShape(40.0, -8.0, 1000)
+    large = geometry.CircleShape(40.0, -8.0, 2000)
+    far = geometry.CircleShape(41.0, -8.0, 1000)
+
+    assert geometry.overlap(small, large) == 1
+    assert geometry.overlap(large, small) == pytest.approx(0.25)
+    assert geometry.overlap(small, far) == 0
+
+
+def test_polygon_overlap() -> None:
+    square = geometry.PolygonShape(
+        [(39.99, -8.01), (40.01, -8.01), (40.01, -7.99), (39.99, -7.99)]
+    )
+    # Covers the western half of the square
+    half = geometry.PolygonShape(
+        [(39.98, -8.02), (40.02, -8.02), (40.02, -8.0), (39.98, -8.0)]
+    )
+
+    assert geometry.overlap(square, half) == pytest.approx(0.5, abs=0.02)
+    assert geometry.overlap(square, geometry.CircleShape(40.0, -8.0, 5000)) == 1
+
+
+def _geodesic_inside(area: geometry.CircleShape, lat: float, lon: float) -> bool:
+    return bool(
+        geopy.distance.geodesic((area.lat, area.lon), (lat, lon)).m < area.radius_m
+    )
+
+
+def _point_at(
+    area: geometry.CircleShape, distance_m: float, bearing: float
+) -> tuple[float, float]:
+    point = geopy.distance.geodesic(meters=distance_m).destination(
+        (area.lat, area.lon), bearing
+    )
+    return point.latitude, point.longitude
+
+
+def test_classify_matches_geodesic() -> None:
+    rng = random.Random(0)
+
+    for _ in range(2000):
+        area = geometry.CircleShape(
+            rng.uniform(-80, 80), rng.uniform(-180, 180), rng.uniform(100, 200_000)
+        )
+        lat, lon = _point_at(
+            area, rng.uniform(0, 2) * area.radius_m, rng.uniform(0, 360)
+        )
+
+        assert geometry.classify([area], lat, lon)[0] == _geodesic_inside(
+            area, lat, lon
+        )
+
+
+def test_classify_near_the_border() -> None:
+    rng = random.Random(1)
+
+    for _ in range(500):
+        area = geometry.CircleShape(
+            rng.uniform(-80, 80), rng.uniform(-180, 180), rng.uniform(100, 200_000)
+        )
+        # Within the error of the haversine distance, decided by the geodesic
+        lat, lon = _point_at(
+            area, area.radius_m * rng.uniform(0.994, 1.006), rng.uniform(0, 360)
+        )
+
+        assert geometry.classify([area], lat, lon)[0] == _geodesic_inside(
+            area, lat, lon
+        )
+
+
+def test_classify_across_the_antimeridian() -> None:
+    east = geometry.CircleShape(10.0, 179.99, 5000)
+    west = geometry.CircleShape(-10.0, -179.99, 5000)
+
+    assert east.bbox.min_lon > east.bbox.max_lon
+    assert geometry.classify([east, west], 10.0, -179.99) == [True, False]
+    assert geometry.classify([east, west], -10.0, 179.99) == [False, True]
+    assert geometry.classify([east], 10.0, 180.0) == [True]
+    assert geometry.classify([east], 10.0, -179.9) == [False]
+
+    for bearing in range(0, 360, 15):
+        lat, lon = _point_at(east, 4990, bearing)
+        assert east.contains(lat, lon)
+
+
+def test_bounding_boxes_across_the_antimeridian() -> None:
+    east = geometry.CircleShape(0.0, 179.99, 5000)
+    west = geometry.CircleShape(0.0, -179.99, 5000)
+    far = geometry.CircleShape(0.0, 0.0, 5000)
+
+    assert east.bbox.intersects(west.bbox)
+    assert west.bbox.intersects(east.bbox)
+    assert not east.bbox.intersects(far.bbox)
+    assert geometry.overlap(east, west) > 0
+
+
+def test_polygon_across_the_antimeridian() -> None:
+    square = geometry.PolygonShape(
+        [(-0.01, 179.99), (0.01, 179.99), (0.01, -179.99), (-0.01, -179.99)]
+    )
+
+    assert (square.bbox.min_lon, square.bbox.max_lon) == (179.99, -179.99)
+    assert square.contains(0.0, 180.0)
+    assert square.contains(0.0, -179.995)
+    assert not square.contains(0.0, 0.0)
+    assert not square.contains(0.0, -179.98)
+
+    assert square.area_m2() == pytest.approx((0.02 * 111195) ** 2, rel=0.01)
+    assert geometry.overlap(square, geometry.CircleShape(0.0, 180.0, 5000)) == 1
+    assert geometry.overlap(square, geometry.CircleShape(0.0, 0.0, 5000)) == 0
@@ -0,0 +1,91 @@
+from typing import Optional
+from datetime import datetime, timezone
+
+import pytest
+
+# The drivers import the standing monitors, which must not be imported first
+import app.drivers  # noqa: F401
+from app.endpoints.location.verify import verify_location_batch
+from app.exceptions import BadRequest, ResourceNotFound
+from app.interfaces.location import LocationInterface
+from app.schemas.device import Device
+from app.schemas.location import (
+    BatchVerifyLocationRequest,
+    Circle,
+    Location,
+    VerificationResult,
+)
+from app.settings import settings
+
+
+class FakeLocations(LocationInterface):
+    """
+    Locates every device at the center of the area of its phone number.
+    """
+
+    def __init__(self, areas: dict[str, Circle]) -> None:
+        self.areas = areas
+
+    async def retrieve_location(
+        self, device: Device, max_age: Optional[int], max_surface: Optional[int]
+    ) -> Location:
+        if device.phoneNumber not in self.areas:
+            raise ResourceNotFound()
+
+        return Location(
+            lastLocationTime=datetime.now(timezone.utc),
+            area=self.areas[device.phoneNumber],
+        )
+
+
+def _circle(latitude: float, longitude: float, radius: float) -> Circle:
+    return Circle.model_validate(
+        {"center": {"latitude": latitude, "longitude": longitude}, "radius": radius}
+    )
+
+
+def _request(*items: tuple[str, Circle]) -> BatchVerifyLocationRequest:
+    return BatchVerifyLocationRequest.model_validate(
+        {
+            "items": [
+                {"device": {"phoneNumber": phone}, "area": area.model_dump()}
+                for phone, area in items
+            ]
+        }
+    )
+
+
+@pytest.mark.anyio
+async def test_items_are_verified_against_their_own_area() -> None:
+    lisbon = _circle(38.72, -9.14, 1000)
+    porto = _circle(41.15, -8.61, 1000)
+    locations = FakeLocations({"+351911111111": lisbon, "+351922222222": porto})
+
+    response = await verify_location_batch(
+        _request(
+            ("+351911111111", lisbon),
+            ("+351922222222", lisbon),
+            ("+351933333333", lisbon),
+        ),
+        locations,
+    )
+
+    first, second, unknown = response.results
+    assert first.result is not None
+    assert first.result.verificationResult == VerificationResult.TRUE
+    assert second.result is not None
+    assert second.result.verificationResult == VerificationResult.FALSE
+    assert unknown.result is None and unknown.error is not None
+
+
+@pytest.mark.anyio
+async def test_oversized_batch_is_rejected(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings.location, "batch_max_items", 1)
+    lisbon = _circle(38.72, -9.14, 1000)
+
+    with pytest.raises(BadRequest) as e:
+        await verify_location_batch(
+            _request(("+351911111111", lisbon), ("+351922222222", lisbon)),
+            FakeLocations({}),
+        )
+    assert "At most 1 items" in e.value.message
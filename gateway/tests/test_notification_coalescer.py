@@ -0,0 +1,202 @@
+import asyncio
+from typing import Any
+
+import pytest
+
+# The drivers import the standing monitors, which must not be imported first
+import app.drivers  # noqa: F401
+from app.drivers.reachability_status.callbacks import nef as reachability_callbacks
+from app.drivers.roaming_status.callbacks import nef as roaming_callbacks
+from app.schemas.nef_schemas.monitoringevent import (
+    MonitoringNotification,
+    MonitoringType,
+    ReachabilityType,
+)
+from app.settings import NotificationCoalescingSettings
+from app.utils.notification_coalescer import NotificationCoalescer
+
+
+class Handler:
+    def __init__(self, delay: float = 0) -> None:
+        self.delay = delay
+        self.handled: list[tuple[str, Any]] = []
+
+    async def __call__(self, key: str, notification: Any) -> None:
+        await asyncio.sleep(self.delay)
+        self.handled.append((key, notification))
+
+
+def _coalescer(
+    handler: Handler, debounce_secs: float = 0.05, max_pending: int = 100
+) -> NotificationCoalescer[Any]:
+    return NotificationCoalescer(
+        "test",
+        handler,
+        lambda old, new: [*old, *new],
+        NotificationCoalescingSettings(
+            debounce_secs=debounce_secs, max_pending=max_pending
+        ),
+    )
+
+
+@pytest.mark.anyio
+async def test_notifications_within_the_window_are_merged() -> None:
+    handler = Handler()
+    coalescer = _coalescer(handler)
+
+    await coalescer.submit("a", [1])
+    await coalescer.submit("b", [1])
+    await coalescer.submit("a", [2])
+    await coalescer.submit("a", [3])
+    assert handler.handled == []
+
+    await asyncio.sleep(0.1)
+    assert sorted(handler.handled) == [("a", [1, 2, 3]), ("b", [1])]
+
+    # A new window is opened after the previous one closed
+    await coalescer.submit("a", [4])
+    await asyncio.sleep(0.1)
+    assert handler.handled[-1] == ("a", [4])
+
+
+@pytest.mark.anyio
+async def test_windows_of_a_key_are_handled_in_order() -> None:
+    # Slower than the window, so the second window closes while the first
+    # one is still being handled
+    handler = Handler(delay=0.1)
+    coalescer = _coalescer(handler, debounce_secs=0.01)
+
+    await coalescer.submit("a", [1])
+    await asyncio.sleep(0.02)
+    await coalescer.submit("a", [2])
+    await asyncio.sleep(0.02)
+    await coalescer.submit("a", [3])
+
+    await asyncio.sleep(0.4)
+    assert handler.handled == [("a", [1]), ("a", [2, 3])]
+
+
+@pytest.mark.anyio
+async def test_notifications_are_not_delayed_when_too_many_keys_are_pending() -> None:
+    handler = Handler()
+    coalescer = _coalescer(handler, max_pending=1)
+
+    await coalescer.submit("a", [1])
+    await coalescer.submit("b", [1])
+    assert handler.handled == [("b", [1])]
+
+    # Still merged into the pending window of its key
+    await coalescer.submit("a", [2])
+    await asyncio.sleep(0.1)
+    assert handler.handled == [("b", [1]), ("a", [1, 2])]
+
+
+@pytest.mark.anyio
+async def test_undelayed_notifications_wait_for_the_earlier_windows() -> None:
+    handler = Handler(delay=0.05)
+    coalescer = _coalescer(handler, debounce_secs=0.01, max_pending=1)
+
+    await coalescer.submit("a", [1])
+    await asyncio.sleep(0.03)
+    # The window of "a" is still being handled and "b" takes the only slot
+    await coalescer.submit("b", [1])
+    await coalescer.submit("a", [2])
+
+    assert handler.handled == [("a", [1]), ("b", [1]), ("a", [2])]
+
+
+@pytest.mark.anyio
+async def test_close_handles_the_pending_notifications() -> None:
+    handler = Handler()
+    coalescer = _coalescer(handler, debounce_secs=60)
+
+    await coalescer.submit("a", [1])
+    await coalescer.submit("a", [2])
+    await coalescer.submit("b", [1])
+
+    await asyncio.wait_for(coalescer.close(), 1)
+    assert sorted(handler.handled) == [("a", [1, 2]), ("b", [1])]
+
+    # The coalescer can be used again afterwards
+    await coalescer.submit("a", [3])
+    await coalescer.close()
+    assert handler.handled[-1] == ("a", [3])
+
+
+@pytest.mark.anyio
+async def test_notifications_are_handled_right_away_without_a_window() -> None:
+    handler = Handler()
+    coalescer = _coalescer(handler, debounce_secs=0)
+
+    await coalescer.submit("a", [1])
+    await coalescer.submit("a", [2])
+    assert handler.handled == [("a", [1]), ("a", [2])]
+
+
+def _notification(*reports: dict[str, Any]) -> MonitoringNotification:
+    return MonitoringNotification.model_validate(
+        {
+            "subscription": "http://nef/subscriptions/1",
+            "monitoringEventReports": list(reports),
+        }
+    )
+
+
+_data = {
+    "monitoringType": MonitoringType.UE_REACHABILITY,
+    "reachabilityType": ReachabilityType.DATA,
+}
+_sms = {
+    "monitoringType": MonitoringType.UE_REACHABILITY,
+    "reachabilityType": ReachabilityType.SMS,
+}
+_loss = {"monitoringType": MonitoringType.LOSS_OF_CONNECTIVITY}
+
+
+def _reports(notification: MonitoringNotification) -> list[dict[str, Any]]:
+    return [
+        report.model_dump(exclude_unset=True)
+        for report in notification.monitoringEventReports or []
+    ]
+
+
+def test_reachability_keeps_the_reports_after_the_last_loss() -> None:
+    merged = reachability_callbacks._merge_notifications(
+        _notification(_sms, _loss), _notification(_data, _loss, _sms, _data)
+    )
+    assert _reports(merged) == [_sms, _data]
+
+
+def test_reachability_keeps_a_trailing_loss_alone() -> None:
+    merged = reachability_callbacks._merge_notifications(
+        _notification(_data, _sms), _notification(_loss)
+    )
+    assert _reports(merged) == [_loss]
+
+
+def test_reachability_keeps_the_last_report_of_each_type() -> None:
+    merged = reachability_callbacks._merge_notifications(
+        _notification(_sms, _data), _notification(_sms)
+    )
+    assert _reports(merged) == [_data, _sms]
+
+
+def _roaming(roaming: bool, mcc: int = 214) -> dict[str, Any]:
+    return {
+        "monitoringType": MonitoringType.ROAMING_STATUS,
+        "roamingStatus": roaming,
+        "plmnId": {"mcc": mcc, "mnc": 1},
+    }
+
+
+def test_roaming_keeps_the_last_roaming_report() -> None:
+    merged = roaming_callbacks._merge_notifications(
+        _notification(_roaming(True)),
+        _notification(_roaming(False, 268), _loss),
+    )
+    assert _reports(merged) == [_roaming(False, 268)]
+
+    merged = roaming_callbacks._merge_notifications(
+        _notification(_roaming(True)), _notification(_loss)
+    )
+    assert _reports(merged) == [_roaming(True)]
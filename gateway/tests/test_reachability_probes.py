@@ -0,0 +1,108 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+
+# The drivers import the standing monitors, which must not be imported first
+import app.drivers  # noqa: F401
+from app.drivers.reachability_status.nef.impl import (
+    NefReachabilityStatusInterface,
+    _ConnectivityStatus,
+)
+from app.schemas.device import Device
+from app.schemas.nef_schemas.monitoringevent import ReachabilityType
+from app.settings import NefReachabilityStatusSettings
+
+_settings = NefReachabilityStatusSettings.model_validate(
+    {
+        "nef": {
+            "url": "http://nef",
+            "base_path": "/nef/api/v1",
+            "gateway_af_id": "gateway",
+            "gateway_notification_url": "http://gateway",
+            "username": "admin",
+            "password": "admin",
+        },
+        "probe_timeout_secs": 0.05,
+    }
+)
+
+_device = Device.model_validate({"phoneNumber": "+351911111111"})
+
+
+class SlowNef:
+    """
+    Creates the one-shot subscriptions after `delay`, as when no report is
+    available for the device.
+    """
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.created: list[str] = []
+        self.deleted: list[str] = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "DELETE":
+            self.deleted.append(str(request.url))
+            return httpx.Response(204)
+
+        await asyncio.sleep(self.delay)
+
+        body = json.loads(request.content)
+        body["self"] = f"http://nef/subscriptions/{len(self.created)}"
+        self.created.append(body["self"])
+        return httpx.Response(201, json=body)
+
+
+def _driver(nef: SlowNef) -> NefReachabilityStatusInterface:
+    driver = NefReachabilityStatusInterface(_settings, "http://gateway")
+    driver.httpx_client = httpx.AsyncClient(
+        base_url="http://nef", transport=httpx.MockTransport(nef.handle)
+    )
+    return driver
+
+
+async def _settle() -> None:
+    # Lets the shielded request and the deletion it schedules finish
+    await asyncio.sleep(0.2)
+
+
+@pytest.mark.anyio
+async def test_probe_deletes_its_subscription(redis) -> None:
+    nef = SlowNef(delay=0)
+    driver = _driver(nef)
+
+    status = await driver._probe(_device, ReachabilityType.DATA)
+    assert status == _ConnectivityStatus.Unknown
+
+    await _settle()
+    assert nef.deleted == nef.created and len(nef.created) == 1
+
+
+@pytest.mark.anyio
+async def test_timed_out_probe_deletes_its_subscription(redis) -> None:
+    nef = SlowNef(delay=0.1)
+    driver = _driver(nef)
+
+    status = await driver._probe(_device, ReachabilityType.DATA)
+    assert status == _ConnectivityStatus.Unknown
+    assert nef.created == []
+
+    await _settle()
+    assert nef.deleted == nef.created and len(nef.created) == 1
+
+
+@pytest.mark.anyio
+async def test_cancelled_probe_deletes_its_subscription(redis) -> None:
+    nef = SlowNef(delay=0.05)
+    driver = _driver(nef)
+
+    probe = asyncio.create_task(driver._probe(_device, ReachabilityType.SMS))
+    await asyncio.sleep(0.01)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    await _settle()
+    assert nef.deleted == nef.created and len(nef.created) == 1
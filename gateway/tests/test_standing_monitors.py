@@ -0,0 +1,244 @@
+import json
+import asyncio
+import time
+from typing import Any
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+# The drivers import the standing monitors, which must not be imported first
+import app.drivers  # noqa: F401
+from app.schemas.nef_schemas.monitoringevent import (
+    MonitoringEventSubscription,
+    MonitoringNotification,
+    MonitoringType,
+)
+from app.drivers.standing_monitors import lifespan
+from app.settings import NEFSettings, StandingMonitorsSettings, settings
+from app.utils import standing_monitors
+from app.utils.standing_monitors import StandingMonitors, StandingReport
+
+_nef_settings = NEFSettings.model_validate(
+    {
+        "url": "http://nef",
+        "base_path": "/nef/api/v1",
+        "gateway_af_id": "gateway",
+        "gateway_notification_url": "http://gateway",
+        "username": "admin",
+        "password": "admin",
+    }
+)
+
+_subscription = MonitoringEventSubscription.model_validate(
+    {
+        "msisdn": "351911111111",
+        "monitoringType": MonitoringType.ROAMING_STATUS,
+        "notificationDestination": "https://0.0.0.0",
+        "maximumNumberOfReports": 1,
+    }
+)
+
+
+class FakeNef:
+    def __init__(self) -> None:
+        self.requests: list[httpx.Request] = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+
+        if request.method == "POST":
+            body = json.loads(request.content)
+            body["self"] = f"http://nef/subscriptions/{len(self.requests)}"
+            return httpx.Response(201, json=body)
+
+        return httpx.Response(204)
+
+    def created(self) -> list[dict]:
+        return [json.loads(r.content) for r in self.requests if r.method == "POST"]
+
+    def deleted(self) -> list[str]:
+        return [str(r.url) for r in self.requests if r.method == "DELETE"]
+
+
+def _monitors(kind: str, nef: FakeNef, **kwargs: Any) -> StandingMonitors:
+    monitors = StandingMonitors(
+        kind,
+        _nef_settings,
+        "/subscriptions",
+        StandingMonitorsSettings(enabled=True, hot_queries=3, idle_secs=60, **kwargs),
+    )
+    monitors.httpx_client = httpx.AsyncClient(
+        base_url="http://nef", transport=httpx.MockTransport(nef.handle)
+    )
+    return monitors
+
+
+async def _promote(monitors: StandingMonitors, device_key: str) -> str:
+    for _ in range(monitors.settings.hot_queries):
+        assert await monitors.lookup(device_key, _subscription) is None
+
+    await monitors._starting[device_key]
+
+    monitor_id = await monitors.redis.get(monitors._monitor_key(device_key))
+    assert monitor_id is not None
+    return str(monitor_id)
+
+
+def _notification(roaming: bool) -> MonitoringNotification:
+    return MonitoringNotification.model_validate(
+        {
+            "subscription": "http://nef/subscriptions/1",
+            "monitoringEventReports": [
+                {"monitoringType": "ROAMING_STATUS", "roamingStatus": roaming}
+            ],
+        }
+    )
+
+
+@pytest.mark.anyio
+async def test_hot_device_gets_a_monitor(redis) -> None:
+    nef = FakeNef()
+    monitors = _monitors("test_hot", nef)
+
+    for _ in range(monitors.settings.hot_queries - 1):
+        assert await monitors.lookup("msisdn:+351911111111", _subscription) is None
+    assert monitors._starting == {}
+
+    monitor_id = await _promote(monitors, "msisdn:+351911111111")
+
+    [created] = nef.created()
+    assert created["immediateRep"] is True
+    assert "maximumNumberOfReports" not in created
+    assert created["notificationDestination"].endswith(
+        f"/callbacks/v1/monitors/test_hot/{monitor_id}"
+    )
+
+    # Other devices aren't hot
+    assert await monitors.lookup("msisdn:+351922222222", _subscription) is None
+    assert len(nef.created()) == 1
+
+
+@pytest.mark.anyio
+async def test_lookup_returns_the_last_report(redis) -> None:
+    nef = FakeNef()
+    monitors = _monitors("test_report", nef)
+    monitor_id = await _promote(monitors, "msisdn:+351911111111")
+
+    # No report yet
+    assert await monitors.lookup("msisdn:+351911111111", _subscription) is None
+
+    await monitors.store_reports(monitor_id, _notification(False))
+    await monitors.store_reports(monitor_id, _notification(True))
+
+    standing = await monitors.lookup("msisdn:+351911111111", _subscription)
+    assert standing is not None
+    assert standing.report.roamingStatus is True
+    assert standing.received_at <= datetime.now(timezone.utc)
+    assert len(nef.created()) == 1
+
+
+@pytest.mark.anyio
+async def test_old_reports_are_not_used(redis) -> None:
+    nef = FakeNef()
+    monitors = _monitors("test_old_report", nef, max_report_age_secs=60)
+    monitor_id = await _promote(monitors, "msisdn:+351911111111")
+    await monitors.store_reports(monitor_id, _notification(True))
+
+    report_key = f"standing_monitor_report:{monitor_id}"
+    standing = StandingReport.model_validate_json(await redis.get(report_key))
+    standing.received_at -= timedelta(seconds=120)
+    await redis.set(report_key, standing.model_dump_json())
+
+    # Answered by the NEF instead
+    assert await monitors.lookup("msisdn:+351911111111", _subscription) is None
+
+
+@pytest.mark.anyio
+async def test_report_for_unknown_monitor_deletes_the_subscription(redis) -> None:
+    nef = FakeNef()
+    monitors = _monitors("test_unknown", nef)
+
+    await monitors.store_reports("unknown", _notification(True))
+    # The deletion runs in the background
+    await asyncio.sleep(0.01)
+
+    assert await redis.keys("standing_monitor_report:*") == []
+    assert "http://nef/subscriptions/1" in nef.deleted()
+
+
+@pytest.mark.anyio
+async def test_idle_monitors_are_retired(redis) -> None:
+    nef = FakeNef()
+    monitors = _monitors("test_retire", nef)
+    idle_id = await _promote(monitors, "msisdn:+351911111111")
+    used_id = await _promote(monitors, "msisdn:+351922222222")
+    await monitors.store_reports(idle_id, _notification(True))
+
+    await redis.zadd(monitors.last_used_key, {idle_id: time.time() - 120})
+    await monitors.retire_idle()
+
+    assert nef.deleted() == ["http://nef/subscriptions/1"]
+    assert await redis.get(monitors._monitor_key("msisdn:+351911111111")) is None
+    assert await redis.get(f"standing_monitor_report:{idle_id}") is None
+    assert await redis.zscore(monitors.last_used_key, used_id) is not None
+
+    # A device queried again after being retired gets a new monitor
+    await _promote(monitors, "msisdn:+351911111111")
+    assert len(nef.created()) == 3
+
+
+@pytest.mark.anyio
+async def test_one_replica_retires_the_monitors(redis) -> None:
+    nef = FakeNef()
+    replica = _monitors("test_lease", nef)
+    other = _monitors("test_lease", nef)
+
+    assert await replica._retire_lease.acquire()
+    assert not await other._retire_lease.acquire()
+    # Renewed by its holder
+    assert await replica._retire_lease.acquire()
+
+    await replica._retire_lease.release()
+    assert await other._retire_lease.acquire()
+
+
+@pytest.mark.anyio
+async def test_monitor_torn_down_meanwhile_is_retired(
+    redis, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    nef = FakeNef()
+    monitors = _monitors("test_torn_down", nef)
+    monitor_id = await _promote(monitors, "msisdn:+351911111111")
+    await monitors.store_reports(monitor_id, _notification(True))
+
+    locked: list[str] = []
+
+    class RecordingLock(standing_monitors.RedisLock):
+        def __init__(self, name: str, *args: Any) -> None:
+            super().__init__(name, *args)
+            locked.append(name)
+
+    monkeypatch.setattr(standing_monitors, "RedisLock", RecordingLock)
+
+    await redis.delete(f"standing_monitor_device:{monitor_id}")
+    await redis.zadd(monitors.last_used_key, {monitor_id: time.time() - 120})
+    await monitors.retire_idle()
+
+    assert nef.deleted() == ["http://nef/subscriptions/1"]
+    assert await redis.get(f"standing_monitor_report:{monitor_id}") is None
+    # There's no device whose monitor to lock
+    assert locked == []
+
+
+@pytest.mark.anyio
+async def test_monitors_are_not_retired_when_disabled(
+    redis, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings.standing_monitors, "enabled", False)
+    nef = FakeNef()
+    _monitors("test_disabled", nef)
+
+    async with lifespan(None):  # type: ignore [arg-type]
+        await asyncio.sleep(0.05)
+        assert await redis.keys("lease:*") == []
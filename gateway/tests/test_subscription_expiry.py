@@ -0,0 +1,256 @@
+import asyncio
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic import TypeAdapter, ValidationError
+
+from app.schemas.device import Device
+from app.schemas.roaming_status import (
+    CloudEventData,
+    CreateSubscriptionDetail,
+    NotificationEventType,
+    Subscription,
+    SubscriptionEventType,
+    SubscriptionRequest,
+    SubscriptionTypeAdapter,
+)
+from app.schemas.subscriptions import SubscriptionStatus, TerminationReason
+from app.settings import SubscriptionsSettings, settings
+from app.utils.subscription_driver_redis import SubscriptionDriverRedis
+
+
+class Driver(
+    SubscriptionDriverRedis[
+        SubscriptionEventType,
+        CreateSubscriptionDetail,
+        NotificationEventType,
+        CloudEventData,
+    ]
+):
+    def __init__(self) -> None:
+        super().__init__("test", "test_expiry", SubscriptionTypeAdapter)
+
+        self.deleted: list[str] = []
+        self.failing: set[str] = set()
+
+    def get_subscription_device(
+        self, details: CreateSubscriptionDetail
+    ) -> Optional[Device]:
+        return details.device
+
+    def set_subscription_device(
+        self, details: CreateSubscriptionDetail, device: Device
+    ) -> None:
+        details.device = device
+
+    async def setup_subscription(self, sub: Subscription) -> None:
+        pass
+
+    async def delete_subscription(
+        self,
+        sub_id: str,
+        *,
+        termination_reason: TerminationReason = TerminationReason.SUBSCRIPTION_DELETED,
+    ) -> None:
+        # Yields so that concurrent runs interleave
+        await asyncio.sleep(0)
+
+        if sub_id in self.failing:
+            raise RuntimeError("Failed to delete the NEF subscription")
+
+        await self.delete_gateway_subscription(sub_id, termination_reason)
+        self.deleted.append(sub_id)
+
+
+def _request(expires_in: timedelta) -> SubscriptionRequest:
+    return TypeAdapter(SubscriptionRequest).validate_python(
+        {
+            "protocol": "HTTP",
+            "sink": "http://sink/events",
+            "types": [SubscriptionEventType.v0_roaming_status],
+            "config": {
+                "subscriptionDetail": {"device": {"phoneNumber": "+351911111111"}},
+                "subscriptionExpireTime": datetime.now(timezone.utc) + expires_in,
+            },
+        }
+    )
+
+
+async def _create(driver: Driver, *expires_in: timedelta) -> list[str]:
+    subs = await driver.create_gateway_subscriptions(
+        [_request(delta) for delta in expires_in]
+    )
+    return [sub.id for sub in subs]
+
+
+async def _status(driver: Driver, sub_id: str) -> Optional[SubscriptionStatus]:
+    return (await driver.get_subscription(sub_id)).status
+
+
+@pytest.mark.anyio
+async def test_expired_subscriptions_are_deleted_in_order(
+    redis, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings.subscriptions, "expiry_batch_size", 2)
+    driver = Driver()
+
+    later, oldest, future, old = await _create(
+        driver,
+        timedelta(seconds=-10),
+        timedelta(seconds=-30),
+        timedelta(hours=1),
+        timedelta(seconds=-20),
+    )
+
+    # A full batch, there might be more to process right away
+    delay = await driver._clear_expired_subscriptions()
+    assert driver.deleted == [oldest, old]
+    assert delay == settings.subscriptions.expiry_min_tick_secs
+
+    delay = await driver._clear_expired_subscriptions()
+    assert driver.deleted == [oldest, old, later]
+    assert delay == settings.subscriptions.expiry_max_tick_secs
+
+    assert await _status(driver, later) == SubscriptionStatus.EXPIRED
+    assert await _status(driver, future) == SubscriptionStatus.ACTIVE
+    assert await redis.zrange(driver.expiry_key, 0, -1) == [future]
+
+
+@pytest.mark.anyio
+async def test_next_run_is_scheduled_at_the_next_expiry(redis) -> None:
+    driver = Driver()
+    await _create(driver, timedelta(seconds=2))
+
+    delay = await driver._clear_expired_subscriptions()
+    assert driver.deleted == []
+    assert 1 < delay <= 2
+
+
+@pytest.mark.anyio
+async def test_concurrent_drivers_delete_each_subscription_once(redis) -> None:
+    driver = Driver()
+    other = Driver()
+
+    expired = await _create(driver, *(timedelta(seconds=-i) for i in range(1, 21)))
+
+    await asyncio.gather(
+        driver._clear_expired_subscriptions(), other._clear_expired_subscriptions()
+    )
+
+    assert sorted(driver.deleted + other.deleted) == sorted(expired)
+    assert len(driver.deleted) != 0 and len(other.deleted) != 0
+
+
+@pytest.mark.anyio
+async def test_failed_deletion_is_retried(redis) -> None:
+    driver = Driver()
+    failing, expired = await _create(
+        driver, timedelta(seconds=-20), timedelta(seconds=-10)
+    )
+    expire_time = await redis.zscore(driver.expiry_key, failing)
+
+    driver.failing.add(failing)
+    with pytest.raises(RuntimeError):
+        await driver._clear_expired_subscriptions()
+
+    # Put back with its expire time, the rest of the batch is left for later
+    assert await redis.zscore(driver.expiry_key, failing) == expire_time
+    assert await _status(driver, failing) == SubscriptionStatus.ACTIVE
+
+    driver.failing.clear()
+    await driver._clear_expired_subscriptions()
+
+    assert driver.deleted == [failing, expired]
+    assert await redis.zcard(driver.expiry_key) == 0
+
+
+async def _wait_for_lease(driver: Driver, timeout: float = 1) -> bool:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not driver._expiry_lease.held:
+        if asyncio.get_running_loop().time() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+
+    return True
+
+
+@pytest.mark.anyio
+async def test_lease_is_handed_over_on_shutdown(
+    redis, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings.subscriptions, "expiry_max_tick_secs", 0.05)
+    holder = Driver()
+    other = Driver()
+
+    holder_task = asyncio.create_task(holder.clear_loop())
+    assert await _wait_for_lease(holder)
+
+    other_task = asyncio.create_task(other.clear_loop())
+    await asyncio.sleep(0.2)
+    assert not other._expiry_lease.held
+
+    # Expired subscriptions are only processed by the holder
+    (expired,) = await _create(holder, timedelta(seconds=-1))
+    await asyncio.sleep(0.2)
+    assert holder.deleted == [expired] and other.deleted == []
+
+    holder_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await holder_task
+
+    # Taken over well before the lease would expire on its own
+    assert await _wait_for_lease(other, timeout=0.5)
+
+    other_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await other_task
+    assert await redis.keys("lease:*") == []
+
+
+@pytest.mark.anyio
+async def test_holder_is_woken_up_by_subscriptions_of_other_replicas(
+    redis, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings.subscriptions, "expiry_max_tick_secs", 60)
+    holder = Driver()
+    other = Driver()
+
+    holder_task = asyncio.create_task(holder.clear_loop())
+    assert await _wait_for_lease(holder)
+    await asyncio.sleep(0.1)
+
+    # Created by a replica not holding the lease, well before the next tick
+    (expired,) = await _create(other, timedelta(seconds=-1))
+    deadline = asyncio.get_running_loop().time() + 1
+    while holder.deleted == [] and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.01)
+    assert holder.deleted == [expired]
+
+    holder_task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await holder_task
+
+
+@pytest.mark.anyio
+async def test_lease_expires_when_the_holder_stops(
+    redis, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings.subscriptions, "expiry_lease_secs", 0.2)
+    crashed = Driver()
+    other = Driver()
+
+    assert await crashed._expiry_lease.acquire()
+    assert not await other._expiry_lease.acquire()
+
+    # The holder stopped renewing the lease without releasing it
+    await asyncio.sleep(0.3)
+    assert await other._expiry_lease.acquire()
+    assert not await crashed._expiry_lease.acquire()
+
+
+def test_lease_must_outlive_the_tick() -> None:
+    SubscriptionsSettings(expiry_max_tick_secs=5, expiry_lease_secs=6)
+
+    with pytest.raises(ValidationError, match="expiry_lease_secs"):
+        SubscriptionsSettings(expiry_max_tick_secs=5, expiry_lease_secs=5)
@@ -0,0 +1,230 @@
+import json
+import asyncio
+from typing import Any, Callable
+from collections import defaultdict
+
+import httpx
+import pytest
+
+from app.settings import CallbacksSettings
+from app.utils.http_clients import OutboundClients
+from app.utils.webhook_delivery import WebhookDelivery
+
+
+class FakeSinks:
+    """
+    Applications receiving events, every sink answers with the next status of
+    its `statuses` and with 200 once there are none left. Requests are held
+    while `open` isn't set.
+    """
+
+    def __init__(self) -> None:
+        self.received: dict[str, list[Any]] = defaultdict(list)
+        self.attempts: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, list[int]] = defaultdict(list)
+
+        self.open = asyncio.Event()
+        self.open.set()
+
+        self.in_flight: dict[str, int] = defaultdict(int)
+        self.max_in_flight: dict[str, int] = defaultdict(int)
+        self.max_total_in_flight = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        sink = str(request.url)
+        self.attempts[sink].append(asyncio.get_running_loop().time())
+
+        self.in_flight[sink] += 1
+        self.max_in_flight[sink] = max(self.max_in_flight[sink], self.in_flight[sink])
+        self.max_total_in_flight = max(
+            self.max_total_in_flight, sum(self.in_flight.values())
+        )
+        try:
+            await self.open.wait()
+        finally:
+            self.in_flight[sink] -= 1
+
+        statuses = self.statuses[sink]
+        status = statuses.pop(0) if len(statuses) != 0 else 200
+        if status == 200:
+            self.received[sink].append(json.loads(request.content))
+
+        return httpx.Response(status)
+
+
+class FakeClients(OutboundClients):
+    def __init__(self, callbacks_settings: CallbacksSettings, sinks: FakeSinks) -> None:
+        super().__init__(callbacks_settings)
+
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(sinks.handler))
+
+    def client_for(self, url: str) -> httpx.AsyncClient:
+        return self.client
+
+
+def _delivery(sinks: FakeSinks, **kwargs: Any) -> WebhookDelivery:
+    callbacks_settings = CallbacksSettings.model_validate(
+        {"retry_backoff_secs": 0.01, "shutdown_timeout_secs": 1, **kwargs}
+    )
+    return WebhookDelivery(callbacks_settings, FakeClients(callbacks_settings, sinks))
+
+
+async def _until(condition: Callable[[], bool], timeout: float = 1) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+async def _dead_letters(redis: Any) -> list[dict[str, Any]]:
+    return [
+        json.loads(entry) for entry in await redis.lrange("webhook_dead_letter", 0, -1)
+    ]
+
+
+@pytest.mark.anyio
+async def test_events_are_delivered_to_their_sinks(redis) -> None:
+    sinks = FakeSinks()
+    delivery = _delivery(sinks)
+
+    for i in range(10):
+        await delivery.deliver("http://a/events", {"n": i})
+    await delivery.deliver("http://b/events", {"n": 0})
+
+    await delivery.close()
+
+    assert sorted(e["n"] for e in sinks.received["http://a/events"]) == list(range(10))
+    assert sinks.received["http://b/events"] == [{"n": 0}]
+    assert delivery.stats.enqueued == delivery.stats.delivered == 11
+    assert await _dead_letters(redis) == []
+
+
+@pytest.mark.anyio
+async def test_full_queue_only_affects_its_sink(redis) -> None:
+    sinks = FakeSinks()
+    delivery = _delivery(
+        sinks, queue_size=2, workers_per_sink=1, enqueue_timeout_secs=0.05
+    )
+    sinks.open.clear()
+
+    # One being delivered and two waiting in the queue
+    for i in range(3):
+        await delivery.deliver("http://slow/events", {"n": i})
+        await _until(lambda: sinks.in_flight["http://slow/events"] == 1)
+    assert delivery.queue_depths() == {"http://slow/events": 2}
+
+    await delivery.deliver("http://slow/events", {"n": 3})
+    (dead,) = await _dead_letters(redis)
+    assert dead["sink"] == "http://slow/events"
+    assert dead["payload"] == {"n": 3}
+    assert dead["reason"] == "Delivery queue full"
+
+    # Other sinks get their own queue
+    await delivery.deliver("http://fast/events", {"n": 0})
+    assert delivery.queue_depths()["http://fast/events"] == 1
+
+    sinks.open.set()
+    await delivery.close()
+
+    assert [e["n"] for e in sinks.received["http://slow/events"]] == [0, 1, 2]
+    assert sinks.received["http://fast/events"] == [{"n": 0}]
+    assert delivery.stats.dead_lettered == 1
+
+
+@pytest.mark.anyio
+async def test_concurrent_deliveries_are_bounded(redis) -> None:
+    sinks = FakeSinks()
+    delivery = _delivery(sinks, workers_per_sink=3, max_in_flight=4)
+    sinks.open.clear()
+
+    for sink in ("http://a/events", "http://b/events", "http://c/events"):
+        for i in range(5):
+            await delivery.deliver(sink, {"n": i})
+
+    await _until(lambda: sum(sinks.in_flight.values()) == 4)
+    await asyncio.sleep(0.05)
+    assert sum(sinks.in_flight.values()) == 4
+
+    sinks.open.set()
+    await delivery.close()
+
+    assert sinks.max_total_in_flight == 4
+    assert max(sinks.max_in_flight.values()) <= 3
+    assert delivery.stats.delivered == 15
+
+
+@pytest.mark.anyio
+async def test_failed_deliveries_are_retried_with_backoff(redis) -> None:
+    sinks = FakeSinks()
+    delivery = _delivery(sinks, max_retries=3)
+    sinks.statuses["http://a/events"] = [503, 429, 500]
+
+    await delivery.deliver("http://a/events", {"n": 0})
+    await delivery.close()
+
+    assert sinks.received["http://a/events"] == [{"n": 0}]
+    assert delivery.stats.retried == 3
+    assert delivery.stats.delivered == 1
+
+    # The delay doubles on each retry, with up to half of it taken off
+    attempts = sinks.attempts["http://a/events"]
+    assert len(attempts) == 4
+    for i, (previous, attempt) in enumerate(zip(attempts, attempts[1:])):
+        assert attempt - previous >= 0.01 * 2**i / 2
+
+
+@pytest.mark.anyio
+async def test_undeliverable_events_are_dead_lettered(redis) -> None:
+    sinks = FakeSinks()
+    delivery = _delivery(sinks, max_retries=2)
+    sinks.statuses["http://down/events"] = [500, 502, 503]
+    sinks.statuses["http://invalid/events"] = [400]
+
+    await delivery.deliver("http://down/events", {"n": 0})
+    await delivery.deliver("http://invalid/events", {"n": 1})
+    await delivery.close()
+
+    dead = sorted(await _dead_letters(redis), key=lambda e: e["sink"])
+    assert [(e["sink"], e["payload"], e["reason"]) for e in dead] == [
+        ("http://down/events", {"n": 0}, "Sink responded with status 503"),
+        ("http://invalid/events", {"n": 1}, "Sink responded with status 400"),
+    ]
+
+    # Client errors aren't retried
+    assert len(sinks.attempts["http://down/events"]) == 3
+    assert len(sinks.attempts["http://invalid/events"]) == 1
+    assert delivery.stats.dead_lettered == 2
+
+
+@pytest.mark.anyio
+async def test_dead_letters_are_trimmed(redis) -> None:
+    sinks = FakeSinks()
+    delivery = _delivery(sinks, max_retries=0, dead_letter_max_length=2)
+    sinks.statuses["http://invalid/events"] = [400, 400, 400]
+
+    for i in range(3):
+        await delivery.deliver("http://invalid/events", {"n": i})
+        await _until(lambda: delivery.stats.dead_lettered == i + 1)
+
+    # The most recent first
+    assert [e["payload"] for e in await _dead_letters(redis)] == [{"n": 2}, {"n": 1}]
+
+
+@pytest.mark.anyio
+async def test_undelivered_events_are_dead_lettered_on_shutdown(redis) -> None:
+    sinks = FakeSinks()
+    delivery = _delivery(sinks, workers_per_sink=1, shutdown_timeout_secs=0.05)
+    sinks.open.clear()
+
+    await delivery.deliver("http://a/events", {"n": 0})
+    await delivery.deliver("http://a/events", {"n": 1})
+    await delivery.close()
+
+    await delivery.deliver("http://a/events", {"n": 2})
+
+    # The event being delivered is dead lettered by its cancelled worker
+    await _until(lambda: delivery.stats.dead_lettered == 3)
+    dead = await _dead_letters(redis)
+    assert sorted(e["payload"]["n"] for e in dead) == [0, 1, 2]
+    assert {e["reason"] for e in dead} == {"Gateway shutting down"}
+    assert delivery.queue_depths() == {}